@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, send_file, make_response, send_from_directory
+from flask import Flask, Response, render_template, request, send_file, make_response, send_from_directory
 import os
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageOps, ImageFilter
 from PIL.ExifTags import TAGS
@@ -11,7 +11,7 @@ import traceback
 from functools import wraps
 import re
 import os
-import cv2
+import types
 import numpy as np
 from skimage import exposure
 import piexif
@@ -26,6 +26,14 @@ import piexif
 # Import configuration
 # Import configuration
 from config import config
+from image_utils import (
+    open_image_for_size,
+    open_image_checked,
+    load_image_safe,
+    oriented_size,
+    decode_stats,
+    ImageTooLarge
+)
 
 # Import email service for unified email sending (SMTP or Brevo)
 from email_service import send_verification_email, send_password_reset_email
@@ -34,16 +42,18 @@ from email_service import send_verification_email, send_password_reset_email
 from auth import (
     get_supabase_client,
     verify_jwt_token,
+    invalidate_token,
     require_auth,
     require_credits,
     optional_auth,
     get_auth_token,
     allow_guest_access
 )
-from auth.supabase_client import supabase_admin
+from auth.supabase_client import supabase_admin, verified_token_cache
 from credits import (
     credit_manager,
     get_tool_cost,
+    get_charged_cost,
     get_all_tools
 )
 from payments import (
@@ -54,7 +64,49 @@ from payments import (
     CREDIT_PLANS
 )
 from streak.utils import StreakManager
-from flask import jsonify, redirect, current_app
+from processing import (
+    model_registry,
+    run_filter_pipeline,
+    grain_is_random,
+    filter_stage_stats,
+    color_lut_engine,
+    FILTER_PRESETS,
+    image_executor,
+    InlineExecutor,
+    ExecutorError,
+    ExecutorBusy,
+    TaskTimeout,
+    apply_upscale_enhancements,
+    enhance_upscaled,
+    collage_slot_box,
+    create_template_collage,
+    job_manager,
+    JobQueueFull,
+    result_cache,
+    memory_budget,
+    estimate_peak_bytes,
+    AdmissionRejected,
+    expand_uploads,
+    stream_batch_zip,
+    image_handles,
+    read_streaming_upload,
+    OutputBuffer,
+    output_buffer,
+    proxy_boxes,
+    luma_proxy,
+    encoded_ssim,
+    quantize_image,
+    DITHER_MODES,
+    png_optimizer,
+    save_png,
+    STRIP_MODES,
+    render_strips,
+    encode_strips,
+    stream_png_strips,
+    strip_height_for
+)
+from flask import jsonify, redirect, current_app, g, has_app_context
+from werkzeug.datastructures import FileStorage, MultiDict
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -150,6 +202,170 @@ def log_request(func):
     
     return wrapper
 
+# ============================================================================
+# MEMORY ADMISSION CONTROL
+# ============================================================================
+
+def uploaded_image_headers():
+    """
+    Read (size, mode) of every uploaded image from its header only
+    
+    Files that are not images are skipped; the endpoint reports those itself.
+    
+    Raises:
+        ImageTooLarge if an image is over the configured pixel budget
+    """
+    headers = []
+    for file in request.files.values():
+        try:
+            img = open_image_checked(file)
+            headers.append((img.size, img.mode))
+        except ImageTooLarge:
+            raise
+        except Exception:
+            pass
+        finally:
+            file.stream.seek(0)
+    return headers
+
+
+def image_too_large_response(error):
+    """413 response for an upload whose header is over the pixel budget"""
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'reason': 'too_many_pixels'
+    }), 413
+
+
+def admission_rejected_response(error):
+    """503 response for a request the memory budget cannot take"""
+    response = make_response(jsonify({
+        'success': False,
+        'error': str(error),
+        'reason': 'too_large' if error.never_fits else 'busy'
+    }), 503)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def executor_error_response(error):
+    """
+    Response for a task the image executor could not run
+    
+    A full queue or a task that timed out is transient, so the client gets
+    a 503 with Retry-After as for admission rejections. A crashed worker or
+    a failed task is a 500.
+    """
+    logger.error(f"[EXECUTOR] {type(error).__name__}: {error}")
+    if isinstance(error, (ExecutorBusy, TaskTimeout)):
+        response = make_response(jsonify({
+            'success': False,
+            'error': str(error),
+            'reason': 'busy' if isinstance(error, ExecutorBusy) else 'timeout'
+        }), 503)
+        response.headers['Retry-After'] = str(config.ADMISSION_RETRY_AFTER_SECONDS)
+        return response
+    return jsonify({'success': False, 'error': str(error)}), 500
+
+
+def refund_credits(user_id, credits, reason):
+    """
+    Give back credits deducted for work that did not produce a result
+    
+    Args:
+        user_id: User UUID
+        credits: Credits to return (nothing happens for 0)
+        reason: Short description for the log
+    
+    Returns:
+        True if the credits were returned
+    """
+    if credits <= 0:
+        return True
+    result = credit_manager.add_credits(user_id, credits)
+    if result['success']:
+        logger.info(f"[CREDITS] Refunded {credits} credits to {user_id}: {reason}")
+        return True
+    logger.error(f"[CREDITS] Could not refund {credits} credits to {user_id} ({reason}): {result.get('error')}")
+    return False
+
+
+def admission_control(tool):
+    """
+    Decorator that reserves the request's estimated peak memory before running it
+    
+    The estimate comes from the uploaded image headers and form values, so it
+    is taken before any pixels are decoded and before credits are deducted.
+    Streamed uploads reserved an estimate when their header arrived; that
+    reservation is kept and only the remainder of the full estimate is added.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                headers = uploaded_image_headers()
+            except ImageTooLarge as e:
+                return image_too_large_response(e)
+            estimate = estimate_peak_bytes(tool, headers, request.form)
+            # A streamed upload already reserved memory before its decode;
+            # only the part of the estimate it does not cover is added
+            held = [g.pop('upload_reservation')] if 'upload_reservation' in g else []
+            try:
+                reservations = memory_budget.reserve_remainder(held, estimate, tool)
+            except AdmissionRejected as e:
+                return admission_rejected_response(e)
+            
+            def release():
+                for reservation in reservations:
+                    reservation.release()
+            
+            try:
+                response = func(*args, **kwargs)
+            except BaseException:
+                release()
+                raise
+            if isinstance(response, Response) and isinstance(response.response, types.GeneratorType):
+                # Streamed while encoding: the work happens as the body is sent
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        return wrapper
+    return decorator
+
+# ============================================================================
+# ENCODED OUTPUTS
+# ============================================================================
+
+def send_output(output, mimetype):
+    """
+    Response for an encoded result
+    
+    Spilled outputs are sent from their temporary file (sendfile under
+    gunicorn) with an exact Content-Length; generators are streamed while
+    they are still encoding.
+    
+    Args:
+        output: OutputBuffer, BytesIO, or a generator of encoded chunks
+        mimetype: Response mimetype
+    """
+    if isinstance(output, types.GeneratorType):
+        return Response(output, mimetype=mimetype)
+    if isinstance(output, OutputBuffer):
+        size = output.size
+        response = make_response(send_file(output.body(), mimetype=mimetype))
+        response.content_length = size
+        return response
+    return make_response(send_file(output, mimetype=mimetype))
+
+
+def cache_output(cache_key, output, mimetype, headers=None):
+    """Store an encoded result in the result cache unless it is too large to keep"""
+    if output.size > result_cache.max_entry_bytes:
+        return
+    result_cache.put(cache_key, output.getvalue(), mimetype, headers)
+
 # ============================================================================
 # CACHE CONTROL
 # ============================================================================
@@ -214,6 +430,262 @@ def enforce_canonical_domain():
 
         return redirect(canonical_url, code=301)
 
+# ============================================================================
+# STREAMING UPLOADS (DECODE WHILE THE BODY ARRIVES)
+# ============================================================================
+
+# Endpoints that decode the uploaded image at full resolution. Tools that
+# shrink it first (resize, palette, remove_bg, collage) gain more from a
+# reduced-scale decode and keep the buffered path.
+STREAMING_DECODE_ENDPOINTS = {
+    'api_compress': 'compress',
+    'api_convert': 'convert',
+    'api_crop': 'crop',
+    'api_filter': 'filter',
+    'api_upscale': 'upscale',
+    'api_pipeline': 'pipeline'
+}
+
+
+@app.before_request
+def stream_image_upload():
+    """
+    Parse the multipart body of image endpoints while it is being received
+    
+    The 'image' part is fed to an incremental decoder as it arrives: its
+    header is checked after the first few KB (413/400 before the rest is
+    read) and its pixels are decoded while the upload is still in flight.
+    The endpoint then sees the usual request.form / request.files, and
+    open_image_bytes picks up the decoded image instead of decoding again.
+    
+    As soon as the header is parsed, and before any pixels are decoded, the
+    tool's estimated peak memory is reserved from memory_budget (503 if it
+    does not fit). admission_control takes that reservation over; if the
+    request never gets there, release_upload_reservation gives it back.
+    
+    Only signed-in requests are streamed, so anonymous requests that the
+    endpoint will refuse cost no decode work.
+    """
+    if (
+        not config.STREAMING_DECODE_ENABLED
+        or request.method != 'POST'
+        or request.endpoint not in STREAMING_DECODE_ENDPOINTS
+        or request.mimetype != 'multipart/form-data'
+    ):
+        return None
+    if current_handle_owner() is None:
+        return None
+    tool = STREAMING_DECODE_ENDPOINTS[request.endpoint]
+    
+    def reserve_decode(size, mode, form):
+        # Fields sent after the image are not known yet; admission_control
+        # re-estimates with the full form
+        estimate = estimate_peak_bytes(tool, [(size, mode)], form)
+        g.upload_reservation = memory_budget.reserve(estimate, tool)
+    
+    try:
+        upload = read_streaming_upload(
+            request.stream,
+            request.content_type,
+            chunk_size=config.STREAMING_DECODE_CHUNK_KB * 1024,
+            on_header=reserve_decode
+        )
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except ValueError as e:
+        logger.warning(f"[UPLOAD] Rejected streamed upload: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    request.form = upload.form
+    request.files = upload.files
+    if upload.image is not None:
+        g.streamed_image = (upload.image_bytes, upload.image)
+    return None
+
+
+@app.teardown_request
+def release_upload_reservation(exc=None):
+    """Give back a streaming reservation that admission_control did not take over"""
+    reservation = g.pop('upload_reservation', None)
+    if reservation is not None:
+        reservation.release()
+
+
+# ============================================================================
+# IMAGE HANDLES (UPLOAD ONCE, RUN MANY TOOLS)
+# ============================================================================
+
+def current_handle_owner():
+    """User id that owns handles created or used by this request (None for guests, who cannot use handles)"""
+    token = get_auth_token()
+    if not token:
+        return None
+    try:
+        user = verify_jwt_token(token)
+    except Exception:
+        return None
+    return user['id'] if user else None
+
+
+@app.before_request
+def resolve_image_handles():
+    """
+    Let every /api/* tool take an image handle in place of a file
+    
+    A form field named '<field>_handle' (e.g. 'image_handle', 'logo_handle')
+    is replaced by the stored file as request.files['<field>'] before the
+    endpoint runs, unless a file was uploaded for that field as well.
+    """
+    if request.method != 'POST' or not request.path.startswith('/api/'):
+        return None
+    
+    handle_fields = [key for key in request.form if key.endswith('_handle')]
+    if not handle_fields:
+        return None
+    
+    owner = current_handle_owner()
+    if owner is None:
+        # Guests have no identity to bind a handle to
+        return jsonify({
+            'success': False,
+            'error': 'Sign in to use image handles',
+            'field': handle_fields[0]
+        }), 401
+    files = MultiDict(request.files)
+    for key in handle_fields:
+        field = key[:-len('_handle')]
+        if field in files:
+            continue
+        handle = image_handles.get(request.form[key], owner)
+        data = image_handles.read_bytes(handle) if handle else None
+        if data is None:
+            return jsonify({
+                'success': False,
+                'error': 'Image handle not found or expired',
+                'field': key
+            }), 404
+        files[field] = FileStorage(
+            stream=io.BytesIO(data),
+            filename=handle.filename,
+            name=field,
+            content_type=f'image/{(handle.format or "png").lower()}'
+        )
+    request.files = files
+    return None
+
+
+def response_file(response):
+    """File object behind a send_file response (Werkzeug's or the server's file wrapper), else None"""
+    body = response.response
+    return getattr(body, 'file', None) or getattr(body, 'filelike', None)
+
+
+@app.after_request
+def store_result_handle(response):
+    """
+    Keep an image result as a new handle when the request asks for it
+    
+    Results sent from a file (spooled to disk or in a BytesIO) are copied
+    into the handle in chunks and rewound for sending. Results streamed
+    while they are encoded cannot be stored without holding them in
+    memory, so the request gets an X-Image-Handle-Error header instead.
+    """
+    if (
+        request.path.startswith('/api/')
+        and request.method == 'POST'
+        and response.status_code == 200
+        and response.mimetype.startswith('image/')
+        and request.form.get('return_handle', 'false') == 'true'
+    ):
+        owner = current_handle_owner()
+        if owner is None:
+            response.headers['X-Image-Handle-Error'] = 'Sign in to keep results as handles'
+            return response
+        try:
+            source = response_file(response)
+            if source is not None:
+                position = source.tell()
+                try:
+                    handle = image_handles.put_file(owner, source, 'result')
+                finally:
+                    source.seek(position)
+            elif response.is_streamed:
+                logger.info(f"[HANDLES] Not storing a streamed result of {request.path} as a handle")
+                response.headers['X-Image-Handle-Error'] = 'Streamed results cannot be kept as handles'
+                return response
+            else:
+                handle = image_handles.put(owner, response.get_data(), 'result')
+            response.headers['X-Image-Handle'] = handle.id
+        except Exception as e:
+            logger.warning(f"[HANDLES] Could not store result handle: {str(e)}")
+    return response
+
+
+@app.route('/api/images', methods=['POST'])
+@require_auth
+@log_request
+def create_image_handle(current_user):
+    """
+    Upload an image once and get a handle to pass to the tools
+    
+    Tools accept the handle as '<field>_handle' instead of the '<field>' file.
+    Handles belong to the signed-in user who created them and expire after
+    HANDLE_TTL_SECONDS.
+    """
+    if 'image' not in request.files:
+        return jsonify({'success': False, 'error': 'No image uploaded'}), 400
+    
+    file = request.files['image']
+    try:
+        handle = image_handles.put(current_user['id'], file.read(), file.filename or 'image')
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    data = handle.to_dict()
+    data['success'] = True
+    return jsonify(data), 201
+
+
+@app.route('/api/images/<handle_id>', methods=['DELETE'])
+@require_auth
+def delete_image_handle(current_user, handle_id):
+    """Release a handle before it expires"""
+    if not image_handles.delete(handle_id, current_user['id']):
+        return jsonify({'success': False, 'error': 'Image handle not found or expired'}), 404
+    return jsonify({'success': True}), 200
+
+
+def open_image_bytes(data, **options):
+    """
+    Decode uploaded image bytes through image_utils.load_image_safe
+    
+    Bytes that were already decoded while streaming in, or that came from an
+    image handle, reuse those pixels instead of being decoded again.
+    
+    Args:
+        data: Encoded image bytes
+        **options: max_side / target_size / reducing_gap for load_image_safe
+    
+    Raises:
+        ImageTooLarge if the image is over the configured pixel budget
+    """
+    # Decoded while the upload was arriving (see stream_image_upload)
+    if has_app_context():
+        streamed = g.pop('streamed_image', None)
+        if streamed is not None and streamed[0] == data:
+            return streamed[1]
+    
+    img = image_handles.decoded(data)
+    if img is not None:
+        return img
+    img, _ = load_image_safe(data, **options)
+    return img
+
+
 # ============================================================================
 # APPLICATION STARTUP
 # ============================================================================
@@ -236,6 +708,12 @@ if config_errors:
     for error in config_errors:
         logger.warning(f"  - {error}")
 
+# Load background removal models once per worker instead of once per request
+model_registry.warm(config.REMBG_WARM_MODELS)
+
+# Bake filter preset color tables that do not depend on image statistics
+color_lut_engine.warm()
+
 
 # ============================================================================
 # AUTHENTICATION ENDPOINTS
@@ -532,6 +1010,7 @@ def auth_login():
 def auth_logout(current_user):
     """Logout user"""
     try:
+        invalidate_token(get_auth_token())
         supabase = get_supabase_client()
         supabase.auth.sign_out()
         return jsonify({'success': True, 'message': 'Logged out successfully'})
@@ -1717,6 +2196,7 @@ def newyear():
 @app.route('/api/resize', methods=['POST'])
 @allow_guest_access('resize')
 @log_request
+@admission_control('resize')
 def api_resize(current_user):
     # Resize is a FREE tool - cost is 0
     cost = 0
@@ -1726,51 +2206,26 @@ def api_resize(current_user):
         return jsonify({'success': False, 'error': 'No image uploaded'}), 400
     
     file = request.files['image']
-    mode = request.form.get('mode')
-    
-    # Define safe limits to prevent memory errors
-    MAX_DIMENSION = 10000
-    MAX_TOTAL_PIXELS = 100000000
     
     try:
-        img = Image.open(file)
-        original_size = f"{img.width}x{img.height}"
-        
-        if mode == 'pixel':
-            width = int(request.form.get('width'))
-            height = int(request.form.get('height'))
-        else:
-            scale = int(request.form.get('scale')) / 100
-            width = int(img.width * scale)
-            height = int(img.height * scale)
-        
-        # Validate dimensions
-        if width > MAX_DIMENSION or height > MAX_DIMENSION:
-            error_msg = f"Dimensions too large! Max: {MAX_DIMENSION}x{MAX_DIMENSION}"
-            return jsonify({'success': False, 'error': error_msg}), 400
-        
-        total_pixels = width * height
-        if total_pixels > MAX_TOTAL_PIXELS:
-            error_msg = f"Total pixels too large! Max: {MAX_TOTAL_PIXELS}"
-            return jsonify({'success': False, 'error': error_msg}), 400
+        data = file.read()
+        params = resize_params(request.form)
         
-        logger.info(f"Resizing image: {original_size} -> {width}x{height} (mode: {mode})")
+        cache_key = result_cache.make_key('resize', data, params)
+        cached = result_cache.get(cache_key)
         
-        # Resize
-        resized_img = img.resize((width, height), Image.Resampling.LANCZOS)
-        
-        # Save
-        img_io = io.BytesIO()
-        fmt = img.format if img.format else 'PNG'
-        
-        if fmt.upper() == 'PNG':
-            resized_img.save(img_io, fmt)
+        if cached is None:
+            try:
+                img_io, mimetype, (width, height) = resize_image(data, params)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            result_headers = {'X-Resized-Dimensions': f"{width}x{height}"}
+            cache_output(cache_key, img_io, mimetype, result_headers)
         else:
-            resized_img.save(img_io, fmt, quality=95)
-            
-        img_io.seek(0)
-        
-        logger.info(f"Resize completed successfully: {fmt} format")
+            logger.info("Resize served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mimetype = cached.mimetype
+            result_headers = cached.headers
         
         # Update streak (even for free tools)
         if current_user:  # Only if logged in
@@ -1783,9 +2238,10 @@ def api_resize(current_user):
                 logger.error(f"[STREAK] Exception: {str(e)}")
         
         # --- RESPONSE WITH HEADERS ---
-        response = make_response(send_file(img_io, mimetype=f'image/{fmt.lower()}'))
+        response = send_output(img_io, mimetype)
         response.headers['X-Credits-Cost'] = str(cost)
-        response.headers['X-Resized-Dimensions'] = f"{width}x{height}" # <--- NEW HEADER
+        response.headers['X-Resized-Dimensions'] = result_headers['X-Resized-Dimensions'] # <--- NEW HEADER
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
         return response
         
     except Exception as e:
@@ -1796,9 +2252,117 @@ def api_resize(current_user):
             'error': f"Resize operation failed: {str(e)}"
         }), 500
 
+
+def resize_params(form):
+    """Normalize the resize form fields (pixel mode uses width/height, otherwise scale)"""
+    mode = form.get('mode')
+    if mode == 'pixel':
+        return {'mode': mode, 'width': int(form.get('width')), 'height': int(form.get('height'))}
+    return {'mode': mode, 'scale': int(form.get('scale'))}
+
+
+def resize_image(data, params):
+    """
+    Resize uploaded image bytes
+    
+    The output size is worked out from the header, so large sources are
+    decoded at a reduced scale (keeping 2x the output for the final LANCZOS pass).
+    
+    Args:
+        data: Encoded image bytes
+        params: Output of resize_params
+    
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype, (width, height))
+    
+    Raises:
+        ValueError if the image or the requested size is over the limits
+    """
+    width, height = resize_target_size(oriented_size(open_image_checked(data)), params)
+    img = open_image_bytes(data, target_size=(width, height), reducing_gap=2.0)
+    resized_img = resize_pixels(img, {'mode': 'pixel', 'width': width, 'height': height})
+    
+    # Save
+    img_io = output_buffer()
+    fmt = img.format if img.format else 'PNG'
+    
+    if fmt.upper() == 'PNG':
+        resized_img.save(img_io, fmt)
+    else:
+        resized_img.save(img_io, fmt, quality=95)
+        
+    img_io.seek(0)
+    
+    logger.info(f"Resize completed successfully: {fmt} format")
+    return img_io, f'image/{fmt.lower()}', (width, height)
+
+
+def resize_target_size(size, params):
+    """
+    Output size of a resize
+    
+    Args:
+        size: Source (width, height)
+        params: Output of resize_params
+    
+    Returns:
+        (width, height)
+    
+    Raises:
+        ValueError if the requested size is over the limits
+    """
+    # Define safe limits to prevent memory errors
+    MAX_DIMENSION = 10000
+    MAX_TOTAL_PIXELS = config.MAX_PIXELS
+    
+    if params['mode'] == 'pixel':
+        width = params['width']
+        height = params['height']
+    else:
+        scale = params['scale'] / 100
+        width = int(size[0] * scale)
+        height = int(size[1] * scale)
+    
+    # Validate dimensions
+    if width > MAX_DIMENSION or height > MAX_DIMENSION:
+        raise ValueError(f"Dimensions too large! Max: {MAX_DIMENSION}x{MAX_DIMENSION}")
+    
+    total_pixels = width * height
+    if total_pixels > MAX_TOTAL_PIXELS:
+        raise ValueError(f"Total pixels too large! Max: {MAX_TOTAL_PIXELS}")
+    
+    return width, height
+
+
+def resize_pixels(img, params):
+    """
+    Resize a PIL image without encoding it
+    
+    Args:
+        img: PIL image
+        params: Output of resize_params
+    
+    Returns:
+        Resized PIL image
+    
+    Raises:
+        ValueError if the requested size is over the limits
+    """
+    width, height = resize_target_size(img.size, params)
+    
+    logger.info(f"Resizing image: {img.width}x{img.height} -> {width}x{height} (mode: {params['mode']})")
+    
+    # Shrink by a power of two first when the source is much larger than the output
+    img = open_image_for_size(img, (width, height), reducing_gap=2.0)
+    
+    # Resize
+    return img.resize((width, height), Image.Resampling.LANCZOS)
+
+
 @app.route('/api/compress', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('compress')
 def api_compress(current_user):
     # Get cost from database
     cost = get_tool_cost('compress')
@@ -1813,40 +2377,56 @@ def api_compress(current_user):
         return 'No image uploaded', 400
     
     file = request.files['image']
-    # Receive "Quality" from JS (0-100 scale where 100 is best quality)
-    quality = int(request.form.get('quality', 80))
+    # Receive "Quality" from JS (0-100 scale where 100 is best quality, or 'auto')
+    quality = request.form.get('quality', 80)
+    quality = int(quality) if quality != 'auto' else quality
     
     try:
-        img = Image.open(file)
-        fmt = img.format if img.format else 'JPEG'
-        
-        logger.info(f"Compressing image: format={fmt}, quality={quality}")
-        
-        img_io = io.BytesIO()
-        
-        if fmt.upper() in ['JPEG', 'JPG']:
-            # Prevent bloating: cap quality at 95 even if requested higher
-            save_quality = 95 if quality >= 95 else quality
-            img.save(img_io, 'JPEG', quality=save_quality, optimize=True)
-            
-        elif fmt.upper() == 'PNG':
-            # PNG Quantization logic
-            if quality < 90:
-                # Map quality (0-100) to colors (2-256)
-                n_colors = max(2, int((quality / 100) * 256))
-                img = img.quantize(colors=n_colors, method=2)
-                img.save(img_io, 'PNG', optimize=True)
+        target = compress_target_params(request.form)
+        min_ssim = compress_min_ssim(request.form)
+        if target and min_ssim is not None:
+            raise ValueError('Use either target_bytes or min_ssim, not both')
+        # Dithering for PNG palette quantization: 'none', 'ordered' or 'floyd'
+        dither = request.form.get('dither', 'none')
+        if dither not in DITHER_MODES:
+            raise ValueError(f"dither must be one of: {', '.join(DITHER_MODES)}")
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        data = file.read()
+        if min_ssim is not None:
+            cache_params = {'min_ssim': min_ssim}
+        else:
+            cache_params = dict(target or {'quality': quality}, dither=dither)
+        cache_key = result_cache.make_key('compress', data, cache_params)
+        cached = result_cache.get(cache_key)
+        
+        if cached is None:
+            result_headers = {}
+            if target:
+                img_io, mimetype, result = compress_to_target(
+                    open_image_bytes(data), target['target_bytes'], target['allow_scale'], dither=dither
+                )
+                result_headers = compress_target_headers(result)
+            elif min_ssim is not None:
+                try:
+                    img_io, mimetype, result = compress_to_similarity(open_image_bytes(data), min_ssim)
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                result_headers = {
+                    'X-Compress-Quality': str(result['quality']),
+                    'X-Compress-SSIM': f"{result['ssim']:.4f}",
+                    'X-Compress-Trials': str(result['trials'])
+                }
             else:
-                img.save(img_io, 'PNG', optimize=True)
-                
-        elif fmt.upper() == 'WEBP':
-            img.save(img_io, 'WEBP', quality=quality)
+                img_io, mimetype = compress_image(open_image_bytes(data), quality, dither)
+            cache_output(cache_key, img_io, mimetype, result_headers)
         else:
-            img.save(img_io, fmt, quality=quality)
-            
-        img_io.seek(0)
-        
-        logger.info("Compression completed successfully")
+            logger.info("Compression served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mimetype = cached.mimetype
+            result_headers = cached.headers
         
         # Update streak with detailed logging
         try:
@@ -1861,10 +2441,12 @@ def api_compress(current_user):
             logger.error(f"[STREAK] Exception during update: {str(e)}")
             logger.error(f"[STREAK] Stack trace: {traceback.format_exc()}")
         
-        response = make_response(send_file(img_io, mimetype=f'image/{fmt.lower()}'))
+        response = send_output(img_io, mimetype)
         
         # --- CRITICAL: Send Cost Header for JS Toast ---
         response.headers['X-Credits-Cost'] = str(cost) 
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
+        response.headers.update(result_headers or {})
         return response
         
     except Exception as e:
@@ -1872,62 +2454,349 @@ def api_compress(current_user):
         logger.error(traceback.format_exc())
         return str(e), 500
 
-@app.route('/api/convert', methods=['POST'])
-@allow_guest_access('convert')
-@log_request
-def api_convert(current_user):
-    # Get cost from database (even if it's 0/Free, we need to send it to frontend)
-    cost = get_tool_cost('convert')
+
+def compress_image(img, quality, dither='none'):
+    """
+    Re-encode a PIL image at a lower quality in its own format
     
-    if 'image' not in request.files:
-        logger.warning("Convert request missing image file")
-        return 'No image uploaded', 400
+    Args:
+        img: Image opened from the upload
+        quality: 0-100 (100 is best quality)
+        dither: PNG palette dithering ('none', 'ordered' or 'floyd')
     
-    file = request.files['image']
-    target_format = request.form.get('format', 'PNG').upper()
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype)
+    """
+    fmt = img.format if img.format else 'JPEG'
     
-    try:
-        img = Image.open(file)
-        source_format = img.format if img.format else 'Unknown'
-        
-        logger.info(f"Converting image: {source_format} -> {target_format}")
-        
-        # Handle mode conversions
-        if target_format in ['JPEG', 'JPG', 'BMP'] and img.mode in ['RGBA', 'LA']:
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1])
-            img = background
-        elif target_format != 'ICO' and img.mode == 'P':
-            img = img.convert('RGB')
-            
-        img_io = io.BytesIO()
-        
-        if target_format == 'ICO':
-            if img.width > 256 or img.height > 256:
-                img.thumbnail((256, 256))
-            img.save(img_io, format='ICO')
+    logger.info(f"Compressing image: format={fmt}, quality={quality}")
+    
+    img_io = encode_compressed(img, fmt, quality, dither)
+    
+    logger.info("Compression completed successfully")
+    return img_io, f'image/{fmt.lower()}'
+
+
+def encode_compressed(img, fmt, quality, dither='none'):
+    """
+    Encode a PIL image in fmt at a compress-tool quality (see compress_image)
+    
+    Returns:
+        OutputBuffer with the encoded result
+    """
+    img_io = output_buffer()
+    
+    if fmt.upper() in ['JPEG', 'JPG']:
+        # Prevent bloating: cap quality at 95 even if requested higher
+        save_quality = 95 if quality >= 95 else quality
+        img.save(img_io, 'JPEG', quality=save_quality, optimize=True)
+        
+    elif fmt.upper() == 'PNG':
+        # PNG Quantization logic
+        if quality < 90:
+            # Map quality (0-100) to colors (2-256)
+            n_colors = max(2, int((quality / 100) * 256))
+            # Palette from a sample, alpha kept (see processing.quantize)
+            img = quantize_image(img, n_colors, dither)
+            img.save(img_io, 'PNG', optimize=True)
         else:
-            img.save(img_io, format=target_format)
+            # Lossless: best of several deflate candidates (see processing.png_optimize)
+            save_png(img, img_io, 'optimize')
             
-        img_io.seek(0)
-        
-        mime_type = f'image/{target_format.lower()}'
-        if target_format == 'ICO':
-            mime_type = 'image/x-icon'
-        
-        logger.info(f"Conversion completed successfully to {target_format}")
+    elif fmt.upper() == 'WEBP':
+        img.save(img_io, 'WEBP', quality=quality)
+    else:
+        img.save(img_io, fmt, quality=quality)
         
-        # Update streak
-        if current_user:
-            try:
-                logger.info(f"[STREAK] Updating for user: {current_user['id']}")
+    img_io.seek(0)
+    return img_io
+
+
+# Quality range searched by the target-size mode
+COMPRESS_TARGET_MIN_QUALITY = 10
+COMPRESS_TARGET_MAX_QUALITY = 95
+
+# Smallest scale the target-size mode shrinks an image to
+COMPRESS_TARGET_MIN_SCALE = 0.1
+
+# A fitting result this close below the target ends the search early
+COMPRESS_TARGET_TOLERANCE = 0.03
+
+
+def compress_target_params(form):
+    """
+    Parse the target-size fields of a compress request
+    
+    Returns:
+        {'target_bytes', 'allow_scale'}, or None when no target was given
+    
+    Raises:
+        ValueError if target_bytes is not a positive integer
+    """
+    value = form.get('target_bytes')
+    if not value:
+        return None
+    try:
+        target_bytes = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('target_bytes must be an integer')
+    if target_bytes <= 0:
+        raise ValueError('target_bytes must be positive')
+    return {
+        'target_bytes': target_bytes,
+        'allow_scale': str(form.get('allow_scale', 'false')).lower() == 'true'
+    }
+
+
+def compress_target_headers(result):
+    """Response headers describing a compress_to_target result"""
+    return {
+        'X-Compress-Quality': str(result['quality']),
+        'X-Compress-Scale': f"{result['scale']:.3f}",
+        'X-Compress-Bytes': str(result['bytes']),
+        'X-Compress-Trials': str(result['trials']),
+        'X-Target-Met': 'true' if result['met'] else 'false'
+    }
+
+
+def compress_min_ssim(form):
+    """
+    Parse the perceptual auto-quality fields of a compress request
+    
+    min_ssim sets the threshold; quality=auto uses config.COMPRESS_AUTO_MIN_SSIM.
+    
+    Returns:
+        SSIM threshold, or None for a fixed quality
+    
+    Raises:
+        ValueError if min_ssim is not a number between 0.5 and 1
+    """
+    value = form.get('min_ssim')
+    if not value:
+        return config.COMPRESS_AUTO_MIN_SSIM if form.get('quality') == 'auto' else None
+    try:
+        min_ssim = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('min_ssim must be a number')
+    if not 0.5 <= min_ssim < 1:
+        raise ValueError('min_ssim must be between 0.5 and 1')
+    return min_ssim
+
+
+def compress_to_similarity(img, min_ssim, max_trials=None):
+    """
+    Compress a JPEG or WebP image at the lowest quality that keeps min_ssim
+    
+    Binary search over quality: every trial encodes the full image, and the
+    decoded result is compared with the source on full-resolution luminance
+    tiles (see processing.quality), so a comparison costs far less than the encode.
+    
+    Args:
+        img: Image opened from the upload
+        min_ssim: Lowest acceptable SSIM against the source
+        max_trials: Encodes allowed (defaults to config.COMPRESS_TARGET_MAX_TRIALS)
+    
+    Returns:
+        Tuple of (OutputBuffer, mimetype, result dict with quality, ssim and
+        trials). If no quality reaches min_ssim, the highest one is returned.
+    
+    Raises:
+        ValueError if the image is not JPEG or WebP
+    """
+    fmt = (img.format or 'JPEG').upper()
+    if fmt == 'JPG':
+        fmt = 'JPEG'
+    if fmt not in ('JPEG', 'WEBP'):
+        raise ValueError('Perceptual auto-quality supports JPEG and WebP images')
+    if img.mode not in ('RGB', 'L') and fmt == 'JPEG':
+        img = img.convert('RGB')
+    max_trials = max_trials or config.COMPRESS_TARGET_MAX_TRIALS
+    
+    boxes = proxy_boxes(img.size)
+    reference = luma_proxy(img, boxes)
+    
+    low, high = COMPRESS_TARGET_MIN_QUALITY, COMPRESS_TARGET_MAX_QUALITY
+    best = None  # (quality, output, ssim) of the lowest passing quality
+    trials = 0
+    
+    logger.info(f"Compressing to SSIM >= {min_ssim}: format={fmt}")
+    
+    while low <= high and trials < max_trials:
+        quality = (low + high) // 2
+        output = encode_compressed(img, fmt, quality)
+        score = encoded_ssim(reference, output.getvalue(), boxes)
+        trials += 1
+        if score >= min_ssim:
+            if best is not None:
+                best[1].close()
+            best = (quality, output, score)
+            high = quality - 1
+        else:
+            output.close()
+            low = quality + 1
+    
+    if best is None:
+        quality = COMPRESS_TARGET_MAX_QUALITY
+        output = encode_compressed(img, fmt, quality)
+        best = (quality, output, encoded_ssim(reference, output.getvalue(), boxes))
+        trials += 1
+    
+    quality, output, score = best
+    output.seek(0)
+    logger.info(f"Compressed at quality {quality} (SSIM {score:.4f}) after {trials} encodes")
+    return output, f'image/{fmt.lower()}', {'quality': quality, 'ssim': score, 'trials': trials}
+
+
+def compress_to_target(img, target_bytes, allow_scale=False, max_trials=None, dither='none'):
+    """
+    Compress a PIL image to at most target_bytes in its own format
+    
+    Quality is found by interpolation search: the encoded size is close to
+    monotonic in quality, so each trial is placed where the line between
+    the best fitting and the smallest failing trial crosses the target. Every
+    trial re-encodes the same decoded image. If even the lowest quality is
+    too large and allow_scale is set, the image is shrunk by the estimated
+    area ratio and the search continues on the smaller image.
+    
+    Args:
+        img: Image opened from the upload
+        target_bytes: Largest acceptable encoded size
+        allow_scale: Allow reducing the dimensions when quality alone is not enough
+        max_trials: Encodes allowed (defaults to config.COMPRESS_TARGET_MAX_TRIALS)
+        dither: PNG palette dithering (see compress_image)
+    
+    Returns:
+        Tuple of (OutputBuffer, mimetype, result dict with quality, scale,
+        bytes, trials and met). When the target cannot be met, the smallest
+        encode is returned with met set to False.
+    """
+    fmt = img.format if img.format else 'JPEG'
+    max_trials = max_trials or config.COMPRESS_TARGET_MAX_TRIALS
+    source = img
+    scale = 1.0
+    trials = 0
+    best = None       # (quality, output) of the highest quality that fits
+    smallest = None   # (quality, output) of the smallest encode so far
+    
+    def encode(quality):
+        """Encode one trial, keep it if it is the best or smallest so far, return its size"""
+        nonlocal trials, best, smallest
+        trials += 1
+        output = encode_compressed(img, fmt, quality, dither)
+        size = output.size
+        previous = [entry[1] for entry in (best, smallest) if entry is not None]
+        # Fitting trials come in increasing quality order
+        if size <= target_bytes:
+            best = (quality, output)
+        if smallest is None or size < smallest[1].size:
+            smallest = (quality, output)
+        kept = [entry[1] for entry in (best, smallest) if entry is not None]
+        for candidate in previous + [output]:
+            if not any(candidate is other for other in kept):
+                candidate.close()
+        return size
+    
+    logger.info(f"Compressing to target: format={fmt}, target={target_bytes} bytes")
+    
+    while trials < max_trials:
+        high_q = COMPRESS_TARGET_MAX_QUALITY
+        high_size = encode(high_q)
+        if high_size <= target_bytes:
+            break
+        
+        low_q = COMPRESS_TARGET_MIN_QUALITY
+        low_size = encode(low_q)
+        if low_size > target_bytes:
+            # Quality alone cannot reach the target at this size
+            if not allow_scale or trials >= max_trials:
+                break
+            # Encoded size scales roughly with the pixel count
+            next_scale = scale * max(0.5, min(0.95, (target_bytes / low_size) ** 0.5 * 0.95))
+            if next_scale < COMPRESS_TARGET_MIN_SCALE:
+                break
+            scale = next_scale
+            size = (max(1, round(source.width * scale)), max(1, round(source.height * scale)))
+            img = source.resize(size, Image.Resampling.LANCZOS)
+            img.format = fmt
+            continue
+        
+        while high_q - low_q > 1 and trials < max_trials:
+            if low_size >= target_bytes * (1 - COMPRESS_TARGET_TOLERANCE):
+                break
+            position = 0.5
+            if high_size > low_size:
+                position = (target_bytes - low_size) / (high_size - low_size)
+            # Keep each guess off the ends of the bracket, so a skewed size
+            # curve still shrinks the bracket at a steady rate
+            position = min(0.8, max(0.2, position))
+            quality = min(high_q - 1, max(low_q + 1, int(round(low_q + position * (high_q - low_q)))))
+            size = encode(quality)
+            if size <= target_bytes:
+                low_q, low_size = quality, size
+            else:
+                high_q, high_size = quality, size
+        break
+    
+    met = best is not None
+    quality, output = best if met else smallest
+    if smallest[1] is not output:
+        smallest[1].close()
+    output.seek(0)
+    
+    result = {
+        'quality': quality,
+        'scale': scale,
+        'bytes': output.size,
+        'trials': trials,
+        'met': met
+    }
+    logger.info(
+        f"Compressed to {result['bytes']} bytes (target {target_bytes}) at quality {quality}, "
+        f"scale {scale:.3f} after {trials} encodes"
+    )
+    return output, f'image/{fmt.lower()}', result
+
+
+@app.route('/api/convert', methods=['POST'])
+@allow_guest_access('convert')
+@log_request
+@admission_control('convert')
+def api_convert(current_user):
+    # Get cost from database (even if it's 0/Free, we need to send it to frontend)
+    cost = get_tool_cost('convert')
+    
+    if 'image' not in request.files:
+        logger.warning("Convert request missing image file")
+        return 'No image uploaded', 400
+    
+    file = request.files['image']
+    target_format = request.form.get('format', 'PNG').upper()
+    
+    try:
+        data = file.read()
+        cache_key = result_cache.make_key('convert', data, {'format': target_format})
+        cached = result_cache.get(cache_key)
+        
+        if cached is None:
+            img_io, mime_type = convert_image(open_image_bytes(data), target_format)
+            cache_output(cache_key, img_io, mime_type)
+        else:
+            logger.info("Conversion served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mime_type = cached.mimetype
+        
+        # Update streak
+        if current_user:
+            try:
+                logger.info(f"[STREAK] Updating for user: {current_user['id']}")
                 StreakManager().update_streak(current_user['id'])
             except Exception as e:
                 logger.error(f"[STREAK] Error: {e}")
         
         # --- UPDATE: Use make_response to send Cost Header ---
-        response = make_response(send_file(img_io, mimetype=mime_type))
+        response = send_output(img_io, mime_type)
         response.headers['X-Credits-Cost'] = str(cost)
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
         return response
         # ----------------------------------------------------
         
@@ -1936,9 +2805,58 @@ def api_convert(current_user):
         logger.error(traceback.format_exc())
         return str(e), 500
 
+
+def convert_image(img, target_format):
+    """
+    Convert a PIL image to another format
+    
+    Args:
+        img: Image opened from the upload
+        target_format: Pillow format name (e.g. 'PNG', 'JPEG', 'ICO')
+    
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype)
+    """
+    source_format = img.format if img.format else 'Unknown'
+    
+    logger.info(f"Converting image: {source_format} -> {target_format}")
+    
+    img = prepare_for_format(img, target_format)
+        
+    img_io = output_buffer()
+    
+    if target_format == 'ICO':
+        if img.width > 256 or img.height > 256:
+            img.thumbnail((256, 256))
+        img.save(img_io, format='ICO')
+    else:
+        img.save(img_io, format=target_format)
+        
+    img_io.seek(0)
+    
+    mime_type = f'image/{target_format.lower()}'
+    if target_format == 'ICO':
+        mime_type = 'image/x-icon'
+    
+    logger.info(f"Conversion completed successfully to {target_format}")
+    return img_io, mime_type
+
+
+def prepare_for_format(img, target_format):
+    """Convert an image to a mode the target format can store (alpha is flattened onto white)"""
+    if target_format in ['JPEG', 'JPG', 'BMP'] and img.mode in ['RGBA', 'LA']:
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if target_format != 'ICO' and img.mode == 'P':
+        return img.convert('RGB')
+    return img
+
+
 @app.route('/api/remove-bg', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('remove_bg')
 def api_remove_bg(current_user):
     """
     Optimized background removal for 512MB RAM environments
@@ -1959,56 +2877,7 @@ def api_remove_bg(current_user):
     file = request.files['image']
     
     try:
-        input_image = Image.open(file)
-        original_size = input_image.size
-        logger.info(f"Removing background from image: {original_size}")
-        
-        # --- MEMORY OPTIMIZATION START ---
-        # 1. Define maximum dimensions to prevent OOM on large images
-        MAX_DIMENSION = 1920  # Max width or height
-        
-        # 2. Resize if image is too large (preserves aspect ratio)
-        needs_resize = max(input_image.size) > MAX_DIMENSION
-        if needs_resize:
-            ratio = MAX_DIMENSION / max(input_image.size)
-            new_size = tuple(int(dim * ratio) for dim in input_image.size)
-            logger.info(f"Resizing image from {original_size} to {new_size} to prevent OOM")
-            input_image = input_image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # 3. Import lightweight session model (u2netp - only ~4.7MB model size)
-        from rembg import remove, new_session
-        
-        # 4. Create session with lightweight model
-        # u2netp = portable version, much smaller memory footprint
-        session = new_session("u2netp")
-        
-        # 5. Remove background with optimized settings
-        output_image = remove(
-            input_image,
-            session=session,
-            only_mask=False,  # Return RGBA image, not just mask
-            post_process_mask=True  # Clean up edges
-        )
-        
-        # 6. If we resized, optionally scale back up (or keep optimized size)
-        # For 512MB RAM, it's safer to keep the optimized size
-        # Uncomment below if you want to restore original size:
-        # if needs_resize:
-        #     output_image = output_image.resize(original_size, Image.Resampling.LANCZOS)
-        
-        # --- MEMORY OPTIMIZATION END ---
-        
-        # Save to buffer
-        img_io = io.BytesIO()
-        output_image.save(img_io, 'PNG', optimize=True)
-        img_io.seek(0)
-        
-        # Clean up
-        del input_image
-        del output_image
-        del session
-        
-        logger.info("Background removal completed successfully")
+        img_io, mimetype = remove_background_image(open_image_bytes(file.read(), max_side=REMOVE_BG_MAX_SIDE))
         
         # Update streak
         try:
@@ -2018,7 +2887,7 @@ def api_remove_bg(current_user):
             logger.error(f"[STREAK] Error: {e}")
         
         # Return response with Cost Header
-        response = make_response(send_file(img_io, mimetype='image/png'))
+        response = send_output(img_io, mimetype)
         response.headers['X-Credits-Cost'] = str(cost)
         return response
         
@@ -2028,10 +2897,68 @@ def api_remove_bg(current_user):
         return str(e), 500
 
 
+# Largest side sent to the background removal model
+REMOVE_BG_MAX_SIDE = 1920
+
+
+def remove_background_image(input_image):
+    """
+    Remove the background from a PIL image
+    
+    Returns:
+        Tuple of (OutputBuffer with the PNG result, mimetype)
+    """
+    original_size = input_image.size
+    logger.info(f"Removing background from image: {original_size}")
+    
+    # --- MEMORY OPTIMIZATION START ---
+    # 1. Define maximum dimensions to prevent OOM on large images
+    MAX_DIMENSION = REMOVE_BG_MAX_SIDE  # Max width or height
+    
+    # 2. Resize if image is too large (preserves aspect ratio)
+    needs_resize = max(input_image.size) > MAX_DIMENSION
+    if needs_resize:
+        ratio = MAX_DIMENSION / max(input_image.size)
+        new_size = tuple(int(dim * ratio) for dim in input_image.size)
+        logger.info(f"Resizing image from {original_size} to {new_size} to prevent OOM")
+        input_image = open_image_for_size(input_image, new_size)
+        input_image = input_image.resize(new_size, Image.Resampling.LANCZOS)
+    
+    # 3. Remove background with the shared, already-loaded session
+    # u2netp = portable version, much smaller memory footprint
+    output_image = model_registry.remove_background(
+        input_image,
+        model_name=config.REMBG_MODEL,
+        only_mask=False,  # Return RGBA image, not just mask
+        post_process_mask=True  # Clean up edges
+    )
+    
+    # 4. If we resized, optionally scale back up (or keep optimized size)
+    # For 512MB RAM, it's safer to keep the optimized size
+    # Uncomment below if you want to restore original size:
+    # if needs_resize:
+    #     output_image = output_image.resize(original_size, Image.Resampling.LANCZOS)
+    
+    # --- MEMORY OPTIMIZATION END ---
+    
+    # Save to buffer
+    img_io = output_buffer()
+    save_png(output_image, img_io, 'optimize')
+    img_io.seek(0)
+    
+    # Clean up
+    del input_image
+    del output_image
+    
+    logger.info("Background removal completed successfully")
+    return img_io, 'image/png'
+
+
 
 @app.route('/api/palette', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('palette')
 def api_palette(current_user):
     # Get cost from database
     cost = get_tool_cost('palette')
@@ -2048,30 +2975,43 @@ def api_palette(current_user):
     file = request.files['image']
     
     try:
-        img = Image.open(file)
-        logger.info("Extracting color palette from image")
-        
-        # Resize for faster processing
-        img.thumbnail((200, 200))
-        
-        # Quantize to 8 colors
-        quantized = img.quantize(colors=8)
-        palette = quantized.getpalette()
-        
-        colors = []
-        if palette:
-            for i in range(8):
-                if (i*3+2) < len(palette):
-                    r = palette[i*3]
-                    g = palette[i*3+1]
-                    b = palette[i*3+2]
-                    hex_code = '#{:02x}{:02x}{:02x}'.format(r, g, b)
-                    colors.append({
-                        'rgb': [r, g, b],
-                        'hex': hex_code
-                    })
-        
-        logger.info(f"Extracted {len(colors)} colors from palette")
+        import json
+        
+        data = file.read()
+        cache_key = result_cache.make_key('palette', data, {'colors': 8})
+        cached = result_cache.get(cache_key)
+        
+        if cached is None:
+            # Large JPEGs are decoded at 1/2 to 1/8 scale
+            img = open_image_bytes(data, target_size=(200, 200))
+            logger.info("Extracting color palette from image")
+            
+            # Resize for faster processing
+            img.thumbnail((200, 200))
+            
+            # Quantize to 8 colors
+            quantized = img.quantize(colors=8)
+            palette = quantized.getpalette()
+            
+            colors = []
+            if palette:
+                for i in range(8):
+                    if (i*3+2) < len(palette):
+                        r = palette[i*3]
+                        g = palette[i*3+1]
+                        b = palette[i*3+2]
+                        hex_code = '#{:02x}{:02x}{:02x}'.format(r, g, b)
+                        colors.append({
+                            'rgb': [r, g, b],
+                            'hex': hex_code
+                        })
+            
+            logger.info(f"Extracted {len(colors)} colors from palette")
+            
+            result_cache.put(cache_key, json.dumps(colors).encode('utf-8'), 'application/json')
+        else:
+            logger.info("Palette served from result cache")
+            colors = json.loads(cached.data)
         
         # Update streak
         try:
@@ -2083,6 +3023,7 @@ def api_palette(current_user):
         # --- UPDATE: Send Cost Header ---
         response = make_response(jsonify({'colors': colors}))
         response.headers['X-Credits-Cost'] = str(cost)
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
         return response
         # --------------------------------
         
@@ -2095,6 +3036,7 @@ def api_palette(current_user):
 @app.route('/api/filter', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('filter')
 def api_filter(current_user):
     """
     Advanced image filtering and color grading tool with AI Auto Enhance
@@ -2116,73 +3058,46 @@ def api_filter(current_user):
     
     file = request.files['image']
     filter_data_str = request.form.get('filterData', '{}')
+    lut_file = request.files.get('lut')  # Optional .cube 3D LUT
     
     try:
         import json
-        import numpy as np
-        import cv2
-        from PIL import ImageEnhance, ImageFilter
-        from skimage import exposure, filters
-        import piexif
         
         # Parse filter data
         filter_data = json.loads(filter_data_str)
         logger.info(f"Applying filters: {filter_data}")
         
-        # Load image and preserve EXIF
-        file_bytes = file.read()
-        file.seek(0)
-        img = Image.open(file)
-        fmt = img.format if img.format else 'JPEG'
-        
-        # Extract and preserve EXIF data
-        exif_dict = None
-        try:
-            if fmt.upper() in ['JPEG', 'JPG'] and 'exif' in img.info:
-                exif_dict = piexif.load(img.info['exif'])
-        except Exception as e:
-            logger.warning(f"Could not extract EXIF: {e}")
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Check for AI Auto Enhance
-        if filter_data.get('aiAutoEnhance', False):
-            img = apply_ai_auto_enhance(img)
-        
-        # Check for preset application
-        preset_name = filter_data.get('preset', None)
-        if preset_name and preset_name != 'none':
-            img = apply_filter_preset(img, preset_name)
-        
-        # Apply manual adjustments
-        img = apply_manual_filters(img, filter_data)
-        
-        # Save to buffer with EXIF preservation
-        img_io = io.BytesIO()
-        save_kwargs = {'quality': 95, 'optimize': True}
-        
-        # Re-insert EXIF data if available
-        if exif_dict and fmt.upper() in ['JPEG', 'JPG']:
+        # Parse uploaded .cube LUT (applied through the same LUT engine as presets)
+        custom_lut = None
+        lut_data = b''
+        if lut_file and lut_file.filename:
+            lut_data = lut_file.read()
             try:
-                exif_bytes = piexif.dump(exif_dict)
-                save_kwargs['exif'] = exif_bytes
-            except Exception as e:
-                logger.warning(f"Could not save EXIF: {e}")
+                custom_lut = color_lut_engine.load_cube(lut_data)
+            except ValueError as e:
+                logger.warning(f"Invalid .cube LUT: {e}")
+                return jsonify({'success': False, 'error': f'Invalid .cube LUT: {str(e)}'}), 400
+        
+        data = file.read()
+        
+        # Only filters without random grain can be served from cache
+        cache_key = None
+        cached = None
+        if filter_is_deterministic(filter_data):
+            cache_key = result_cache.make_key('filter', data + lut_data, {
+                'filterData': filter_data,
+                'lutBytes': len(lut_data)
+            })
+            cached = result_cache.get(cache_key)
         
-        if fmt.upper() in ['JPEG', 'JPG']:
-            img.save(img_io, 'JPEG', **save_kwargs)
-        elif fmt.upper() == 'PNG':
-            img.save(img_io, 'PNG', optimize=True)
-        elif fmt.upper() == 'WEBP':
-            img.save(img_io, 'WEBP', quality=95)
+        if cached is None:
+            img_io, mimetype = filter_image(open_image_bytes(data), filter_data, custom_lut)
+            if cache_key:
+                cache_output(cache_key, img_io, mimetype)
         else:
-            img.save(img_io, fmt, quality=95)
-        
-        img_io.seek(0)
-        
-        logger.info("Filter application completed successfully")
+            logger.info("Filter served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mimetype = cached.mimetype
         
         # Update streak with detailed logging
         try:
@@ -2198,413 +3113,108 @@ def api_filter(current_user):
             logger.error(f"[STREAK] Stack trace: {traceback.format_exc()}")
         
         # Return response with Cost Header
-        response = make_response(send_file(img_io, mimetype=f'image/{fmt.lower()}'))
+        response = send_output(img_io, mimetype)
         response.headers['X-Credits-Cost'] = str(cost)
+        response.headers['X-Cache'] = 'HIT' if cached is not None else ('MISS' if cache_key else 'BYPASS')
         return response
         
+    except ExecutorError as e:
+        return executor_error_response(e)
     except Exception as e:
         logger.error(f"Filter application failed: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-def apply_ai_auto_enhance(img):
+def filter_is_deterministic(filter_data):
     """
-    AI-powered auto enhancement using OpenCV CLAHE
-    Applies adaptive histogram equalization in LAB color space
+    Check whether a filter request always gives the same output for the same input
+    
+    Film grain (manual or from a preset) comes from a seeded texture bank, so
+    it is reproducible too; only requests asking for a random grain seed are
+    never cached.
     """
-    try:
-        import cv2
-        import numpy as np
-        
-        # Convert PIL to OpenCV format
-        img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-        
-        # Convert to LAB color space for better color preservation
-        lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization) to L channel
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        l_enhanced = clahe.apply(l)
-        
-        # Merge channels
-        enhanced_lab = cv2.merge([l_enhanced, a, b])
-        
-        # Convert back to BGR then RGB
-        enhanced_bgr = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-        enhanced_rgb = cv2.cvtColor(enhanced_bgr, cv2.COLOR_BGR2RGB)
-        
-        # Apply subtle sharpening
-        kernel = np.array([[-1,-1,-1],
-                          [-1, 9,-1],
-                          [-1,-1,-1]]) / 9.0
-        enhanced_rgb = cv2.filter2D(enhanced_rgb, -1, kernel)
-        
-        # Apply gentle noise reduction
-        enhanced_rgb = cv2.fastNlMeansDenoisingColored(enhanced_rgb, None, 3, 3, 7, 21)
-        
-        # Auto white balance
-        enhanced_rgb = auto_white_balance(enhanced_rgb)
-        
-        # Convert back to PIL
-        return Image.fromarray(enhanced_rgb)
-        
-    except Exception as e:
-        logger.warning(f"AI Auto Enhance failed: {e}, returning original")
-        return img
-
-
-def auto_white_balance(img_cv):
-    """Apply automatic white balance using gray world assumption"""
-    try:
-        result = cv2.cvtColor(img_cv, cv2.COLOR_RGB2LAB)
-        avg_a = np.average(result[:, :, 1])
-        avg_b = np.average(result[:, :, 2])
-        result[:, :, 1] = result[:, :, 1] - ((avg_a - 128) * (result[:, :, 0] / 255.0) * 1.1)
-        result[:, :, 2] = result[:, :, 2] - ((avg_b - 128) * (result[:, :, 0] / 255.0) * 1.1)
-        result = cv2.cvtColor(result, cv2.COLOR_LAB2RGB)
-        return result
-    except:
-        return img_cv
+    if not grain_is_random(filter_data):
+        return True
+    if float(filter_data.get('grain', 0) or 0) > 0:
+        return False
+    preset = FILTER_PRESETS.get(filter_data.get('preset') or 'none')
+    return preset is None or not preset.adds_grain
 
 
-def apply_filter_preset(img, preset_name):
+def filter_image(img, filter_data, custom_lut=None):
     """
-    Apply predefined filter presets
-    25 professional presets across 5 categories
-    """
-    import numpy as np
-    from PIL import ImageEnhance
-    
-    img_array = np.array(img, dtype=np.float32)
-    
-    # Cinematic Presets
-    if preset_name == 'teal_orange':
-        # Teal & Orange (Blockbuster look)
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.15, 0, 255)  # Boost reds
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.85 + 20, 0, 255)  # Teal shadows
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Contrast(img).enhance(1.2)
-        img = ImageEnhance.Color(img).enhance(0.9)
-        
-    elif preset_name == 'moody_dark':
-        img_array = np.clip(img_array * 0.7, 0, 255)  # Darken
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Contrast(img).enhance(1.3)
-        img = ImageEnhance.Color(img).enhance(0.8)
-        img = apply_vignette_pil(img, 60)
-        
-    elif preset_name == 'bright_cinematic':
-        img_array = np.clip(img_array * 1.15 + 10, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Contrast(img).enhance(1.1)
-        img = ImageEnhance.Color(img).enhance(1.1)
-        
-    elif preset_name == 'film_noir':
-        img = img.convert('L').convert('RGB')  # B&W
-        img = ImageEnhance.Contrast(img).enhance(1.5)
-        img = apply_vignette_pil(img, 70)
-        
-    elif preset_name == 'dramatic':
-        img = ImageEnhance.Contrast(img).enhance(1.4)
-        img = ImageEnhance.Color(img).enhance(0.9)
-        img = apply_vignette_pil(img, 50)
-        
-    # Vintage Presets
-    elif preset_name == 'retro_70s':
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.1, 0, 255)  # Warm
-        img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.05, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(0.7)
-        img = ImageEnhance.Contrast(img).enhance(0.9)
-        img = add_grain_pil(img, 15)
-        
-    elif preset_name == 'polaroid':
-        img = ImageEnhance.Brightness(img).enhance(1.1)
-        img = ImageEnhance.Color(img).enhance(0.8)
-        img = ImageEnhance.Contrast(img).enhance(0.95)
-        img = apply_vignette_pil(img, 30)
-        
-    elif preset_name == 'faded_film':
-        img_array = np.clip(img_array * 0.9 + 20, 0, 255)  # Fade
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(0.6)
-        img = ImageEnhance.Contrast(img).enhance(0.85)
-        
-    elif preset_name == 'warm_vintage':
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] + 25, 0, 255)  # Red
-        img_array[:, :, 1] = np.clip(img_array[:, :, 1] + 15, 0, 255)  # Green
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(0.75)
-        
-    elif preset_name == 'cool_vintage':
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] + 20, 0, 255)  # Blue
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(0.75)
-        img = ImageEnhance.Contrast(img).enhance(0.9)
-        
-    # Modern Presets
-    elif preset_name == 'clean_bright':
-        img = ImageEnhance.Brightness(img).enhance(1.15)
-        img = ImageEnhance.Color(img).enhance(1.05)
-        img = ImageEnhance.Sharpness(img).enhance(1.2)
-        
-    elif preset_name == 'high_contrast':
-        img = ImageEnhance.Contrast(img).enhance(1.4)
-        img = ImageEnhance.Color(img).enhance(1.1)
-        
-    elif preset_name == 'matte_finish':
-        img_array = np.clip(img_array * 0.95 + 10, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Contrast(img).enhance(0.9)
-        
-    elif preset_name == 'vibrant_pop':
-        img = ImageEnhance.Color(img).enhance(1.3)
-        img = ImageEnhance.Contrast(img).enhance(1.15)
-        img = ImageEnhance.Sharpness(img).enhance(1.1)
-        
-    elif preset_name == 'soft_pastel':
-        img_array = np.clip(img_array * 0.9 + 25, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(0.8)
-        img = ImageEnhance.Contrast(img).enhance(0.85)
-        
-    # Black & White Presets
-    elif preset_name == 'classic_bw':
-        img = img.convert('L').convert('RGB')
-        img = ImageEnhance.Contrast(img).enhance(1.1)
-        
-    elif preset_name == 'high_contrast_bw':
-        img = img.convert('L').convert('RGB')
-        img = ImageEnhance.Contrast(img).enhance(1.5)
-        
-    elif preset_name == 'soft_bw':
-        img = img.convert('L').convert('RGB')
-        img_array = np.array(img, dtype=np.float32)
-        img_array = np.clip(img_array * 0.95 + 10, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        
-    elif preset_name == 'dramatic_bw':
-        img = img.convert('L').convert('RGB')
-        img = ImageEnhance.Contrast(img).enhance(1.6)
-        img = apply_vignette_pil(img, 60)
-        
-    elif preset_name == 'film_bw':
-        img = img.convert('L').convert('RGB')
-        img = ImageEnhance.Contrast(img).enhance(1.2)
-        img = add_grain_pil(img, 10)
-        
-    # Special Presets
-    elif preset_name == 'golden_hour':
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.2 + 15, 0, 255)
-        img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.1 + 10, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(1.1)
-        
-    elif preset_name == 'blue_hour':
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 1.2 + 15, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        img = ImageEnhance.Color(img).enhance(1.05)
-        img = ImageEnhance.Brightness(img).enhance(0.95)
-        
-    elif preset_name == 'sunset_glow':
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.25, 0, 255)
-        img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.1, 0, 255)
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.9, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        
-    elif preset_name == 'cool_tones':
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 1.15, 0, 255)
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 0.95, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-        
-    elif preset_name == 'warm_tones':
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * 1.15, 0, 255)
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 0.95, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
+    Run the filter tool pipeline on an opened PIL image
     
-    return img
-
-
-def apply_manual_filters(img, filter_data):
-    """Apply manual filter adjustments with full parameter support"""
-    import numpy as np
-    from PIL import ImageEnhance, ImageFilter
-    
-    img_array = np.array(img, dtype=np.float32)
-    
-    # --- EXPOSURE ---
-    exposure_val = float(filter_data.get('exposure', 0))
-    if exposure_val != 0:
-        stops = exposure_val / 50.0
-        factor = 2.0 ** stops
-        img_array = np.clip(img_array * factor, 0, 255)
-    
-    # --- BRIGHTNESS ---
-    brightness = float(filter_data.get('brightness', 0))
-    if brightness != 0:
-        img_array = np.clip(img_array + (brightness * 2.55), 0, 255)
-    
-    # --- CONTRAST ---
-    contrast = float(filter_data.get('contrast', 0))
-    if contrast != 0:
-        factor = (contrast + 100.0) / 100.0
-        img_array = np.clip(((img_array - 127.5) * factor) + 127.5, 0, 255)
-    
-    # --- HIGHLIGHTS ---
-    highlights = float(filter_data.get('highlights', 0))
-    if highlights != 0:
-        mask = (img_array > 180).astype(float)
-        adjustment = highlights * 0.5
-        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
-    
-    # --- SHADOWS ---
-    shadows = float(filter_data.get('shadows', 0))
-    if shadows != 0:
-        mask = (img_array < 75).astype(float)
-        adjustment = shadows * 0.5
-        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
-    
-    # --- WHITES ---
-    whites = float(filter_data.get('whites', 0))
-    if whites != 0:
-        mask = (img_array > 200).astype(float)
-        adjustment = whites * 0.3
-        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
-    
-    # --- BLACKS ---
-    blacks = float(filter_data.get('blacks', 0))
-    if blacks != 0:
-        mask = (img_array < 50).astype(float)
-        adjustment = blacks * 0.3
-        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
-    
-    # Convert to PIL for color adjustments
-    img = Image.fromarray(img_array.astype(np.uint8))
-    
-    # --- SATURATION ---
-    saturation = float(filter_data.get('saturation', 0))
-    if saturation != 0:
-        enhancer = ImageEnhance.Color(img)
-        factor = 1.0 + (saturation / 100.0)
-        img = enhancer.enhance(max(0, factor))
-    
-    # --- VIBRANCE ---
-    vibrance = float(filter_data.get('vibrance', 0))
-    if vibrance != 0:
-        img_array = np.array(img, dtype=np.float32)
-        # Vibrance affects less saturated colors more
-        hsv = cv2.cvtColor(img_array.astype(np.uint8), cv2.COLOR_RGB2HSV).astype(np.float32)
-        saturation_mask = 1.0 - (hsv[:, :, 1] / 255.0)
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1] + (vibrance * saturation_mask * 0.5), 0, 255)
-        img_array = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
-        img = Image.fromarray(img_array)
-    
-    # --- TEMPERATURE ---
-    temp_val = float(filter_data.get('temperature', 0))
-    if temp_val != 0:
-        img_array = np.array(img, dtype=np.float32)
-        if temp_val > 0:  # Warmer
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] + temp_val * 1.5, 0, 255)
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] - temp_val * 0.5, 0, 255)
-        else:  # Cooler
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] + temp_val * 0.5, 0, 255)
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] - temp_val * 1.5, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-    
-    # --- TINT ---
-    tint_val = float(filter_data.get('tint', 0))
-    if tint_val != 0:
-        img_array = np.array(img, dtype=np.float32)
-        if tint_val > 0:  # More green
-            img_array[:, :, 1] = np.clip(img_array[:, :, 1] + tint_val * 1.5, 0, 255)
-        else:  # More magenta
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] - tint_val * 0.75, 0, 255)
-            img_array[:, :, 2] = np.clip(img_array[:, :, 2] - tint_val * 0.75, 0, 255)
-        img = Image.fromarray(img_array.astype(np.uint8))
-    
-    # --- HUE SHIFT ---
-    hue_shift = float(filter_data.get('hueShift', 0))
-    if hue_shift != 0:
-        img_array = np.array(img)
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV).astype(np.float32)
-        hsv[:, :, 0] = (hsv[:, :, 0] + hue_shift) % 180
-        img_array = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2RGB)
-        img = Image.fromarray(img_array)
-    
-    # --- SHARPNESS ---
-    sharpness = float(filter_data.get('sharpness', 0))
-    if sharpness > 0:
-        enhancer = ImageEnhance.Sharpness(img)
-        factor = 1.0 + (sharpness / 50.0)
-        img = enhancer.enhance(factor)
-    
-    # --- CLARITY ---
-    clarity = float(filter_data.get('clarity', 0))
-    if clarity > 0:
-        img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=int(clarity * 1.5), threshold=3))
-    
-    # --- BLUR ---
-    blur = float(filter_data.get('blur', 0))
-    if blur > 0:
-        img = img.filter(ImageFilter.GaussianBlur(radius=blur / 10.0))
-    
-    # --- VIGNETTE ---
-    vignette = float(filter_data.get('vignette', 0))
-    if vignette > 0:
-        img = apply_vignette_pil(img, vignette)
-    
-    # --- GRAIN ---
-    grain = float(filter_data.get('grain', 0))
-    if grain > 0:
-        img = add_grain_pil(img, grain)
+    Args:
+        img: Image opened from the upload
+        filter_data: Parsed filterData settings
+        custom_lut: Optional Color3DLUT from an uploaded .cube file
     
-    return img
-
-
-def apply_vignette_pil(img, strength):
-    """Apply vignette effect to PIL image"""
-    import numpy as np
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype)
+    """
+    import piexif
+    
+    fmt = img.format if img.format else 'JPEG'
     
-    img_array = np.array(img, dtype=np.float32)
-    rows, cols = img_array.shape[:2]
+    # Extract and preserve EXIF data
+    exif_dict = None
+    try:
+        if fmt.upper() in ['JPEG', 'JPG'] and 'exif' in img.info:
+            exif_dict = piexif.load(img.info['exif'])
+    except Exception as e:
+        logger.warning(f"Could not extract EXIF: {e}")
     
-    # Create radial gradient mask
-    center_x, center_y = cols / 2, rows / 2
-    Y, X = np.ogrid[:rows, :cols]
+    img = filter_pixels(img, filter_data, custom_lut)
     
-    dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-    max_dist = np.sqrt(center_x**2 + center_y**2)
+    # Save to buffer with EXIF preservation
+    img_io = output_buffer()
+    save_kwargs = {'quality': 95, 'optimize': True}
     
-    mask = 1.0 - (dist_from_center / max_dist)
-    mask = np.clip(mask, 0, 1)
+    # Re-insert EXIF data if available
+    if exif_dict and fmt.upper() in ['JPEG', 'JPG']:
+        try:
+            exif_bytes = piexif.dump(exif_dict)
+            save_kwargs['exif'] = exif_bytes
+        except Exception as e:
+            logger.warning(f"Could not save EXIF: {e}")
     
-    strength_factor = strength / 100.0
-    mask = 1.0 - (strength_factor * (1.0 - mask))
+    if fmt.upper() in ['JPEG', 'JPG']:
+        img.save(img_io, 'JPEG', **save_kwargs)
+    elif fmt.upper() == 'PNG':
+        img.save(img_io, 'PNG', optimize=True)
+    elif fmt.upper() == 'WEBP':
+        img.save(img_io, 'WEBP', quality=95)
+    else:
+        img.save(img_io, fmt, quality=95)
     
-    img_array = img_array * mask[:, :, np.newaxis]
-    img_array = np.clip(img_array, 0, 255)
+    img_io.seek(0)
     
-    return Image.fromarray(img_array.astype(np.uint8))
+    logger.info("Filter application completed successfully")
+    return img_io, f'image/{fmt.lower()}'
 
 
-def add_grain_pil(img, amount):
-    """Add film grain to PIL image"""
-    import numpy as np
+def filter_pixels(img, filter_data, custom_lut=None):
+    """
+    Apply AI enhance, preset, .cube LUT and manual adjustments without encoding
     
-    img_array = np.array(img, dtype=np.float32)
-    noise = np.random.normal(0, amount * 0.5, img_array.shape)
-    img_array = np.clip(img_array + noise, 0, 255)
+    All stages run on one pooled working buffer (see processing.filter_pipeline).
     
-    return Image.fromarray(img_array.astype(np.uint8))
-
-        
+    Returns:
+        RGB PIL image
+    """
+    # Convert to RGB if needed
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    return image_executor.run(run_filter_pipeline, img, filter_data, custom_lut)
 
 
 @app.route('/api/exif', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('exif')
 def api_exif(current_user):
     """
     EXIF metadata viewer and remover with grouped display
@@ -2645,7 +3255,8 @@ def api_exif(current_user):
             return jsonify(deduct_result), 402
     
     try:
-        img = Image.open(file)
+        # Header only: EXIF is read as stored, without applying the orientation
+        img = open_image_checked(file)
         file.seek(0)  # Reset file pointer for potential re-reading
         
         logger.info(f"EXIF operation: action={action}, format={img.format}, size={img.size}")
@@ -2679,7 +3290,7 @@ def api_exif(current_user):
             import piexif
             
             # Save image without EXIF
-            img_io = io.BytesIO()
+            img_io = output_buffer()
             fmt = img.format if img.format else 'JPEG'
             
             # For JPEG/TIFF, use piexif to remove metadata
@@ -2695,7 +3306,7 @@ def api_exif(current_user):
                     data = list(img.getdata())
                     image_without_exif = Image.new(img.mode, img.size)
                     image_without_exif.putdata(data)
-                    img_io = io.BytesIO()
+                    img_io = output_buffer()
                     image_without_exif.save(img_io, fmt, quality=95)
                     img_io.seek(0)
             else:
@@ -2709,7 +3320,7 @@ def api_exif(current_user):
             logger.info(f"EXIF data removed successfully from {fmt} image")
             
             # Create Response with Headers
-            response = make_response(send_file(img_io, mimetype=f'image/{fmt.lower()}'))
+            response = send_output(img_io, f'image/{fmt.lower()}')
             response.headers['X-Credits-Cost'] = str(credit_cost)
             return response
             
@@ -2898,6 +3509,7 @@ def format_gps_coordinate(coord_tuple):
 @app.route('/api/upscale', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('upscale')
 def api_upscale(current_user):
     # Get cost from database
     cost = get_tool_cost('upscale')
@@ -2915,98 +3527,7 @@ def api_upscale(current_user):
     output_format = request.form.get('format', 'PNG').upper()
     
     try:
-        img = Image.open(file)
-        original_size = f"{img.width}x{img.height}"
-        
-        # Convert to RGB if necessary (for JPEG output)
-        if img.mode in ('RGBA', 'LA', 'P') and output_format == 'JPEG':
-            # Create white background
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB' and output_format == 'JPEG':
-            img = img.convert('RGB')
-        
-        new_width = img.width * factor
-        new_height = img.height * factor
-        
-        logger.info(f"Upscaling image: {original_size} -> {new_width}x{new_height} (factor={factor})")
-        
-        # Step 1: High-quality resize using LANCZOS
-        upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Step 2: Apply factor-based quality enhancements
-        if factor == 8:
-            # 8x: Maximum quality - most beautiful
-            logger.info("Applying 8x quality enhancements (maximum)")
-            
-            # High sharpness with UnsharpMask
-            upscaled = upscaled.filter(ImageFilter.UnsharpMask(radius=3, percent=200, threshold=2))
-            
-            # Detail enhancement (contrast boost)
-            enhancer = ImageEnhance.Contrast(upscaled)
-            upscaled = enhancer.enhance(1.15)  # 15% contrast boost
-            
-            # Brightness fine-tuning
-            enhancer = ImageEnhance.Brightness(upscaled)
-            upscaled = enhancer.enhance(1.05)  # 5% brightness boost
-            
-            # Sharpness enhancement
-            enhancer = ImageEnhance.Sharpness(upscaled)
-            upscaled = enhancer.enhance(1.3)  # 30% sharpness boost
-            
-            # Color saturation boost for vibrant colors
-            enhancer = ImageEnhance.Color(upscaled)
-            upscaled = enhancer.enhance(1.1)  # 10% saturation boost
-            
-        elif factor == 4:
-            # 4x: Medium quality
-            logger.info("Applying 4x quality enhancements (medium)")
-            
-            # Moderate sharpness
-            upscaled = upscaled.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
-            
-            # Moderate detail enhancement
-            enhancer = ImageEnhance.Contrast(upscaled)
-            upscaled = enhancer.enhance(1.1)  # 10% contrast boost
-            
-            # Sharpness enhancement
-            enhancer = ImageEnhance.Sharpness(upscaled)
-            upscaled = enhancer.enhance(1.2)  # 20% sharpness boost
-            
-            # Slight color boost
-            enhancer = ImageEnhance.Color(upscaled)
-            upscaled = enhancer.enhance(1.05)  # 5% saturation boost
-            
-        else:  # factor == 2
-            # 2x: Standard quality
-            logger.info("Applying 2x quality enhancements (standard)")
-            
-            # Light sharpness
-            upscaled = upscaled.filter(ImageFilter.UnsharpMask(radius=1.5, percent=120, threshold=3))
-            
-            # Minimal detail enhancement
-            enhancer = ImageEnhance.Contrast(upscaled)
-            upscaled = enhancer.enhance(1.05)  # 5% contrast boost
-            
-            # Light sharpness boost
-            enhancer = ImageEnhance.Sharpness(upscaled)
-            upscaled = enhancer.enhance(1.1)  # 10% sharpness boost
-            
-        # Save to buffer
-        img_io = io.BytesIO()
-        
-        # Set quality based on format
-        if output_format == 'JPEG':
-            upscaled.save(img_io, 'JPEG', quality=95, optimize=True)
-        else:  # PNG
-            upscaled.save(img_io, 'PNG', optimize=True)
-        
-        img_io.seek(0)
-        
-        logger.info(f"Upscale completed successfully with {factor}x quality enhancements")
+        img_io, mimetype = upscale_image(open_image_bytes(file.read()), factor, output_format, stream=True)
         
         # Update streak
         try:
@@ -3016,17 +3537,123 @@ def api_upscale(current_user):
             logger.error(f"[STREAK] Error: {e}")
         
         # Return with proper mimetype
-        mimetype = 'image/jpeg' if output_format == 'JPEG' else 'image/png'
-        response = make_response(send_file(img_io, mimetype=mimetype))
+        response = send_output(img_io, mimetype)
         response.headers['X-Credits-Cost'] = str(cost)
         return response
         
+    except ExecutorError as e:
+        return executor_error_response(e)
     except Exception as e:
         logger.error(f"Upscale operation failed: {str(e)}")
         logger.error(traceback.format_exc())
         return str(e), 500
 
 
+def upscale_image(img, factor, output_format, stream=False):
+    """
+    Upscale a PIL image with factor-based quality enhancements
+    
+    Args:
+        img: Source image
+        factor: Upscale factor
+        output_format: 'PNG' or 'JPEG'
+        stream: Return large PNG outputs as a generator that encodes while
+            the response is sent (see upscale_in_strips)
+    
+    Returns:
+        Tuple of (OutputBuffer or generator of chunks, mimetype)
+    """
+    original_size = f"{img.width}x{img.height}"
+    
+    # Convert to RGB if necessary (for JPEG output)
+    if img.mode in ('RGBA', 'LA', 'P') and output_format == 'JPEG':
+        # Create white background
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        img = background
+    elif img.mode != 'RGB' and output_format == 'JPEG':
+        img = img.convert('RGB')
+    
+    logger.info(f"Upscaling image: {original_size} -> {img.width * factor}x{img.height * factor} (factor={factor})")
+    
+    if img.width * factor * img.height * factor > config.TILE_THRESHOLD_PIXELS and img.mode in STRIP_MODES:
+        # Large output: never hold the full-resolution intermediates
+        logger.info(f"Upscaling in strips of ~{config.TILE_PIXELS} pixels")
+        img_io = upscale_in_strips(img, factor, output_format, stream=stream)
+    else:
+        upscaled = image_executor.run(enhance_upscaled, img, factor)
+        
+        # Save to buffer
+        img_io = output_buffer()
+        
+        # Set quality based on format
+        if output_format == 'JPEG':
+            upscaled.save(img_io, 'JPEG', quality=95, optimize=True)
+        else:  # PNG
+            save_png(upscaled, img_io, 'optimize')
+        
+        img_io.seek(0)
+    
+    logger.info(f"Upscale completed successfully with {factor}x quality enhancements")
+    
+    mimetype = 'image/jpeg' if output_format == 'JPEG' else 'image/png'
+    return img_io, mimetype
+
+
+# Rows of context a strip needs so UnsharpMask (radius <= 3) and the 3x3
+# sharpness filter see the same neighbours as in a full-image pass
+UPSCALE_STRIP_OVERLAP = 16
+
+
+def upscale_in_strips(img, factor, output_format, stream=False):
+    """
+    Upscale and encode an image strip by strip
+    
+    Each strip is resized straight from the source (LANCZOS with a source box
+    gives the same rows as the full resize) and run through the enhancement
+    chain, so no full-resolution intermediate is kept. PNG output is encoded
+    as the strips are produced; JPEG needs one assembled output image.
+    
+    The contrast step uses the mean gray level of the source image, which the
+    resize and unsharp mask preserve to within rounding.
+    
+    With stream=True, PNG output is returned as a generator instead: strips
+    are rendered and compressed as the response is sent, so the encoded
+    file is never held whole.
+    
+    Returns:
+        OutputBuffer with the encoded result, or a generator of PNG chunks
+    """
+    width, height = img.width * factor, img.height * factor
+    img.load()
+    mean = int(np.asarray(img.convert('L'), dtype=np.float64).mean() + 0.5)
+    
+    def render(top, bottom):
+        strip = img.resize(
+            (width, bottom - top),
+            Image.Resampling.LANCZOS,
+            box=(0, top / factor, img.width, bottom / factor)
+        )
+        return apply_upscale_enhancements(strip, factor, contrast_mean=mean)
+    
+    strips = render_strips(
+        (width, height),
+        render,
+        strip_height_for(width, config.TILE_PIXELS),
+        overlap=UPSCALE_STRIP_OVERLAP
+    )
+    
+    if stream and output_format == 'PNG':
+        return stream_png_strips(strips, (width, height), img.mode)
+    
+    img_io = output_buffer()
+    encode_strips(strips, (width, height), img.mode, output_format, img_io, quality=95, optimize=True)
+    img_io.seek(0)
+    return img_io
+
+
 @app.route('/crop')
 def crop():
     """Render the crop tool page"""
@@ -3035,6 +3662,7 @@ def crop():
 @app.route('/api/crop', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('crop')
 def api_crop(current_user):
     # Get cost from database
     cost = get_tool_cost('crop')
@@ -3061,44 +3689,22 @@ def api_crop(current_user):
         flip_h = request.form.get('flipH', 'false') == 'true'
         flip_v = request.form.get('flipV', 'false') == 'true'
         
-        img = Image.open(file)
-        original_size = f"{img.width}x{img.height}"
-        
-        # 1. Crop (using original coordinates)
-        img_width, img_height = img.size
-        left = max(0, min(x, img_width))
-        top = max(0, min(y, img_height))
-        right = max(0, min(x + width, img_width))
-        bottom = max(0, min(y + height, img_height))
+        data = file.read()
+        cache_key = result_cache.make_key('crop', data, {
+            'x': x, 'y': y, 'width': width, 'height': height,
+            'rotation': rotate, 'flipH': flip_h, 'flipV': flip_v
+        })
+        cached = result_cache.get(cache_key)
         
-        if right > left and bottom > top:
-            logger.info(f"Cropping image: {original_size} -> Box({left}, {top}, {right}, {bottom})")
-            img = img.crop((left, top, right, bottom))
+        if cached is None:
+            img_io, mimetype = crop_image(
+                open_image_bytes(data), x, y, width, height, rotate, flip_h, flip_v
+            )
+            cache_output(cache_key, img_io, mimetype)
         else:
-            logger.warning("Invalid crop dimensions, using full image")
-
-        # 2. Rotate
-        if rotate != 0:
-            # Negative because PIL rotates counter-clockwise by default, but UI usually implies clockwise logic
-            # However, usually, 90 deg in UI means clockwise. PIL .rotate(90) is counter-clockwise.
-            # Let's stick to standard PIL behavior or flip sign if UI feels wrong.
-            # Standard JS rotation often goes clockwise. PIL is CCW. 
-            # To match most UI expectations (Right = Clockwise):
-            img = img.rotate(-rotate, expand=True)
-            
-        # 3. Flip
-        if flip_h:
-            img = img.transpose(Image.FLIP_LEFT_RIGHT)
-        if flip_v:
-            img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            
-        # Save to buffer
-        img_io = io.BytesIO()
-        fmt = img.format if img.format else 'PNG'
-        img.save(img_io, fmt)
-        img_io.seek(0)
-        
-        logger.info("Crop completed successfully")
+            logger.info("Crop served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mimetype = cached.mimetype
         
         # Update streak
         try:
@@ -3108,8 +3714,9 @@ def api_crop(current_user):
             logger.error(f"[STREAK] Error: {e}")
         
         # Return response with Cost Header
-        response = make_response(send_file(img_io, mimetype=f'image/{fmt.lower()}'))
+        response = send_output(img_io, mimetype)
         response.headers['X-Credits-Cost'] = str(cost)
+        response.headers['X-Cache'] = 'MISS' if cached is None else 'HIT'
         return response
         
     except Exception as e:
@@ -3118,9 +3725,70 @@ def api_crop(current_user):
         return str(e), 500
 
 
+def crop_image(img, x, y, width, height, rotate=0, flip_h=False, flip_v=False):
+    """
+    Crop, rotate and flip a PIL image
+    
+    Args:
+        img: Image opened from the upload
+        x, y, width, height: Crop box in image coordinates
+        rotate: Clockwise rotation in degrees
+        flip_h, flip_v: Mirror horizontally / vertically
+    
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype)
+    """
+    img = crop_pixels(img, x, y, width, height, rotate, flip_h, flip_v)
+        
+    # Save to buffer
+    img_io = output_buffer()
+    fmt = img.format if img.format else 'PNG'
+    img.save(img_io, fmt)
+    img_io.seek(0)
+    
+    logger.info("Crop completed successfully")
+    return img_io, f'image/{fmt.lower()}'
+
+
+def crop_pixels(img, x, y, width, height, rotate=0, flip_h=False, flip_v=False):
+    """Crop, rotate and flip a PIL image without encoding it (see crop_image)"""
+    original_size = f"{img.width}x{img.height}"
+    
+    # 1. Crop (using original coordinates)
+    img_width, img_height = img.size
+    left = max(0, min(x, img_width))
+    top = max(0, min(y, img_height))
+    right = max(0, min(x + width, img_width))
+    bottom = max(0, min(y + height, img_height))
+    
+    if right > left and bottom > top:
+        logger.info(f"Cropping image: {original_size} -> Box({left}, {top}, {right}, {bottom})")
+        img = img.crop((left, top, right, bottom))
+    else:
+        logger.warning("Invalid crop dimensions, using full image")
+
+    # 2. Rotate
+    if rotate != 0:
+        # Negative because PIL rotates counter-clockwise by default, but UI usually implies clockwise logic
+        # However, usually, 90 deg in UI means clockwise. PIL .rotate(90) is counter-clockwise.
+        # Let's stick to standard PIL behavior or flip sign if UI feels wrong.
+        # Standard JS rotation often goes clockwise. PIL is CCW. 
+        # To match most UI expectations (Right = Clockwise):
+        img = img.rotate(-rotate, expand=True)
+        
+    # 3. Flip
+    if flip_h:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    if flip_v:
+        img = img.transpose(Image.FLIP_TOP_BOTTOM)
+    
+    return img
+
+
 @app.route('/api/watermark', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('watermark')
 def api_watermark(current_user):
     # Get cost from database
     cost = get_tool_cost('watermark')
@@ -3128,126 +3796,20 @@ def api_watermark(current_user):
     # Deduct credits
     deduct_result = credit_manager.deduct_credits(current_user['id'], 'watermark', cost)
     if not deduct_result['success']:
-        return jsonify(deduct_result), 402
-
-    if 'image' not in request.files:
-        return 'No image uploaded', 400
-    
-    file = request.files['image']
-    watermark_type = request.form.get('watermark_type', 'text')
-    
-    try:
-        img = Image.open(file).convert('RGBA')
-        
-        opacity = int(request.form.get('opacity', 70))
-        scale = int(request.form.get('scale', 100)) / 100
-        rotation = int(request.form.get('rotation', 0))
-        pos_x_percent = float(request.form.get('position_x', 50))
-        pos_y_percent = float(request.form.get('position_y', 50))
-        
-        # Calculate pixel position
-        pos_x = int(img.width * pos_x_percent / 100)
-        pos_y = int(img.height * pos_y_percent / 100)
-        
-        # Create transparent overlay
-        watermark_layer = Image.new('RGBA', img.size, (0,0,0,0))
-        draw = ImageDraw.Draw(watermark_layer)
-        
-        if watermark_type == 'text':
-            text = request.form.get('text', '© ImgCraft')
-            font_family = request.form.get('font_family', 'Arial')
-            font_size = int(request.form.get('font_size', 40))
-            color = request.form.get('color', '#ffffff')
-            
-            # --- FONT LOADING LOGIC ---
-            # 1. Map Names to Files (Assuming you have these in static/fonts/)
-            # If not, it falls back to default.
-            font_map = {
-                'Arial': 'arial.ttf',
-                'Times New Roman': 'times.ttf',
-                'Courier New': 'courier.ttf',
-                'Verdana': 'verdana.ttf',
-                'Impact': 'impact.ttf',
-                'Georgia': 'georgia.ttf'
-            }
-            
-            font_file = font_map.get(font_family, 'arial.ttf')
-            # Look in static folder (Standard for Flask)
-            font_path = os.path.join(app.static_folder, 'fonts', font_file)
-            
-            scaled_font_size = int(font_size * scale)
-            
-            try:
-                # Try loading from static/fonts
-                font = ImageFont.truetype(font_path, scaled_font_size)
-            except OSError:
-                try:
-                    # Fallback: Try loading system font by name (works on Linux/Mac/Win sometimes)
-                    font = ImageFont.truetype(font_family, scaled_font_size)
-                except OSError:
-                    # Final Fallback: Default PIL font (bitmap, size ignored)
-                    logger.warning("Font not found, using default")
-                    font = ImageFont.load_default()
-            
-            # Draw Text
-            color_rgb = tuple(int(color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-            
-            # Get text size
-            bbox = draw.textbbox((0, 0), text, font=font)
-            w = bbox[2] - bbox[0]
-            h = bbox[3] - bbox[1]
-            
-            # Create text image for rotation/opacity
-            txt_img = Image.new('RGBA', (w + 20, h + 20), (0,0,0,0))
-            d = ImageDraw.Draw(txt_img)
-            d.text((10, 10), text, font=font, fill=color_rgb + (255,))
-            
-            # Rotate
-            if rotation != 0:
-                txt_img = txt_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
-                
-            # Opacity
-            if opacity < 100:
-                alpha = txt_img.split()[3]
-                alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
-                txt_img.putalpha(alpha)
-                
-            # Paste (Centered on pos_x, pos_y)
-            paste_x = pos_x - txt_img.width // 2
-            paste_y = pos_y - txt_img.height // 2
-            watermark_layer.paste(txt_img, (paste_x, paste_y), txt_img)
-
-        elif watermark_type == 'image':
-             if 'watermark_image' in request.files:
-                wm_file = request.files['watermark_image']
-                wm_img = Image.open(wm_file).convert('RGBA')
-                
-                # Scale
-                new_w = int(wm_img.width * scale)
-                new_h = int(wm_img.height * scale)
-                wm_img = wm_img.resize((new_w, new_h), Image.LANCZOS)
-                
-                # Rotate
-                if rotation != 0:
-                    wm_img = wm_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
-                
-                # Opacity
-                if opacity < 100:
-                    alpha = wm_img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
-                    wm_img.putalpha(alpha)
-                
-                # Paste
-                paste_x = pos_x - wm_img.width // 2
-                paste_y = pos_y - wm_img.height // 2
-                watermark_layer.paste(wm_img, (paste_x, paste_y), wm_img)
-        
-        # Composite
-        result = Image.alpha_composite(img, watermark_layer)
+        return jsonify(deduct_result), 402
+
+    if 'image' not in request.files:
+        return 'No image uploaded', 400
+    
+    file = request.files['image']
+    
+    try:
+        img = load_image_safe(file)[0].convert('RGBA')
+        result = watermark_pixels(img, request.form, request.files.get('watermark_image'))
         
         # Save
-        output = io.BytesIO()
-        result.save(output, format='PNG')
+        output = output_buffer()
+        save_png(result, output, 'fast')
         output.seek(0)
         
         # Update streak
@@ -3257,7 +3819,7 @@ def api_watermark(current_user):
         except Exception as e:
             logger.error(f"[STREAK] Error: {e}")
         
-        response = make_response(send_file(output, mimetype='image/png'))
+        response = send_output(output, 'image/png')
         response.headers['X-Credits-Cost'] = str(cost)
         return response
 
@@ -3266,6 +3828,126 @@ def api_watermark(current_user):
         logger.error(traceback.format_exc())
         return str(e), 500
 
+
+def watermark_pixels(img, form, watermark_file=None):
+    """
+    Draw a text or image watermark onto an RGBA image
+    
+    Args:
+        img: RGBA PIL image
+        form: Watermark fields of the /api/watermark form
+        watermark_file: Uploaded watermark image (for watermark_type 'image')
+    
+    Returns:
+        Composited RGBA PIL image
+    """
+    watermark_type = form.get('watermark_type', 'text')
+    
+    opacity = int(form.get('opacity', 70))
+    scale = int(form.get('scale', 100)) / 100
+    rotation = int(form.get('rotation', 0))
+    pos_x_percent = float(form.get('position_x', 50))
+    pos_y_percent = float(form.get('position_y', 50))
+    
+    # Calculate pixel position
+    pos_x = int(img.width * pos_x_percent / 100)
+    pos_y = int(img.height * pos_y_percent / 100)
+    
+    # Create transparent overlay
+    watermark_layer = Image.new('RGBA', img.size, (0,0,0,0))
+    draw = ImageDraw.Draw(watermark_layer)
+    
+    if watermark_type == 'text':
+        text = form.get('text', '© ImgCraft')
+        font_family = form.get('font_family', 'Arial')
+        font_size = int(form.get('font_size', 40))
+        color = form.get('color', '#ffffff')
+        
+        # --- FONT LOADING LOGIC ---
+        # 1. Map Names to Files (Assuming you have these in static/fonts/)
+        # If not, it falls back to default.
+        font_map = {
+            'Arial': 'arial.ttf',
+            'Times New Roman': 'times.ttf',
+            'Courier New': 'courier.ttf',
+            'Verdana': 'verdana.ttf',
+            'Impact': 'impact.ttf',
+            'Georgia': 'georgia.ttf'
+        }
+        
+        font_file = font_map.get(font_family, 'arial.ttf')
+        # Look in static folder (Standard for Flask)
+        font_path = os.path.join(app.static_folder, 'fonts', font_file)
+        
+        scaled_font_size = int(font_size * scale)
+        
+        try:
+            # Try loading from static/fonts
+            font = ImageFont.truetype(font_path, scaled_font_size)
+        except OSError:
+            try:
+                # Fallback: Try loading system font by name (works on Linux/Mac/Win sometimes)
+                font = ImageFont.truetype(font_family, scaled_font_size)
+            except OSError:
+                # Final Fallback: Default PIL font (bitmap, size ignored)
+                logger.warning("Font not found, using default")
+                font = ImageFont.load_default()
+        
+        # Draw Text
+        color_rgb = tuple(int(color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+        
+        # Get text size
+        bbox = draw.textbbox((0, 0), text, font=font)
+        w = bbox[2] - bbox[0]
+        h = bbox[3] - bbox[1]
+        
+        # Create text image for rotation/opacity
+        txt_img = Image.new('RGBA', (w + 20, h + 20), (0,0,0,0))
+        d = ImageDraw.Draw(txt_img)
+        d.text((10, 10), text, font=font, fill=color_rgb + (255,))
+        
+        # Rotate
+        if rotation != 0:
+            txt_img = txt_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
+            
+        # Opacity
+        if opacity < 100:
+            alpha = txt_img.split()[3]
+            alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
+            txt_img.putalpha(alpha)
+            
+        # Paste (Centered on pos_x, pos_y)
+        paste_x = pos_x - txt_img.width // 2
+        paste_y = pos_y - txt_img.height // 2
+        watermark_layer.paste(txt_img, (paste_x, paste_y), txt_img)
+
+    elif watermark_type == 'image':
+        if watermark_file is not None:
+            wm_img = load_image_safe(watermark_file)[0].convert('RGBA')
+            
+            # Scale
+            new_w = int(wm_img.width * scale)
+            new_h = int(wm_img.height * scale)
+            wm_img = wm_img.resize((new_w, new_h), Image.LANCZOS)
+            
+            # Rotate
+            if rotation != 0:
+                wm_img = wm_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
+            
+            # Opacity
+            if opacity < 100:
+                alpha = wm_img.split()[3]
+                alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
+                wm_img.putalpha(alpha)
+            
+            # Paste
+            paste_x = pos_x - wm_img.width // 2
+            paste_y = pos_y - wm_img.height // 2
+            watermark_layer.paste(wm_img, (paste_x, paste_y), wm_img)
+    
+    # Composite
+    return Image.alpha_composite(img, watermark_layer)
+
 # ============================================================================
 # COLLAGE LAYOUT TEMPLATES
 # ============================================================================
@@ -3305,6 +3987,7 @@ LAYOUT_TEMPLATES = {
 @app.route('/api/collage', methods=['POST'])
 @require_auth
 @log_request
+@admission_control('collage')
 def api_collage(current_user):
     """AI-Powered Collage Generator - 13 credits"""
     
@@ -3325,7 +4008,7 @@ def api_collage(current_user):
         key = f'image{i}'
         if key in request.files:
             try:
-                img = Image.open(request.files[key])
+                img = open_image_checked(request.files[key])
                 images.append(img)
             except Exception as e:
                 logger.warning(f"Failed to open image {i}: {str(e)}")
@@ -3363,15 +4046,23 @@ def api_collage(current_user):
         
         template = LAYOUT_TEMPLATES.get(layout_id, LAYOUT_TEMPLATES['layout_2_v'])
         
+        # Decode each image only as large as its slot needs
+        images = [
+            load_image_safe(img, target_size=collage_slot_box(slot, spacing)[2:], reducing_gap=2.0)[0]
+            for img, slot in zip(images, template)
+        ]
+        
         # Generate the collage
-        collage_img = create_template_collage(images, template, spacing, background, corner_radius)
+        collage_img = image_executor.run(
+            create_template_collage, images, template, spacing, background, corner_radius
+        )
         
         # Apply Filters
         collage_img = apply_collage_filters(collage_img, filter_type)
         
         # Return result
-        img_io = io.BytesIO()
-        collage_img.save(img_io, 'PNG', quality=95)
+        img_io = output_buffer()
+        save_png(collage_img, img_io, 'fast')
         img_io.seek(0)
         
         # Update streak
@@ -3383,10 +4074,12 @@ def api_collage(current_user):
         except Exception as e:
             logger.error(f"[STREAK] Error: {e}")
 
-        response = make_response(send_file(img_io, mimetype='image/png'))
+        response = send_output(img_io, 'image/png')
         response.headers['X-Credits-Cost'] = str(cost)
         return response
         
+    except ExecutorError as e:
+        return executor_error_response(e)
     except Exception as e:
         logger.error(f"Collage generation failed: {str(e)}")
         logger.error(traceback.format_exc())
@@ -3437,97 +4130,6 @@ def api_annotation(current_user):
         logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def create_template_collage(images, template, spacing, background, corner_radius):
-    """
-    Creates a collage based on a normalized grid template (0.0-1.0 coords).
-    Applies spacing to ALL sides (Outer Padding + Inner Gaps).
-    """
-    # Canvas Settings
-    CANVAS_WIDTH = 1200
-    CANVAS_HEIGHT = 1200 
-    
-    # Create Background
-    if background == 'transparent':
-        canvas = Image.new('RGBA', (CANVAS_WIDTH, CANVAS_HEIGHT), (0, 0, 0, 0))
-    elif background == 'white':
-        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (255, 255, 255))
-    elif background == 'black':
-        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (0, 0, 0))
-    elif background == 'gradient':
-        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (20, 20, 20))
-        # Simple diagonal gradient
-        draw = ImageDraw.Draw(canvas)
-        for i in range(CANVAS_HEIGHT):
-            r = int(20 + (i/CANVAS_HEIGHT)*30)
-            g = int(20 + (i/CANVAS_HEIGHT)*40)
-            b = int(40 + (i/CANVAS_HEIGHT)*60)
-            draw.line([(0, i), (CANVAS_WIDTH, i)], fill=(r,g,b))
-    else:
-        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (255, 255, 255))
-
-    # Iterate slots
-    for idx, slot in enumerate(template):
-        if idx >= len(images): break
-        
-        img = images[idx]
-        
-        # Parse slot (x, y, w, h) in %
-        sx, sy, sw, sh = slot
-        
-        # --- NEW SPACING LOGIC ---
-        # Apply spacing to X and Y offset (Push image in)
-        pixel_x = int(sx * CANVAS_WIDTH) + spacing
-        pixel_y = int(sy * CANVAS_HEIGHT) + spacing
-        
-        # Subtract 2x spacing from Width and Height (Shrink image to make room for padding on both sides)
-        pixel_w = int(sw * CANVAS_WIDTH) - (2 * spacing)
-        pixel_h = int(sh * CANVAS_HEIGHT) - (2 * spacing)
-        
-        # Ensure positive dimensions
-        if pixel_w < 1: pixel_w = 1
-        if pixel_h < 1: pixel_h = 1
-        
-        # Smart Crop & Resize Image to fit Slot
-        img_ratio = img.width / img.height
-        slot_ratio = pixel_w / pixel_h
-        
-        if img_ratio > slot_ratio:
-            # Image is wider than slot: crop sides
-            new_height = pixel_h
-            new_width = int(new_height * img_ratio)
-            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            # Center crop
-            left = (new_width - pixel_w) // 2
-            resized = resized.crop((left, 0, left + pixel_w, pixel_h))
-        else:
-            # Image is taller than slot: crop top/bottom
-            new_width = pixel_w
-            new_height = int(new_width / img_ratio)
-            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            # Center crop
-            top = (new_height - pixel_h) // 2
-            resized = resized.crop((0, top, pixel_w, top + pixel_h))
-            
-        # Apply Corner Radius
-        if corner_radius > 0:
-            mask = Image.new("L", (pixel_w, pixel_h), 0)
-            draw = ImageDraw.Draw(mask)
-            draw.rounded_rectangle((0, 0, pixel_w, pixel_h), radius=corner_radius, fill=255)
-            
-            # Create a transparent container for the rounded image
-            container = Image.new('RGBA', (pixel_w, pixel_h), (0,0,0,0))
-            container.paste(resized, (0,0))
-            container.putalpha(mask)
-            resized = container
-            
-        # Paste into Canvas
-        if resized.mode == 'RGBA':
-            canvas.paste(resized, (pixel_x, pixel_y), resized)
-        else:
-            canvas.paste(resized, (pixel_x, pixel_y))
-            
-    return canvas
-
 def apply_collage_filters(image, filter_type):
     if filter_type == 'none': return image
     
@@ -3746,6 +4348,571 @@ def apply_collage_filters(image, filter_type):
 #             'message': 'Webhook processing failed'
 #         }), 500
 
+# ============================================================================
+# TOOL RUNNERS (BACKGROUND JOBS AND BATCHES)
+# ============================================================================
+
+def _run_resize(image_bytes, form, extra):
+    img_io, mimetype, _ = resize_image(image_bytes, resize_params(form))
+    return img_io, mimetype
+
+
+def _run_compress(image_bytes, form, extra):
+    target = compress_target_params(form)
+    min_ssim = compress_min_ssim(form)
+    if min_ssim is not None:
+        img_io, mimetype, _ = compress_to_similarity(open_image_bytes(image_bytes), min_ssim)
+        return img_io, mimetype
+    if target:
+        img_io, mimetype, _ = compress_to_target(
+            open_image_bytes(image_bytes), target['target_bytes'], target['allow_scale'],
+            dither=form.get('dither', 'none')
+        )
+        return img_io, mimetype
+    return compress_image(open_image_bytes(image_bytes), int(form.get('quality', 80)), form.get('dither', 'none'))
+
+
+def _run_convert(image_bytes, form, extra):
+    return convert_image(open_image_bytes(image_bytes), form.get('format', 'PNG').upper())
+
+
+def _run_crop(image_bytes, form, extra):
+    return crop_image(
+        open_image_bytes(image_bytes),
+        float(form.get('x', 0)),
+        float(form.get('y', 0)),
+        float(form.get('width', 0)),
+        float(form.get('height', 0)),
+        int(form.get('rotation', 0)),
+        form.get('flipH', 'false') == 'true',
+        form.get('flipV', 'false') == 'true'
+    )
+
+
+def _run_upscale(image_bytes, form, extra):
+    factor = int(form.get('factor', 2))
+    output_format = form.get('format', 'PNG').upper()
+    return upscale_image(open_image_bytes(image_bytes), factor, output_format)
+
+
+def _run_remove_bg(image_bytes, form, extra):
+    return remove_background_image(open_image_bytes(image_bytes, max_side=REMOVE_BG_MAX_SIDE))
+
+
+def _run_filter(image_bytes, form, extra):
+    return filter_image(open_image_bytes(image_bytes), extra['filter_data'], extra.get('custom_lut'))
+
+
+# Tools that can run outside their own endpoint: tool name -> runner(image_bytes, form, extra)
+TOOL_RUNNERS = {
+    'resize': _run_resize,
+    'compress': _run_compress,
+    'convert': _run_convert,
+    'crop': _run_crop,
+    'upscale': _run_upscale,
+    'remove_bg': _run_remove_bg,
+    'filter': _run_filter
+}
+
+# Tools that can run as background jobs
+JOB_TOOLS = {name: TOOL_RUNNERS[name] for name in ('upscale', 'remove_bg', 'filter')}
+
+
+def parse_tool_extra(tool):
+    """
+    Parse the request fields a runner needs beyond the plain form values
+    
+    Returns:
+        Dictionary passed to the runner as `extra`
+    
+    Raises:
+        ValueError with a user-facing message if a field is invalid
+    """
+    extra = {}
+    if tool == 'filter':
+        import json
+        try:
+            extra['filter_data'] = json.loads(request.form.get('filterData', '{}'))
+        except ValueError:
+            raise ValueError('Invalid filterData')
+        lut_file = request.files.get('lut')
+        if lut_file and lut_file.filename:
+            try:
+                extra['custom_lut'] = color_lut_engine.load_cube(lut_file.read())
+            except ValueError as e:
+                raise ValueError(f'Invalid .cube LUT: {str(e)}')
+    return extra
+
+
+# ============================================================================
+# BACKGROUND JOBS (LONG-RUNNING TOOLS)
+# ============================================================================
+
+@app.route('/api/jobs/<tool>', methods=['POST'])
+@require_auth
+@log_request
+def submit_job(current_user, tool):
+    """
+    Submit a long-running tool as a background job
+    Accepts the same form fields as the tool's synchronous endpoint
+    Credits are deducted only if the job is accepted
+    """
+    if tool not in JOB_TOOLS:
+        return jsonify({'success': False, 'error': f'Tool {tool} cannot run as a job'}), 404
+    
+    if 'image' not in request.files:
+        logger.warning(f"Job request for {tool} missing image file")
+        return jsonify({'success': False, 'error': 'No image uploaded'}), 400
+    
+    form = request.form.to_dict()
+    try:
+        extra = parse_tool_extra(tool)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Jobs wait for memory headroom in the worker, but one that can never fit is refused now
+    try:
+        memory_estimate = estimate_peak_bytes(tool, uploaded_image_headers(), request.form)
+    except ImageTooLarge as e:
+        return image_too_large_response(e)
+    if memory_estimate > memory_budget.budget_bytes:
+        return admission_rejected_response(AdmissionRejected(
+            'This image is too large to process with these settings',
+            config.ADMISSION_RETRY_AFTER_SECONDS,
+            never_fits=True
+        ))
+    
+    image_bytes = request.files['image'].read()
+    cost = get_tool_cost(tool)
+    
+    # Reserve a queue slot first so credits are only taken for accepted jobs
+    try:
+        job_manager.reserve()
+    except JobQueueFull as e:
+        logger.warning(f"[JOBS] Rejected {tool} job: {str(e)}")
+        response = make_response(jsonify({
+            'success': False,
+            'error': 'Server is busy',
+            'message': 'Too many jobs are running. Please try again shortly.'
+        }), 503)
+        response.headers['Retry-After'] = str(config.JOB_RETRY_AFTER_SECONDS)
+        return response
+    
+    deduct_result = credit_manager.deduct_credits(current_user['id'], tool, cost)
+    if not deduct_result['success']:
+        job_manager.release()
+        return jsonify(deduct_result), 402
+    
+    user_id = current_user['id']
+    runner = JOB_TOOLS[tool]
+    
+    def run():
+        try:
+            reservation = memory_budget.reserve(memory_estimate, tool, timeout=config.JOB_ADMISSION_WAIT_SECONDS)
+        except AdmissionRejected:
+            # The job never ran, so it is not charged
+            refund_credits(user_id, cost, f'{tool} job found no memory headroom')
+            raise
+        with reservation:
+            img_io, mimetype = runner(image_bytes, form, extra)
+        try:
+            StreakManager().update_streak(user_id)
+        except Exception as e:
+            logger.error(f"[STREAK] Error: {e}")
+        return img_io, mimetype, {'X-Credits-Cost': str(cost)}
+    
+    try:
+        # submit gives the queue slot back itself if it fails
+        job = job_manager.submit(user_id, tool, run)
+    except Exception as e:
+        logger.error(f"[JOBS] Could not start {tool} job: {str(e)}")
+        refund_credits(user_id, cost, f'{tool} job could not be started')
+        return jsonify({'success': False, 'error': 'Could not start the job'}), 500
+    
+    response = make_response(jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}/status',
+        'result_url': f'/api/jobs/{job.id}/result'
+    }), 202)
+    response.headers['X-Credits-Cost'] = str(cost)
+    return response
+
+
+@app.route('/api/jobs/<job_id>/status', methods=['GET'])
+@require_auth
+def get_job_status(current_user, job_id):
+    """Poll the status of a background job"""
+    job = job_manager.get(job_id, current_user['id'])
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+    
+    data = job.to_dict()
+    data['success'] = True
+    if job.status == 'done':
+        data['result_url'] = f'/api/jobs/{job.id}/result'
+    return jsonify(data), 200
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@require_auth
+def get_job_result(current_user, job_id):
+    """Download the result of a finished background job"""
+    job = job_manager.get(job_id, current_user['id'])
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+    
+    if job.status == 'failed':
+        return jsonify({'success': False, 'status': job.status, 'error': job.error}), 500
+    if job.status != 'done':
+        return jsonify({'success': False, 'status': job.status, 'error': 'Job is not finished yet'}), 409
+    
+    try:
+        response = make_response(send_file(job.result_path, mimetype=job.mimetype))
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Job not found or expired'}), 404
+    for name, value in job.headers.items():
+        response.headers[name] = value
+    return response
+
+
+# ============================================================================
+# BATCH PROCESSING
+# ============================================================================
+
+@app.route('/api/batch/<tool>', methods=['POST'])
+@require_auth
+@log_request
+def api_batch(current_user, tool):
+    """
+    Run one tool over many images and stream back a ZIP of the results
+    
+    Accepts any number of files in 'images' (or 'image'), and/or ZIP archives
+    of images, plus the same form fields as the tool's own endpoint. Credits
+    are deducted once for every image that can be processed (free tools
+    cost nothing, as on their own endpoints), and items that then fail are
+    refunded when the stream ends; the archive ends with a manifest.json
+    listing each item's output or error and the credits finally charged.
+    """
+    if tool not in TOOL_RUNNERS:
+        return jsonify({'success': False, 'error': f'Tool {tool} does not support batches'}), 404
+    
+    uploads = request.files.getlist('images') + request.files.getlist('image')
+    if not uploads:
+        logger.warning(f"Batch request for {tool} missing image files")
+        return jsonify({'success': False, 'error': 'No images uploaded'}), 400
+    
+    try:
+        extra = parse_tool_extra(tool)
+        items = expand_uploads(
+            uploads,
+            config.ALLOWED_EXTENSIONS,
+            config.BATCH_MAX_ITEMS,
+            config.MAX_CONTENT_LENGTH,
+            config.BATCH_MAX_TOTAL_MB * 1024 * 1024
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if not items:
+        return jsonify({'success': False, 'error': 'No images found in the upload'}), 400
+    
+    form = request.form.to_dict()
+    runner = TOOL_RUNNERS[tool]
+    
+    # Read every header up front: unreadable or never-fitting images are
+    # reported in the manifest and not charged
+    for item in items:
+        if item.error:
+            continue
+        try:
+            with item.open() as source:
+                img = open_image_checked(source)
+            item.estimate = estimate_peak_bytes(tool, [(img.size, img.mode)], form)
+        except ImageTooLarge as e:
+            item.error = str(e)
+            continue
+        except Exception:
+            item.error = 'Not a readable image'
+            continue
+        if item.estimate > memory_budget.budget_bytes:
+            item.error = 'This image is too large to process with these settings'
+    
+    accepted = sum(1 for item in items if item.error is None)
+    cost = get_charged_cost(tool) * accepted
+    
+    if cost > 0:
+        deduct_result = credit_manager.deduct_credits(current_user['id'], tool, cost)
+        if not deduct_result['success']:
+            return jsonify(deduct_result), 402
+    
+    logger.info(f"[BATCH] {tool}: {accepted}/{len(items)} images accepted, {cost} credits")
+    
+    if accepted:
+        try:
+            StreakManager().update_streak(current_user['id'])
+        except Exception as e:
+            logger.error(f"[STREAK] Error: {e}")
+    
+    user_id = current_user['id']
+    unit_cost = cost // accepted if accepted else 0
+    
+    def process(item):
+        with memory_budget.reserve(item.estimate, tool):
+            return runner(item.read(), form, extra)
+    
+    def settle(entries):
+        # Items that were charged but failed or never ran are refunded
+        succeeded = sum(1 for entry in entries if entry['status'] == 'done')
+        refund = unit_cost * (accepted - succeeded)
+        if refund and not refund_credits(user_id, refund, f'{accepted - succeeded} failed {tool} batch items'):
+            refund = 0
+        return {'credits_charged': cost - refund, 'credits_refunded': refund}
+    
+    stream = stream_batch_zip(
+        items,
+        process,
+        config.BATCH_WORKERS,
+        manifest_extra={'tool': tool},
+        on_finish=settle
+    )
+    
+    response = Response(stream, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=imgcraft-{tool}-batch.zip'
+    response.headers['X-Credits-Cost'] = str(cost)
+    response.headers['X-Batch-Items'] = str(len(items))
+    response.headers['X-Batch-Accepted'] = str(accepted)
+    return response
+
+
+# ============================================================================
+# PIPELINE (SEVERAL TOOLS, ONE DECODE AND ONE ENCODE)
+# ============================================================================
+
+# Steps that change pixels, in any order
+PIPELINE_PIXEL_STEPS = ('crop', 'resize', 'filter', 'watermark')
+
+# Steps that only choose the final encoding; they must come after every pixel step
+PIPELINE_ENCODE_STEPS = ('compress', 'convert')
+
+PIPELINE_MAX_STEPS = 12
+
+
+def parse_pipeline(operations_str):
+    """
+    Validate the 'operations' field of /api/pipeline
+    
+    Args:
+        operations_str: JSON list of steps, e.g.
+            [{"op": "crop", "x": 0, "y": 0, "width": 800, "height": 600},
+             {"op": "filter", "filterData": {"preset": "vivid"}},
+             {"op": "compress", "quality": 80}]
+    
+    Returns:
+        List of step dictionaries
+    
+    Raises:
+        ValueError with a user-facing message if the list is invalid
+    """
+    import json
+    
+    try:
+        steps = json.loads(operations_str or '[]')
+    except ValueError:
+        raise ValueError('Invalid operations')
+    
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('operations must be a non-empty list')
+    if len(steps) > PIPELINE_MAX_STEPS:
+        raise ValueError(f'Too many operations (max {PIPELINE_MAX_STEPS})')
+    
+    encoding = False
+    for index, step in enumerate(steps):
+        op = step.get('op') if isinstance(step, dict) else None
+        if op in PIPELINE_ENCODE_STEPS:
+            if any(isinstance(other, dict) and other.get('op') == op for other in steps[index + 1:]):
+                raise ValueError(f'{op} can only appear once')
+            encoding = True
+        elif op in PIPELINE_PIXEL_STEPS:
+            if encoding:
+                raise ValueError(f'{op} must come before compress and convert')
+            if op == 'filter' and not isinstance(step.get('filterData', {}), dict):
+                raise ValueError('filterData must be an object')
+        else:
+            raise ValueError(f'Unknown operation at position {index + 1}: {op}')
+    
+    return steps
+
+
+def pipeline_is_deterministic(steps):
+    """Check whether a pipeline always gives the same output (see filter_is_deterministic)"""
+    return all(
+        filter_is_deterministic(step.get('filterData', {}))
+        for step in steps if step['op'] == 'filter'
+    )
+
+
+def run_pipeline(img, steps, custom_lut=None, watermark_data=b''):
+    """
+    Run pipeline steps on one decoded image and encode the result once
+    
+    The output keeps the source format unless a convert step picks another
+    one; compress sets the quality of that single encode.
+    
+    Args:
+        img: Image opened from the upload
+        steps: Output of parse_pipeline
+        custom_lut: Optional Color3DLUT used by filter steps
+        watermark_data: Watermark image bytes used by image watermark steps
+    
+    Returns:
+        Tuple of (OutputBuffer with the encoded result, mimetype)
+    """
+    target_format = (img.format or 'PNG').upper()
+    quality = None
+    
+    for step in steps:
+        op = step['op']
+        logger.info(f"[PIPELINE] {op} on {img.width}x{img.height}")
+        if op == 'crop':
+            img = crop_pixels(
+                img,
+                float(step.get('x', 0)),
+                float(step.get('y', 0)),
+                float(step.get('width', 0)),
+                float(step.get('height', 0)),
+                int(step.get('rotation', 0)),
+                step.get('flipH') in (True, 'true'),
+                step.get('flipV') in (True, 'true')
+            )
+        elif op == 'resize':
+            img = resize_pixels(img, resize_params(step))
+        elif op == 'filter':
+            img = filter_pixels(img, step.get('filterData', {}), custom_lut)
+        elif op == 'watermark':
+            watermark_file = io.BytesIO(watermark_data) if watermark_data else None
+            img = watermark_pixels(img.convert('RGBA'), step, watermark_file)
+        elif op == 'convert':
+            target_format = str(step.get('format', 'PNG')).upper()
+        elif op == 'compress':
+            quality = int(step.get('quality', 80))
+    
+    if target_format == 'JPG':
+        target_format = 'JPEG'
+    img = prepare_for_format(img, target_format)
+    
+    if quality is not None:
+        img.format = target_format
+        return compress_image(img, quality)
+    
+    if target_format in ('JPEG', 'WEBP'):
+        # Same quality the single-step tools use for lossy output
+        img_io = output_buffer()
+        img.save(img_io, target_format, quality=95)
+        img_io.seek(0)
+        return img_io, f'image/{target_format.lower()}'
+    
+    return convert_image(img, target_format)
+
+
+def pipeline_cost(steps):
+    """Credits for a pipeline: the sum of its steps' charged costs (free tools cost nothing)"""
+    return sum(get_charged_cost(step['op']) for step in steps)
+
+
+@app.route('/api/pipeline', methods=['POST'])
+@require_auth
+@log_request
+@admission_control('pipeline')
+def api_pipeline(current_user):
+    """
+    Run several tools on one image in a single request
+    
+    The image is decoded once, every step works on the decoded pixels and the
+    result is encoded once, so there is no generation loss between steps.
+    
+    Form fields:
+        image: Source image (or image_handle)
+        operations: JSON list of steps (see parse_pipeline); crop, resize,
+            filter and watermark steps take the same fields as their own
+            endpoints (filter takes filterData as an object)
+        lut: Optional .cube LUT for filter steps
+        watermark_image: Optional watermark for image watermark steps
+    
+    Cost: sum of the steps' tool costs
+    """
+    if 'image' not in request.files:
+        logger.warning("Pipeline request missing image file")
+        return jsonify({'success': False, 'error': 'No image uploaded'}), 400
+    
+    try:
+        steps = parse_pipeline(request.form.get('operations'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    custom_lut = None
+    lut_data = b''
+    lut_file = request.files.get('lut')
+    if lut_file and lut_file.filename:
+        lut_data = lut_file.read()
+        try:
+            custom_lut = color_lut_engine.load_cube(lut_data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid .cube LUT: {str(e)}'}), 400
+    
+    watermark_file = request.files.get('watermark_image')
+    watermark_data = watermark_file.read() if watermark_file else b''
+    
+    cost = pipeline_cost(steps)
+    deduct_result = credit_manager.deduct_credits(current_user['id'], 'pipeline', cost)
+    if not deduct_result['success']:
+        return jsonify(deduct_result), 402
+    
+    try:
+        data = request.files['image'].read()
+        
+        cache_key = None
+        cached = None
+        if pipeline_is_deterministic(steps):
+            cache_key = result_cache.make_key('pipeline', data + lut_data + watermark_data, {
+                'operations': steps,
+                'lutBytes': len(lut_data),
+                'watermarkBytes': len(watermark_data)
+            })
+            cached = result_cache.get(cache_key)
+        
+        if cached is None:
+            try:
+                img_io, mimetype = run_pipeline(open_image_bytes(data), steps, custom_lut, watermark_data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if cache_key:
+                cache_output(cache_key, img_io, mimetype)
+        else:
+            logger.info("Pipeline served from result cache")
+            img_io = io.BytesIO(cached.data)
+            mimetype = cached.mimetype
+        
+        try:
+            StreakManager().update_streak(current_user['id'])
+        except Exception as e:
+            logger.error(f"[STREAK] Error: {e}")
+        
+        response = send_output(img_io, mimetype)
+        response.headers['X-Credits-Cost'] = str(cost)
+        response.headers['X-Pipeline-Steps'] = ','.join(step['op'] for step in steps)
+        response.headers['X-Cache'] = 'HIT' if cached is not None else ('MISS' if cache_key else 'BYPASS')
+        return response
+        
+    except ExecutorError as e:
+        return executor_error_response(e)
+    except Exception as e:
+        logger.error(f"Pipeline failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/log', methods=['POST'])
 def api_log():
     """Endpoint for client-side logging"""
@@ -4400,6 +5567,30 @@ def health_check():
     }), 200
 
 
+@app.route('/api/metrics', methods=['GET'])
+@require_auth
+def metrics(current_user):
+    """Runtime statistics for the image processing subsystems (admins only)"""
+    from admin_config import is_admin
+    
+    if not is_admin(current_user.get('email', '')):
+        return jsonify({'success': False, 'error': 'Admin only'}), 403
+    
+    return jsonify({
+        'models': model_registry.stats(),
+        'auth_token_cache': verified_token_cache.stats(),
+        'jobs': job_manager.stats(),
+        'executor': image_executor.stats(),
+        'result_cache': result_cache.stats(),
+        'memory': memory_budget.stats(),
+        'image_handles': image_handles.stats(),
+        'decode': decode_stats(),
+        'png_optimizer': png_optimizer.stats(),
+        'filter_pipeline': filter_stage_stats(),
+        'timestamp': datetime.utcnow().isoformat()
+    }), 200
+
+
 @app.route('/api/check-first-visit', methods=['POST'])
 def check_first_visit():
     """Check if this is user's first visit based on IP address"""
@@ -4469,6 +5660,15 @@ def internal_server_error(e):
 def chrome_devtools():
     return jsonify({}), 200
 
+# Start the image worker processes (if enabled); they come from a fork server,
+# never from this already multithreaded process. Workers re-run a __main__
+# script, so when this file is run directly (python app.py) image work stays
+# inline; serve it with gunicorn (app:app) to use the process backend
+if __name__ == '__main__' and image_executor.backend == 'process':
+    logger.warning("[EXECUTOR] The process backend needs the app served by gunicorn, running image work inline")
+    image_executor = InlineExecutor()
+image_executor.start()
+
 # ============================================================================
 # APPLICATION ENTRY POINT
 # ============================================================================
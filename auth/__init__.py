@@ -4,6 +4,7 @@ Auth module initialization
 from auth.supabase_client import (
     get_supabase_client,
     verify_jwt_token,
+    invalidate_token,
     get_user_by_id,
     get_user_credits,
     supabase_admin,
@@ -21,6 +22,7 @@ from auth.middleware import (
 __all__ = [
     'get_supabase_client',
     'verify_jwt_token',
+    'invalidate_token',
     'get_user_by_id',
     'get_user_credits',
     'supabase_admin',
@@ -1,7 +1,15 @@
 """
 Supabase client configuration and initialization
 """
+import hashlib
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -13,6 +21,23 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
 
+# Local JWT verification
+# HS256 tokens are checked against the project's JWT secret; asymmetric
+# tokens (RS256/ES256) against the project's JWKS, whose keys are cached.
+SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+SUPABASE_JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUDIENCE', 'authenticated')
+JWKS_CACHE_SECONDS = int(os.getenv('JWKS_CACHE_SECONDS', 600))
+JWT_CACHE_SIZE = int(os.getenv('JWT_CACHE_SIZE', 1024))
+# Verified tokens are remembered for at most this long (never past their exp).
+# Revocation tradeoff: logout only evicts the token on the worker that served
+# it, so other workers keep accepting a logged-out or revoked token from their
+# cache for up to this many seconds. Keep it well below the token lifetime;
+# 0 disables the cache.
+JWT_CACHE_TTL_SECONDS = int(os.getenv('JWT_CACHE_TTL_SECONDS', 60))
+JWT_LEEWAY_SECONDS = int(os.getenv('JWT_LEEWAY_SECONDS', 10))
+
+logger = logging.getLogger('imgcraft')
+
 # Validate configuration
 if not SUPABASE_URL or not SUPABASE_ANON_KEY or not SUPABASE_SERVICE_KEY:
     raise ValueError(
@@ -27,6 +52,76 @@ supabase_anon: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 # Service client - for server-side operations (full permissions)
 supabase_admin: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+# JWKS client - fetches the project's public signing keys and caches them
+_jwks_client = jwt.PyJWKClient(
+    f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json",
+    cache_keys=True,
+    lifespan=JWKS_CACHE_SECONDS,
+    headers={'apikey': SUPABASE_ANON_KEY},
+    timeout=5
+)
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified tokens, keyed by token hash and expiring after ttl seconds or at the token's exp"""
+
+    def __init__(self, max_size: int, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(user)
+
+    def put(self, token: str, user: dict, expires_at: float) -> None:
+        now = time.time()
+        if self.max_size <= 0 or self.ttl <= 0 or now >= expires_at:
+            return
+        expires_at = min(expires_at, now + self.ttl)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, dict(user))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+verified_token_cache = VerifiedTokenCache(JWT_CACHE_SIZE, JWT_CACHE_TTL_SECONDS)
+
 
 def get_supabase_client(use_service_role=False) -> Client:
     """
@@ -42,10 +137,69 @@ def get_supabase_client(use_service_role=False) -> Client:
     return supabase_admin if use_service_role else supabase_anon
 
 
+def _user_from_claims(claims: dict) -> dict:
+    """Build the user dictionary the routes expect from verified JWT claims"""
+    return {
+        'id': claims['sub'],
+        'aud': claims.get('aud'),
+        'role': claims.get('role'),
+        'email': claims.get('email', ''),
+        'phone': claims.get('phone', ''),
+        'app_metadata': claims.get('app_metadata') or {},
+        'user_metadata': claims.get('user_metadata') or {},
+        'is_anonymous': claims.get('is_anonymous', False)
+    }
+
+
+def _decode_locally(token: str) -> Optional[dict]:
+    """
+    Verify a token's signature and claims without calling Supabase
+    
+    Args:
+        token: JWT token string
+    
+    Returns:
+        Verified claims, or None if the token cannot be verified locally
+        (no JWT secret configured, or signing keys unavailable)
+    
+    Raises:
+        jwt.InvalidTokenError if the token is invalid
+    """
+    algorithm = jwt.get_unverified_header(token).get('alg')
+    
+    if algorithm == 'HS256':
+        if not SUPABASE_JWT_SECRET:
+            return None
+        key = SUPABASE_JWT_SECRET
+    elif algorithm in ('RS256', 'ES256'):
+        try:
+            key = _jwks_client.get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientError as e:
+            logger.warning(f"[AUTH] JWKS unavailable, falling back to Supabase: {str(e)}")
+            return None
+    else:
+        raise jwt.InvalidTokenError(f"Unsupported token algorithm: {algorithm}")
+    
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[algorithm],
+        audience=SUPABASE_JWT_AUDIENCE,
+        leeway=JWT_LEEWAY_SECONDS,
+        options={'require': ['exp', 'sub']}
+    )
+
+
 def verify_jwt_token(token: str) -> dict:
     """
     Verify JWT token from Supabase Auth
     
+    Tokens are verified locally against the project's JWT secret or JWKS and
+    remembered for up to JWT_CACHE_TTL_SECONDS, so most requests need no
+    Supabase round trip (see JWT_CACHE_TTL_SECONDS for the revocation tradeoff).
+    Falls back to supabase_admin.auth.get_user when local verification is
+    not possible.
+    
     Args:
         token: JWT token string
     
@@ -55,14 +209,39 @@ def verify_jwt_token(token: str) -> dict:
     Raises:
         Exception if token is invalid
     """
+    cached_user = verified_token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    
     try:
-        # Use admin client to verify token
-        user = supabase_admin.auth.get_user(token)
-        return user.user.model_dump() if user.user else None
+        claims = _decode_locally(token)
+        if claims is not None:
+            user_data = _user_from_claims(claims)
+        else:
+            # Use admin client to verify token
+            user = supabase_admin.auth.get_user(token)
+            if not user.user:
+                return None
+            user_data = user.user.model_dump()
+            # Supabase accepted the token, so its exp claim can be trusted
+            claims = jwt.decode(token, options={'verify_signature': False})
+        
+        verified_token_cache.put(token, user_data, float(claims.get('exp', 0)))
+        return user_data
     except Exception as e:
         raise Exception(f"Invalid token: {str(e)}")
 
 
+def invalidate_token(token: str) -> None:
+    """
+    Forget a previously verified token (e.g. on logout)
+    
+    Args:
+        token: JWT token string
+    """
+    verified_token_cache.discard(token)
+
+
 def get_user_by_id(user_id: str) -> dict:
     """
     Get user data by user ID
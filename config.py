@@ -43,6 +43,92 @@ class Config:
     MAX_COLLAGE_IMAGES: int = int(os.getenv('MAX_COLLAGE_IMAGES', 6))
     MAX_COLLAGE_SIDE: int = int(os.getenv('MAX_COLLAGE_SIDE', 4000))
 
+    # Background removal models (loaded once per worker and shared)
+    REMBG_MODEL: str = os.getenv('REMBG_MODEL', 'u2netp')
+    REMBG_WARM_MODELS: List[str] = field(default_factory=lambda: [
+        name.strip() for name in os.getenv('REMBG_WARM_MODELS', 'u2netp').split(',') if name.strip()
+    ])
+
+    # Filter preset / .cube LUT engine
+    LUT_SIZE: int = int(os.getenv('LUT_SIZE', 33))
+    LUT_CACHE_SIZE: int = int(os.getenv('LUT_CACHE_SIZE', 32))
+    # Working buffers kept between filter requests of the same image size.
+    # Idle buffers are not reserved by any request, so their limit is taken
+    # off MEMORY_BUDGET_MB
+    FILTER_BUFFER_POOL_MB: int = int(os.getenv('FILTER_BUFFER_POOL_MB', 24))
+    # Low-resolution vignette bases kept between requests (at most 1MB each)
+    VIGNETTE_CACHE_MB: int = int(os.getenv('VIGNETTE_CACHE_MB', 4))
+    # Time AI Auto Enhance may take before it falls back to a faster tier
+    AI_ENHANCE_BUDGET_MS: int = int(os.getenv('AI_ENHANCE_BUDGET_MS', 2500))
+
+    # Background jobs for long-running tools
+    JOB_WORKERS: int = int(os.getenv('JOB_WORKERS', 1))
+    JOB_MAX_PENDING: int = int(os.getenv('JOB_MAX_PENDING', 8))
+    JOB_RESULT_DIR: str = os.getenv('JOB_RESULT_DIR', os.path.join(os.getenv('UPLOAD_FOLDER', 'uploads'), 'jobs'))
+    JOB_RESULT_TTL_SECONDS: int = int(os.getenv('JOB_RESULT_TTL_SECONDS', 1800))
+    JOB_MAX_RESULT_MB: int = int(os.getenv('JOB_MAX_RESULT_MB', 256))
+    JOB_RETRY_AFTER_SECONDS: int = int(os.getenv('JOB_RETRY_AFTER_SECONDS', 10))
+    # Longest a queued job waits for memory headroom before it fails
+    JOB_ADMISSION_WAIT_SECONDS: float = float(os.getenv('JOB_ADMISSION_WAIT_SECONDS', 120))
+
+    # Content-addressed cache of deterministic tool results
+    RESULT_CACHE_ENABLED: bool = _to_bool(os.getenv('RESULT_CACHE_ENABLED', 'true'), True)
+    RESULT_CACHE_DIR: str = os.getenv('RESULT_CACHE_DIR', os.path.join(os.getenv('UPLOAD_FOLDER', 'uploads'), 'result_cache'))
+    RESULT_CACHE_MEMORY_MB: int = int(os.getenv('RESULT_CACHE_MEMORY_MB', 32))
+    RESULT_CACHE_DISK_MB: int = int(os.getenv('RESULT_CACHE_DISK_MB', 512))
+    RESULT_CACHE_MAX_ENTRY_MB: int = int(os.getenv('RESULT_CACHE_MAX_ENTRY_MB', 16))
+
+    # Strip-based processing for large outputs
+    TILE_THRESHOLD_PIXELS: int = int(os.getenv('TILE_THRESHOLD_PIXELS', 16_000_000))
+    TILE_PIXELS: int = int(os.getenv('TILE_PIXELS', 1_000_000))
+
+    # Batch endpoint
+    BATCH_MAX_ITEMS: int = int(os.getenv('BATCH_MAX_ITEMS', 50))
+    BATCH_WORKERS: int = int(os.getenv('BATCH_WORKERS', 2))
+    # Uncompressed size of all images in one batch (ZIP members included)
+    BATCH_MAX_TOTAL_MB: int = int(os.getenv('BATCH_MAX_TOTAL_MB', 256))
+
+    # Encodes allowed when compressing to a target file size or similarity
+    COMPRESS_TARGET_MAX_TRIALS: int = int(os.getenv('COMPRESS_TARGET_MAX_TRIALS', 8))
+    # SSIM threshold used by quality=auto
+    COMPRESS_AUTO_MIN_SSIM: float = float(os.getenv('COMPRESS_AUTO_MIN_SSIM', 0.98))
+
+    # Parallel lossless PNG optimizer
+    PNG_OPTIMIZE_WORKERS: int = int(os.getenv('PNG_OPTIMIZE_WORKERS', min(3, os.cpu_count() or 1)))
+    PNG_OPTIMIZE_BUDGET_MS: int = int(os.getenv('PNG_OPTIMIZE_BUDGET_MS', 1500))
+    PNG_OPTIMIZE_MAX_PIXELS: int = int(os.getenv('PNG_OPTIMIZE_MAX_PIXELS', 8_000_000))
+
+    # Encoded results larger than this are spooled to a temporary file
+    OUTPUT_SPILL_MB: int = int(os.getenv('OUTPUT_SPILL_MB', 8))
+    OUTPUT_SPOOL_DIR: str = os.getenv('OUTPUT_SPOOL_DIR', '')
+
+    # Decode the main image while a multipart upload is still arriving
+    STREAMING_DECODE_ENABLED: bool = _to_bool(os.getenv('STREAMING_DECODE_ENABLED', 'true'), True)
+    STREAMING_DECODE_CHUNK_KB: int = int(os.getenv('STREAMING_DECODE_CHUNK_KB', 64))
+
+    # Server-side image handles
+    HANDLE_DIR: str = os.getenv('HANDLE_DIR', os.path.join(os.getenv('UPLOAD_FOLDER', 'uploads'), 'handles'))
+    HANDLE_TTL_SECONDS: int = int(os.getenv('HANDLE_TTL_SECONDS', 1800))
+    # Decoded handle pixels kept in memory (taken off MEMORY_BUDGET_MB)
+    HANDLE_MEMORY_MB: int = int(os.getenv('HANDLE_MEMORY_MB', 16))
+    HANDLE_DISK_MB: int = int(os.getenv('HANDLE_DISK_MB', 512))
+
+    # Memory admission control for image endpoints. The budget covers request
+    # work and the in-memory caches (handles, result cache, filter buffer pool,
+    # vignette bases), whose limits are taken off what requests may reserve.
+    # The Python runtime and the resident rembg/onnx sessions are not in it,
+    # so leave room for them below the instance's memory limit
+    MEMORY_BUDGET_MB: int = int(os.getenv('MEMORY_BUDGET_MB', 320))
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 30))
+    ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv('ADMISSION_RETRY_AFTER_SECONDS', 5))
+
+    # Executor for CPU-bound image work ('inline' or 'process'; 'process' needs
+    # the app served by gunicorn, see processing.executor)
+    EXECUTOR_BACKEND: str = os.getenv('EXECUTOR_BACKEND', 'inline')
+    EXECUTOR_WORKERS: int = int(os.getenv('EXECUTOR_WORKERS', 2))
+    EXECUTOR_MAX_PENDING: int = int(os.getenv('EXECUTOR_MAX_PENDING', 4))
+    EXECUTOR_TASK_TIMEOUT_SECONDS: float = float(os.getenv('EXECUTOR_TASK_TIMEOUT_SECONDS', 60))
+
     # Logging
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE: str = os.getenv('LOG_FILE', 'logs/imgcraft.log')
@@ -92,6 +178,15 @@ class Config:
             os.makedirs(log_dir, exist_ok=True)
         app.config['MAX_CONTENT_LENGTH'] = self.MAX_CONTENT_LENGTH
 
+    def resident_cache_mb(self) -> int:
+        """Memory the in-memory caches may hold between requests, in MB"""
+        return (
+            self.HANDLE_MEMORY_MB
+            + self.RESULT_CACHE_MEMORY_MB
+            + self.FILTER_BUFFER_POOL_MB
+            + self.VIGNETTE_CACHE_MB
+        )
+
     def validate(self) -> List[str]:
         """Return a list of validation warnings/errors."""
         errors: List[str] = []
@@ -109,6 +204,12 @@ class Config:
         if self.MAX_PIXELS <= 0:
             errors.append('MAX_PIXELS must be greater than zero')
 
+        if self.resident_cache_mb() >= self.MEMORY_BUDGET_MB:
+            errors.append(
+                f'In-memory caches ({self.resident_cache_mb()}MB) leave nothing of '
+                f'MEMORY_BUDGET_MB ({self.MEMORY_BUDGET_MB}MB) for requests'
+            )
+
         if not os.path.exists(self.DEFAULT_FONT_PATH):
             errors.append(f"Font file not found: {self.DEFAULT_FONT_PATH}")
 
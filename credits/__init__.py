@@ -6,7 +6,9 @@ from credits.tool_costs import (
     TOOL_COSTS,
     TOOL_NAMES,
     TOOL_DESCRIPTIONS,
+    FREE_TOOLS,
     get_tool_cost,
+    get_charged_cost,
     get_all_tools,
     is_tool_available
 )
@@ -17,7 +19,9 @@ __all__ = [
     'TOOL_COSTS',
     'TOOL_NAMES',
     'TOOL_DESCRIPTIONS',
+    'FREE_TOOLS',
     'get_tool_cost',
+    'get_charged_cost',
     'get_all_tools',
     'is_tool_available'
 ]
@@ -97,6 +97,24 @@ def get_tool_cost(tool_name: str, use_cache: bool = True) -> int:
         return 1
 
 
+def get_charged_cost(tool_name: str) -> int:
+    """
+    Credits deducted for one run of a tool
+    
+    Free tools are never charged, whatever their database row says (their
+    single-image endpoints do not deduct credits either).
+    
+    Args:
+        tool_name: Name of the tool
+    
+    Returns:
+        0 for tools in FREE_TOOLS, otherwise get_tool_cost(tool_name)
+    """
+    if is_free_tool(tool_name):
+        return 0
+    return get_tool_cost(tool_name)
+
+
 def get_tool_info(tool_name: str, use_cache: bool = True) -> Optional[dict]:
     """
     Get full tool information from Supabase
@@ -1,19 +1,46 @@
 """Shared image-handling helpers for ImgCraft."""
 from __future__ import annotations
 
+import io
+import logging
 import math
 import os
-from typing import Tuple
+import threading
+import time
+from typing import BinaryIO, Callable, Optional, Tuple, Union
 
 from PIL import Image, ImageOps, ImageFile
 from werkzeug.datastructures import FileStorage
 
 from config import config
 
+logger = logging.getLogger('imgcraft')
+
 # Protect against decompression bombs
 Image.MAX_IMAGE_PIXELS = config.MAX_PIXELS
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+# EXIF orientation tag and the values that swap width and height
+ORIENTATION_TAG = 0x0112
+_SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+ImageSource = Union[Image.Image, FileStorage, BinaryIO, bytes, str]
+
+_decode_lock = threading.Lock()
+_decode_stats = {
+    'decodes': 0,
+    'decode_seconds': 0.0,
+    'max_decode_seconds': 0.0,
+    'reduced': 0,
+    'oriented': 0,
+    'streamed': 0,
+    'rejected_too_large': 0,
+}
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image header exceeds the configured pixel budget."""
+
 
 def _format_bytes(num_bytes: int) -> str:
     if num_bytes < 1024:
@@ -40,26 +67,276 @@ def ensure_file_within_limit(file_storage: FileStorage) -> int:
     return size
 
 
+def open_image_checked(source: ImageSource, *, max_pixels: Optional[int] = None) -> Image.Image:
+    """Open an image and check its header against the pixel budget.
+
+    Only the header is read; no pixels are decoded, so oversized uploads are
+    rejected before they cost CPU or memory.
+    """
+    if isinstance(source, Image.Image):
+        img = source
+    else:
+        if isinstance(source, FileStorage):
+            ensure_file_within_limit(source)
+            source.stream.seek(0)
+            source = source.stream
+        elif isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        try:
+            img = Image.open(source)
+        except Image.DecompressionBombError as e:
+            _count_rejected()
+            raise ImageTooLarge(str(e))
+
+    limit = max_pixels or config.MAX_PIXELS
+    total_pixels = img.width * img.height
+    if total_pixels > limit:
+        _count_rejected()
+        raise ImageTooLarge(
+            f"Image dimensions too large. Limit {limit:,} pixels, "
+            f"received {total_pixels:,}"
+        )
+    return img
+
+
+def _count_rejected() -> None:
+    with _decode_lock:
+        _decode_stats['rejected_too_large'] += 1
+
+
+def image_orientation(img: Image.Image) -> int:
+    """EXIF orientation of an opened image (1 when absent), read from the header."""
+    try:
+        return int(img.getexif().get(ORIENTATION_TAG, 1) or 1)
+    except Exception:
+        return 1
+
+
+def oriented_size(img: Image.Image) -> Tuple[int, int]:
+    """Size of an opened image once its EXIF orientation is applied."""
+    if image_orientation(img) in _SWAPPED_ORIENTATIONS:
+        return img.height, img.width
+    return img.size
+
+
 def load_image_safe(
-    file_storage: FileStorage,
+    source: ImageSource,
     *,
     max_side: int | None = None,
+    target_size: Tuple[int, int] | None = None,
+    reducing_gap: float = 1.0,
+    orient: bool = True,
 ) -> Tuple[Image.Image, Tuple[int, int]]:
-    """Load an image, enforcing size limits and orientation."""
-    ensure_file_within_limit(file_storage)
-    file_storage.stream.seek(0)
-    with Image.open(file_storage.stream) as img:
-        original_format = img.format
+    """Load an image, enforcing size limits and orientation.
+
+    The pixel budget is checked from the header before decoding. When the
+    caller will shrink the image (max_side or target_size, both in display
+    orientation) it is decoded at a reduced scale (see open_image_for_size).
+    The EXIF orientation is applied only when the image is not upright.
+    """
+    img = open_image_checked(source)
+    original_format = img.format
+    orientation = image_orientation(img) if orient else 1
+
+    if max_side and max(oriented_size(img)) > max_side:
+        width, height = oriented_size(img)
+        ratio = max_side / max(width, height)
+        target_size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+    decode_size = img.size
+    started = time.perf_counter()
+    if target_size:
+        if orientation in _SWAPPED_ORIENTATIONS:
+            target_size = (target_size[1], target_size[0])
+        img = open_image_for_size(img, target_size, reducing_gap=reducing_gap)
+    img.load()
+    if orientation != 1:
         img = ImageOps.exif_transpose(img)
-        width, height = img.size
-        total_pixels = width * height
-        if total_pixels > config.MAX_PIXELS:
-            raise ValueError(
-                f"Image dimensions too large. Limit {config.MAX_PIXELS:,} pixels, "
-                f"received {total_pixels:,}"
+    elapsed = time.perf_counter() - started
+
+    _record_decode(
+        elapsed,
+        reduced=img.width * img.height < decode_size[0] * decode_size[1],
+        oriented=orientation != 1,
+    )
+    logger.debug(
+        f"[DECODE] {original_format} {decode_size[0]}x{decode_size[1]} -> "
+        f"{img.width}x{img.height} in {elapsed * 1000:.1f}ms"
+    )
+
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    img.format = original_format
+    return img, img.size
+
+
+def _record_decode(elapsed: float, *, reduced: bool = False, oriented: bool = False, streamed: bool = False) -> None:
+    with _decode_lock:
+        _decode_stats['decodes'] += 1
+        _decode_stats['decode_seconds'] += elapsed
+        _decode_stats['max_decode_seconds'] = max(_decode_stats['max_decode_seconds'], elapsed)
+        _decode_stats['reduced'] += int(reduced)
+        _decode_stats['oriented'] += int(oriented)
+        _decode_stats['streamed'] += int(streamed)
+
+
+class IncrementalDecoder:
+    """Decode an image from chunks as they arrive, using Pillow's ImageFile.Parser.
+
+    The header is checked against the pixel budget as soon as it has been
+    parsed, so an oversized or non-image upload is rejected after the first
+    few KB. on_header is called with the header image at that point, before
+    any pixels are decoded (the caller reserves memory there). Formats Pillow decodes incrementally (JPEG) are decoded while the
+    rest is still being received. Others (PNG, WebP, ...) would only be
+    buffered by the parser, which re-concatenates its whole buffer on every
+    chunk, so their chunks are just collected and decoded once in close().
+    """
+
+    # Bytes after which an upload without a recognizable image header is rejected
+    HEADER_LIMIT = 1024 * 1024
+
+    # Formats whose pixels are decoded chunk by chunk
+    INCREMENTAL_FORMATS = ('JPEG',)
+
+    def __init__(self, max_pixels: Optional[int] = None, on_header: Optional[Callable[[Image.Image], None]] = None):
+        self.max_pixels = max_pixels
+        self.on_header = on_header
+        self.received = 0
+        self.decode_seconds = 0.0
+        self.header: Optional[Image.Image] = None
+        self._parser = ImageFile.Parser()
+        self._chunks = []
+        self._incremental = False
+        self._failed = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Add the next chunk; raises ImageTooLarge or ValueError for a bad header.
+
+        Exceptions raised by on_header propagate as well.
+        """
+        self._chunks.append(chunk)
+        self.received += len(chunk)
+        if self._failed or (self.header is not None and not self._incremental):
+            return
+
+        started = time.perf_counter()
+        try:
+            self._parser.feed(chunk)
+        except Image.DecompressionBombError as e:
+            _count_rejected()
+            raise ImageTooLarge(str(e))
+        except Exception as e:
+            # Decoder errors are left to the full decode in close()
+            logger.debug(f"[DECODE] Incremental decode stopped: {str(e)}")
+            self._failed = True
+        self.decode_seconds += time.perf_counter() - started
+
+        if self.header is not None:
+            return
+        if self._parser.image is not None:
+            self.header = self._parser.image
+            open_image_checked(self.header, max_pixels=self.max_pixels)
+            if self.on_header is not None:
+                self.on_header(self.header)
+            self._incremental = (
+                self._parser.decoder is not None and self.header.format in self.INCREMENTAL_FORMATS
             )
-        img_copy = img.copy()
-    if max_side and max(img_copy.size) > max_side:
-        img_copy.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
-    img_copy.format = original_format
-    return img_copy, img_copy.size
+        elif self.received > self.HEADER_LIMIT:
+            raise ValueError('Not a readable image')
+
+    def close(self) -> Tuple[Optional[Image.Image], bytes]:
+        """Finish decoding.
+
+        Returns:
+            (oriented image, encoded bytes); the image is None if decoding
+            failed and the caller should decode the bytes instead
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        if self._failed or self.header is None:
+            return None, data
+
+        started = time.perf_counter()
+        try:
+            if self._incremental:
+                img = self._parser.close()
+            else:
+                img = Image.open(io.BytesIO(data))
+                img.load()
+        except Exception as e:
+            logger.debug(f"[DECODE] Decode of streamed upload failed: {str(e)}")
+            return None, data
+        original_format = img.format
+        orientation = image_orientation(img)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+            img.format = original_format
+        elapsed = self.decode_seconds + time.perf_counter() - started
+
+        _record_decode(elapsed, oriented=orientation != 1, streamed=self._incremental)
+        logger.debug(
+            f"[DECODE] {original_format} {img.width}x{img.height} from {self.received} bytes "
+            f"({'incremental' if self._incremental else 'after upload'}, {elapsed * 1000:.1f}ms of decode work)"
+        )
+        return img, data
+
+
+def decode_stats() -> dict:
+    """Counters and timing of load_image_safe, for the metrics endpoint."""
+    with _decode_lock:
+        data = dict(_decode_stats)
+    data['avg_decode_ms'] = (
+        round(data['decode_seconds'] * 1000 / data['decodes'], 2) if data['decodes'] else 0.0
+    )
+    return data
+
+
+def reduction_factor(
+    size: Tuple[int, int],
+    target_size: Tuple[int, int],
+    reducing_gap: float = 1.0,
+) -> int:
+    """Largest power-of-two factor that keeps both sides >= target_size * reducing_gap."""
+    width, height = size
+    target_width = max(1, int(target_size[0] * reducing_gap))
+    target_height = max(1, int(target_size[1] * reducing_gap))
+    factor = 1
+    while width // (factor * 2) >= target_width and height // (factor * 2) >= target_height:
+        factor *= 2
+    return factor
+
+
+def open_image_for_size(
+    source: Union[Image.Image, BinaryIO, str],
+    target_size: Tuple[int, int],
+    *,
+    reducing_gap: float = 1.0,
+) -> Image.Image:
+    """Decode an image only as large as needed to be shrunk to target_size.
+
+    JPEGs that are not loaded yet are decoded with DCT scaling (Image.draft),
+    anything else is decoded and shrunk with Image.reduce. Either way the
+    result still covers target_size * reducing_gap on both sides, so the
+    caller's final resample works from enough pixels.
+    """
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    original_format = img.format
+    target_width, target_height = target_size
+    if target_width >= img.width and target_height >= img.height:
+        return img
+
+    if original_format == 'JPEG' and img.mode in ('L', 'RGB', 'CMYK'):
+        requested = (
+            max(1, int(target_width * reducing_gap)),
+            max(1, int(target_height * reducing_gap)),
+        )
+        # No-op once the image is loaded; reduce() below covers that case
+        img.draft(img.mode, requested)
+
+    factor = reduction_factor(img.size, target_size, reducing_gap)
+    if factor > 1 and img.mode not in ('1', 'P'):
+        reduced = img.reduce(factor)
+        reduced.format = original_format
+        reduced.info = dict(img.info)
+        return reduced
+    return img
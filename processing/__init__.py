@@ -0,0 +1,142 @@
+"""
+Processing module initialization
+"""
+from processing.model_pool import model_registry, ModelRegistry
+from processing.color_lut import (
+    color_lut_engine,
+    ColorLUTEngine,
+    FILTER_PRESETS,
+    parse_cube_lut
+)
+from processing.color_matrix import build_color_matrix, build_hsv_lut
+from processing.admission import (
+    memory_budget,
+    MemoryBudget,
+    AdmissionRejected,
+    estimate_peak_bytes
+)
+from processing.batch import BatchItem, expand_uploads, stream_batch_zip
+from processing.executor import (
+    image_executor,
+    InlineExecutor,
+    ProcessImageExecutor,
+    ExecutorError,
+    ExecutorBusy,
+    TaskTimeout,
+    WorkerCrashed,
+    TaskFailed
+)
+from processing.upscale import UPSCALE_ENHANCEMENTS, apply_upscale_enhancements, enhance_upscaled
+from processing.collage import COLLAGE_CANVAS_SIZE, collage_slot_box, create_template_collage
+from processing.filter_pipeline import (
+    buffer_pool,
+    BufferPool,
+    FilterRun,
+    run_filter_pipeline,
+    filter_stage_stats,
+    enhance_tiers,
+    EnhanceTierModel,
+    ENHANCE_TIERS
+)
+from processing.grain import grain_bank, GrainBank, grain_seed, grain_is_random
+from processing.handles import image_handles, ImageHandleStore, ImageHandle
+from processing.jobs import job_manager, JobManager, JobQueueFull
+from processing.output import OutputBuffer, ChunkSink, output_buffer
+from processing.png_optimize import png_optimizer, PNGOptimizer, save_png, PNG_MODES
+from processing.quality import proxy_boxes, luma_proxy, ssim, encoded_ssim
+from processing.quantize import quantize_image, build_palette, map_to_palette, DITHER_MODES
+from processing.result_cache import result_cache, ResultCache, CachedResult
+from processing.streaming_upload import StreamedUpload, read_streaming_upload
+from processing.tiles import (
+    STRIP_MODES,
+    PNGStripWriter,
+    render_strips,
+    assemble_strips,
+    encode_strips,
+    stream_png_strips,
+    strip_height_for
+)
+from processing.tone import build_tone_lut
+from processing.vignette import vignette_masks, VignetteMask, VignetteMaskCache, build_vignette_mask
+
+__all__ = [
+    'model_registry',
+    'ModelRegistry',
+    'color_lut_engine',
+    'ColorLUTEngine',
+    'FILTER_PRESETS',
+    'parse_cube_lut',
+    'build_color_matrix',
+    'build_hsv_lut',
+    'memory_budget',
+    'MemoryBudget',
+    'AdmissionRejected',
+    'estimate_peak_bytes',
+    'BatchItem',
+    'expand_uploads',
+    'stream_batch_zip',
+    'image_executor',
+    'InlineExecutor',
+    'ProcessImageExecutor',
+    'ExecutorError',
+    'ExecutorBusy',
+    'TaskTimeout',
+    'WorkerCrashed',
+    'TaskFailed',
+    'UPSCALE_ENHANCEMENTS',
+    'apply_upscale_enhancements',
+    'enhance_upscaled',
+    'COLLAGE_CANVAS_SIZE',
+    'collage_slot_box',
+    'create_template_collage',
+    'buffer_pool',
+    'BufferPool',
+    'FilterRun',
+    'run_filter_pipeline',
+    'filter_stage_stats',
+    'enhance_tiers',
+    'EnhanceTierModel',
+    'ENHANCE_TIERS',
+    'grain_bank',
+    'GrainBank',
+    'grain_seed',
+    'grain_is_random',
+    'image_handles',
+    'ImageHandleStore',
+    'ImageHandle',
+    'job_manager',
+    'JobManager',
+    'JobQueueFull',
+    'OutputBuffer',
+    'ChunkSink',
+    'output_buffer',
+    'png_optimizer',
+    'PNGOptimizer',
+    'save_png',
+    'PNG_MODES',
+    'proxy_boxes',
+    'luma_proxy',
+    'ssim',
+    'encoded_ssim',
+    'quantize_image',
+    'build_palette',
+    'map_to_palette',
+    'DITHER_MODES',
+    'result_cache',
+    'ResultCache',
+    'CachedResult',
+    'StreamedUpload',
+    'read_streaming_upload',
+    'STRIP_MODES',
+    'PNGStripWriter',
+    'render_strips',
+    'assemble_strips',
+    'encode_strips',
+    'stream_png_strips',
+    'strip_height_for',
+    'build_tone_lut',
+    'vignette_masks',
+    'VignetteMask',
+    'VignetteMaskCache',
+    'build_vignette_mask'
+]
@@ -0,0 +1,361 @@
+"""
+Memory-budget admission control for image endpoints
+
+Every image request reserves an estimate of its peak memory before any pixel
+work starts. Requests whose estimate fits in the free part of the budget run
+immediately, requests that fit the budget but not the current headroom wait
+their turn (in arrival order), and requests that could never fit, or that
+waited too long, are rejected so the caller can answer 503 instead of letting
+the worker be OOM-killed.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+# Bytes per pixel of a decoded image, by mode
+MODE_BYTES = {
+    '1': 1, 'L': 1, 'P': 1, 'LA': 2, 'PA': 2, 'La': 2,
+    'RGB': 3, 'YCbCr': 3, 'LAB': 3, 'HSV': 3,
+    'RGBA': 4, 'RGBa': 4, 'RGBX': 4, 'CMYK': 4, 'I': 4, 'F': 4,
+    'I;16': 2, 'I;16L': 2, 'I;16B': 2
+}
+
+# Rough number of full-size 8-bit RGB(A) working copies each tool holds at
+# its peak, measured against the current implementations ('remove_bg' builds
+# float masks, hence its larger factor; 'filter' adds FILTER_STEP_BYTES)
+TOOL_COPY_FACTORS = {
+    'resize': 1,
+    'compress': 3,
+    'convert': 3,
+    'crop': 3,
+    'palette': 1,
+    'watermark': 4,
+    'filter': 3,
+    'remove_bg': 8,
+    'collage': 2,
+    'pipeline': 1,
+    'exif': 2
+}
+
+# Extra bytes per pixel on top of the filter's base copies, for the stages
+# that hold full-size scratch buffers next to the working buffer (the largest
+# one active sets the peak; float work is done a block of rows at a time, see
+# processing.filter_pipeline)
+FILTER_STEP_BYTES = {
+    'aiAutoEnhance': 16,
+    'vibrance': 3,
+    'hueShift': 3,
+    'sharpness': 3,
+    'clarity': 3,
+    'vignette': 1,
+    'preset': 8
+}
+
+# Largest side remove_bg works at (larger inputs are downscaled first)
+REMOVE_BG_MAX_SIDE = 1920
+
+# Collage canvas size (see create_template_collage)
+COLLAGE_CANVAS_SIDE = 1200
+
+# Fixed per-request overhead (encoders, Python objects, response buffers)
+BASE_OVERHEAD_BYTES = 8 * 1024 * 1024
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, message: str, retry_after: int, never_fits: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.never_fits = never_fits
+
+
+def _bytes_per_pixel(mode: str) -> int:
+    return MODE_BYTES.get(mode, 4)
+
+
+def _int_param(params: Mapping, key: str, default: int) -> int:
+    try:
+        return int(params.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def estimate_peak_bytes(tool: str, images: Iterable[Tuple[Tuple[int, int], str]], params: Mapping) -> int:
+    """
+    Estimate the peak memory of a tool run from the decoded image headers
+
+    Args:
+        tool: Tool name (e.g. 'upscale')
+        images: (size, mode) of every uploaded image, read from the headers only
+        params: Request form values
+
+    Returns:
+        Estimated peak bytes
+    """
+    images = list(images)
+    decoded = sum(w * h * _bytes_per_pixel(mode) for (w, h), mode in images)
+    total = BASE_OVERHEAD_BYTES + decoded
+    if not images:
+        return total
+
+    (width, height), mode = max(images, key=lambda item: item[0][0] * item[0][1])
+    pixels = width * height
+    # Most tools convert to RGB(A) for their working copies
+    working_bpp = max(3, _bytes_per_pixel(mode))
+
+    if tool == 'upscale':
+        factor = _int_param(params, 'factor', 2)
+        out_pixels = pixels * factor * factor
+        if out_pixels > config.TILE_THRESHOLD_PIXELS:
+            # Strip path: a few strips plus the in-memory part of the encoded
+            # output (PNG, larger outputs are streamed or spooled to disk) or
+            # one assembled output image plus the encoder's copy (JPEG)
+            strips = 6 * config.TILE_PIXELS * working_bpp
+            if params.get('format', 'PNG').upper() == 'JPEG':
+                return total + strips + 2 * out_pixels * working_bpp
+            return total + strips + min(out_pixels * working_bpp // 2, config.OUTPUT_SPILL_MB * 1024 * 1024)
+        # Full path: the resized image, the current step and its degenerate
+        return total + 3 * out_pixels * working_bpp
+
+    if tool == 'resize':
+        if params.get('mode') == 'pixel':
+            out_pixels = _int_param(params, 'width', width) * _int_param(params, 'height', height)
+        else:
+            scale = _int_param(params, 'scale', 100) / 100
+            out_pixels = int(width * scale) * int(height * scale)
+        return total + 2 * out_pixels * working_bpp
+
+    if tool == 'filter':
+        # Pipeline steps carry filterData already parsed
+        filter_data = params.get('filterData') or '{}'
+        if isinstance(filter_data, str):
+            try:
+                filter_data = json.loads(filter_data)
+            except ValueError:
+                filter_data = {}
+        step_bytes = max(
+            [per_pixel for key, per_pixel in FILTER_STEP_BYTES.items() if filter_data.get(key)] or [0]
+        )
+        return total + pixels * (TOOL_COPY_FACTORS['filter'] * working_bpp + step_bytes)
+
+    if tool == 'pipeline':
+        return total + _pipeline_step_peak((width, height), mode, params)
+
+    if tool == 'remove_bg':
+        scale = min(1.0, REMOVE_BG_MAX_SIDE / max(width, height, 1))
+        pixels = int(pixels * scale * scale)
+        working_bpp = 4
+
+    if tool == 'collage':
+        canvas = COLLAGE_CANVAS_SIDE * COLLAGE_CANVAS_SIDE * 4
+        return total + TOOL_COPY_FACTORS['collage'] * canvas
+
+    return total + TOOL_COPY_FACTORS.get(tool, 4) * pixels * working_bpp
+
+
+def _pipeline_step_peak(size: Tuple[int, int], mode: str, params: Mapping) -> int:
+    """
+    Largest working memory of any step of an /api/pipeline request
+
+    Steps run one after another on one image, so the peak is the largest step
+    at the image size that step sees (crop and resize change it for the rest).
+    """
+    try:
+        steps = json.loads(params.get('operations') or '[]')
+    except ValueError:
+        return 0
+    if not isinstance(steps, list):
+        return 0
+
+    peak = 0
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        op = step.get('op')
+        width, height = size
+        if op in ('crop', 'resize', 'filter', 'watermark', 'compress', 'convert'):
+            # The fixed overhead is counted once for the whole request
+            peak = max(peak, estimate_peak_bytes(op, [(size, mode)], step) - BASE_OVERHEAD_BYTES)
+        if op == 'crop':
+            crop_width = _int_param(step, 'width', 0)
+            crop_height = _int_param(step, 'height', 0)
+            if crop_width > 0 and crop_height > 0:
+                size = (min(width, crop_width), min(height, crop_height))
+        elif op == 'resize':
+            if step.get('mode') == 'pixel':
+                size = (_int_param(step, 'width', width), _int_param(step, 'height', height))
+            else:
+                scale = _int_param(step, 'scale', 100) / 100
+                size = (int(width * scale), int(height * scale))
+        elif op == 'filter':
+            mode = 'RGB'
+        elif op == 'watermark':
+            mode = 'RGBA'
+    return peak
+
+
+class _Reservation:
+    """Context manager that releases a reservation on exit"""
+
+    def __init__(self, budget: 'MemoryBudget', ticket: int, nbytes: int):
+        self._budget = budget
+        self._ticket = ticket
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def release(self) -> None:
+        """Give the reservation back (safe to call more than once)"""
+        self._budget.release(self._ticket)
+
+
+class MemoryBudget:
+    """Process-wide budget of estimated peak memory for in-flight requests"""
+
+    def __init__(self, budget_bytes: int, max_wait_seconds: float = 30.0, retry_after: int = 5):
+        self.budget_bytes = budget_bytes
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._tickets = itertools.count(1)
+        self._queue: deque = deque()
+        self._active = {}
+        self._reserved = 0
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected_too_large': 0, 'rejected_timeout': 0}
+
+    def reserve(self, nbytes: int, label: str, timeout: Optional[float] = None) -> _Reservation:
+        """
+        Reserve nbytes of the budget, waiting for headroom if needed
+
+        Args:
+            nbytes: Estimated peak memory of the request
+            label: Tool name, for metrics and logs
+            timeout: Longest time to wait (defaults to max_wait_seconds)
+
+        Returns:
+            Context manager that releases the reservation
+
+        Raises:
+            AdmissionRejected if the request can never fit or waited too long
+        """
+        if nbytes > self.budget_bytes:
+            with self._cond:
+                self._stats['rejected_too_large'] += 1
+            logger.warning(
+                f"[ADMISSION] Rejected {label}: needs ~{nbytes // (1024 * 1024)}MB, "
+                f"budget is {self.budget_bytes // (1024 * 1024)}MB"
+            )
+            raise AdmissionRejected(
+                'This image is too large to process with these settings',
+                self.retry_after,
+                never_fits=True
+            )
+
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        ticket = next(self._tickets)
+
+        with self._cond:
+            self._queue.append(ticket)
+            waited = False
+            try:
+                # First come, first served: only the head of the queue may take
+                # headroom, so a large request is not starved by small ones
+                while self._queue[0] != ticket or self._reserved + nbytes > self.budget_bytes:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['rejected_timeout'] += 1
+                        logger.warning(f"[ADMISSION] Rejected {label}: no headroom after {timeout:.0f}s")
+                        raise AdmissionRejected('Server is busy, please try again shortly', self.retry_after)
+                    if not waited:
+                        waited = True
+                        self._stats['queued'] += 1
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            self._reserved += nbytes
+            self._active[ticket] = (label, nbytes, time.time())
+            self._stats['admitted'] += 1
+
+        return _Reservation(self, ticket, nbytes)
+
+    def reserve_remainder(self, held: List[_Reservation], nbytes: int, label: str,
+                          timeout: Optional[float] = None) -> List[_Reservation]:
+        """
+        Make the reservations a request already holds cover nbytes
+
+        A streamed upload reserves an estimate as soon as its header arrives;
+        once the whole form is known, only the part of the full estimate that
+        reservation does not cover is reserved on top of it.
+
+        Args:
+            held: Reservations already taken for this request
+            nbytes: Full estimate of the request
+            label: Tool name, for metrics and logs
+            timeout: Longest time to wait (defaults to max_wait_seconds)
+
+        Returns:
+            held, plus a reservation for the remainder if one was needed
+
+        Raises:
+            AdmissionRejected as reserve does, after releasing held
+        """
+        held = list(held)
+        covered = sum(reservation.nbytes for reservation in held)
+        if nbytes <= covered:
+            return held
+        # An estimate over the whole budget must still be refused outright
+        # rather than wait for headroom that never comes
+        needed = nbytes - covered if nbytes <= self.budget_bytes else nbytes
+        try:
+            held.append(self.reserve(needed, label, timeout))
+        except AdmissionRejected:
+            for reservation in held:
+                reservation.release()
+            raise
+        return held
+
+    def release(self, ticket: int) -> None:
+        with self._cond:
+            entry = self._active.pop(ticket, None)
+            if entry is not None:
+                self._reserved -= entry[1]
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                'budget_bytes': self.budget_bytes,
+                'reserved_bytes': self._reserved,
+                'waiting': len(self._queue),
+                'reservations': [
+                    {'tool': label, 'bytes': nbytes, 'since': since}
+                    for label, nbytes, since in self._active.values()
+                ]
+            })
+            return data
+
+
+# Create singleton instance (the caches' limits are memory no reservation covers)
+memory_budget = MemoryBudget(
+    max(0, config.MEMORY_BUDGET_MB - config.resident_cache_mb()) * 1024 * 1024,
+    max_wait_seconds=config.ADMISSION_MAX_WAIT_SECONDS,
+    retry_after=config.ADMISSION_RETRY_AFTER_SECONDS
+)
@@ -0,0 +1,223 @@
+"""
+Batch execution of a tool over many uploaded images
+
+Uploads (individual files and/or ZIP archives) are expanded into items, the
+items are processed on a small thread pool, and the results are streamed back
+as a ZIP archive: each result is written as soon as it finishes, followed by a
+manifest.json describing every item, including the ones that failed.
+"""
+import io
+import json
+import logging
+import mimetypes
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional
+
+from processing.output import ChunkSink
+
+logger = logging.getLogger('imgcraft')
+
+# Extensions for result mimetypes that mimetypes.guess_extension gets wrong or lacks
+_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/x-icon': '.ico',
+    'image/ico': '.ico',
+    'image/tiff': '.tiff'
+}
+
+
+class BatchItem:
+    """One image of a batch
+
+    ZIP members are not read up front: opener returns a fresh file object
+    over the member, so only the items being processed are in memory.
+    """
+
+    def __init__(
+        self,
+        index: int,
+        name: str,
+        opener: Optional[Callable[[], BinaryIO]] = None,
+        error: Optional[str] = None
+    ):
+        self.index = index
+        self.name = name
+        self.opener = opener
+        self.error = error
+        self.estimate = 0
+
+    def open(self) -> BinaryIO:
+        """File object over the item's bytes (the caller closes it)"""
+        return self.opener()
+
+    def read(self) -> bytes:
+        """The item's bytes"""
+        with self.open() as source:
+            return source.read()
+
+
+def _allowed(name: str, allowed_extensions: Iterable[str]) -> bool:
+    ext = os.path.splitext(name)[1].lower().lstrip('.')
+    return ext in allowed_extensions
+
+
+def expand_uploads(
+    files,
+    allowed_extensions: Iterable[str],
+    max_items: int,
+    max_item_bytes: int,
+    max_total_bytes: int
+) -> List[BatchItem]:
+    """
+    Turn uploaded files and ZIP archives into batch items
+
+    Archive members that are directories, hidden files or not images are
+    skipped. Members larger than max_item_bytes become failed items, and an
+    upload whose members add up to more than max_total_bytes uncompressed is
+    refused, so a small archive cannot expand into gigabytes of work. Members
+    are only listed here; each is decompressed when its item is processed.
+
+    Args:
+        files: Uploaded file objects (with .filename and .read())
+        allowed_extensions: Lower-case image extensions without the dot
+        max_items: Maximum number of items
+        max_item_bytes: Maximum uncompressed size of one item
+        max_total_bytes: Maximum uncompressed size of all items together
+
+    Returns:
+        List of BatchItem
+
+    Raises:
+        ValueError if there are more than max_items images, they are larger
+        than max_total_bytes in total, or an archive is invalid
+    """
+    allowed_extensions = set(allowed_extensions)
+    items: List[BatchItem] = []
+    total = 0
+
+    def add(name: str, size: int = 0, opener=None, error: Optional[str] = None) -> None:
+        nonlocal total
+        if len(items) >= max_items:
+            raise ValueError(f'Too many images in one batch (max {max_items})')
+        total += size
+        if total > max_total_bytes:
+            raise ValueError(f'Images in one batch may not exceed {max_total_bytes // (1024 * 1024)}MB uncompressed')
+        items.append(BatchItem(len(items), name, opener, error))
+
+    for upload in files:
+        filename = upload.filename or f'image_{len(items) + 1}'
+        if not filename.lower().endswith('.zip'):
+            data = upload.read()
+            add(filename, len(data), partial(io.BytesIO, data))
+            continue
+
+        try:
+            # The compressed archive is kept (it is no larger than the upload)
+            # since the request's own files are closed before the items run
+            archive = zipfile.ZipFile(io.BytesIO(upload.read()))
+        except zipfile.BadZipFile:
+            raise ValueError(f'{filename} is not a valid ZIP archive')
+        for info in archive.infolist():
+            base = os.path.basename(info.filename)
+            if info.is_dir() or not base or base.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            if not _allowed(base, allowed_extensions):
+                continue
+            if info.file_size > max_item_bytes:
+                add(info.filename, error=f'File is larger than {max_item_bytes // (1024 * 1024)}MB')
+                continue
+            # zipfile stops reading a member at its declared file_size
+            add(info.filename, info.file_size, partial(archive.open, info))
+
+    return items
+
+
+def output_name(item: BatchItem, mimetype: str) -> str:
+    """Name of an item's result inside the output archive (unique per item)"""
+    stem = os.path.splitext(os.path.basename(item.name))[0] or 'image'
+    ext = _EXTENSIONS.get(mimetype) or mimetypes.guess_extension(mimetype) or '.bin'
+    return f'{item.index + 1:03d}_{stem}{ext}'
+
+
+def stream_batch_zip(
+    items: List[BatchItem],
+    process: Callable[[BatchItem], tuple],
+    workers: int,
+    manifest_extra: Optional[dict] = None,
+    on_finish: Optional[Callable[[List[dict]], Optional[dict]]] = None
+) -> Iterator[bytes]:
+    """
+    Process items concurrently and stream a ZIP of the results
+
+    Results are written in completion order. Items that already carry an
+    error are not processed and only appear in the manifest.
+
+    Args:
+        items: Batch items
+        process: Callable returning (output buffer, mimetype) for an item
+        workers: Maximum items processed at once
+        manifest_extra: Extra top-level fields for manifest.json
+        on_finish: Called once with the manifest entries when processing
+            stops, also if the client went away before the end (items that
+            never ran are still 'pending'); the fields it returns are added
+            to manifest.json
+
+    Yields:
+        Chunks of the ZIP archive
+    """
+    sink = ChunkSink()
+    entries = {}
+    for item in items:
+        entries[item.index] = {
+            'index': item.index,
+            'source': item.name,
+            'status': 'failed' if item.error else 'pending',
+            'output': None,
+            'bytes': None,
+            'error': item.error
+        }
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        runnable = [item for item in items if item.error is None]
+        pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='imgcraft-batch')
+        try:
+            futures = {pool.submit(process, item): item for item in runnable}
+            for future in as_completed(futures):
+                item = futures[future]
+                entry = entries[item.index]
+                try:
+                    output, mimetype = future.result()
+                    data = output.getvalue()
+                    entry['output'] = output_name(item, mimetype)
+                    entry['bytes'] = len(data)
+                    entry['status'] = 'done'
+                    archive.writestr(entry['output'], data)
+                    del data, output
+                except Exception as e:
+                    entry['status'] = 'failed'
+                    entry['error'] = str(e)
+                    logger.warning(f"[BATCH] Item {item.index} ({item.name}) failed: {str(e)}")
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+        finally:
+            # Stop queued items if the client went away
+            pool.shutdown(wait=True, cancel_futures=True)
+            settled = on_finish([entries[index] for index in sorted(entries)]) if on_finish else None
+
+        manifest = dict(manifest_extra or {})
+        manifest.update(settled or {})
+        manifest['items'] = [entries[index] for index in sorted(entries)]
+        manifest['succeeded'] = sum(1 for entry in entries.values() if entry['status'] == 'done')
+        manifest['failed'] = len(entries) - manifest['succeeded']
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+
+    yield sink.drain()
@@ -0,0 +1,111 @@
+"""
+Template collage rendering
+
+Slot geometry and composition of the collage tool. They live outside app.py
+so that image executor workers can import them without importing the web
+app.
+"""
+from PIL import Image, ImageDraw
+
+# Collage canvas size
+COLLAGE_CANVAS_SIZE = (1200, 1200)
+
+
+def collage_slot_box(slot, spacing):
+    """Pixel (x, y, width, height) of a template slot on the collage canvas"""
+    CANVAS_WIDTH, CANVAS_HEIGHT = COLLAGE_CANVAS_SIZE
+    
+    # Parse slot (x, y, w, h) in %
+    sx, sy, sw, sh = slot
+    
+    # --- NEW SPACING LOGIC ---
+    # Apply spacing to X and Y offset (Push image in)
+    pixel_x = int(sx * CANVAS_WIDTH) + spacing
+    pixel_y = int(sy * CANVAS_HEIGHT) + spacing
+    
+    # Subtract 2x spacing from Width and Height (Shrink image to make room for padding on both sides)
+    pixel_w = int(sw * CANVAS_WIDTH) - (2 * spacing)
+    pixel_h = int(sh * CANVAS_HEIGHT) - (2 * spacing)
+    
+    # Ensure positive dimensions
+    if pixel_w < 1: pixel_w = 1
+    if pixel_h < 1: pixel_h = 1
+    
+    return pixel_x, pixel_y, pixel_w, pixel_h
+
+
+def create_template_collage(images, template, spacing, background, corner_radius):
+    """
+    Creates a collage based on a normalized grid template (0.0-1.0 coords).
+    Applies spacing to ALL sides (Outer Padding + Inner Gaps).
+    """
+    # Canvas Settings
+    CANVAS_WIDTH, CANVAS_HEIGHT = COLLAGE_CANVAS_SIZE
+    
+    # Create Background
+    if background == 'transparent':
+        canvas = Image.new('RGBA', (CANVAS_WIDTH, CANVAS_HEIGHT), (0, 0, 0, 0))
+    elif background == 'white':
+        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (255, 255, 255))
+    elif background == 'black':
+        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (0, 0, 0))
+    elif background == 'gradient':
+        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (20, 20, 20))
+        # Simple diagonal gradient
+        draw = ImageDraw.Draw(canvas)
+        for i in range(CANVAS_HEIGHT):
+            r = int(20 + (i/CANVAS_HEIGHT)*30)
+            g = int(20 + (i/CANVAS_HEIGHT)*40)
+            b = int(40 + (i/CANVAS_HEIGHT)*60)
+            draw.line([(0, i), (CANVAS_WIDTH, i)], fill=(r,g,b))
+    else:
+        canvas = Image.new('RGB', (CANVAS_WIDTH, CANVAS_HEIGHT), (255, 255, 255))
+
+    # Iterate slots
+    for idx, slot in enumerate(template):
+        if idx >= len(images): break
+        
+        img = images[idx]
+        
+        pixel_x, pixel_y, pixel_w, pixel_h = collage_slot_box(slot, spacing)
+        
+        # Smart Crop & Resize Image to fit Slot
+        img_ratio = img.width / img.height
+        slot_ratio = pixel_w / pixel_h
+        
+        if img_ratio > slot_ratio:
+            # Image is wider than slot: crop sides
+            new_height = pixel_h
+            new_width = int(new_height * img_ratio)
+            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Center crop
+            left = (new_width - pixel_w) // 2
+            resized = resized.crop((left, 0, left + pixel_w, pixel_h))
+        else:
+            # Image is taller than slot: crop top/bottom
+            new_width = pixel_w
+            new_height = int(new_width / img_ratio)
+            resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            # Center crop
+            top = (new_height - pixel_h) // 2
+            resized = resized.crop((0, top, pixel_w, top + pixel_h))
+            
+        # Apply Corner Radius
+        if corner_radius > 0:
+            mask = Image.new("L", (pixel_w, pixel_h), 0)
+            draw = ImageDraw.Draw(mask)
+            draw.rounded_rectangle((0, 0, pixel_w, pixel_h), radius=corner_radius, fill=255)
+            
+            # Create a transparent container for the rounded image
+            container = Image.new('RGBA', (pixel_w, pixel_h), (0,0,0,0))
+            container.paste(resized, (0,0))
+            container.putalpha(mask)
+            resized = container
+            
+        # Paste into Canvas
+        if resized.mode == 'RGBA':
+            canvas.paste(resized, (pixel_x, pixel_y), resized)
+        else:
+            canvas.paste(resized, (pixel_x, pixel_y))
+            
+    return canvas
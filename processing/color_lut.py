@@ -0,0 +1,379 @@
+"""
+3D color LUT engine for filter presets and uploaded .cube files
+
+Every color-only step of a preset (channel gains/offsets, grayscale,
+ImageEnhance Brightness/Color/Contrast) is modelled on plain RGB triples,
+evaluated once over a lattice and baked into a Pillow Color3DLUT. The image is
+then graded in a single trilinear-interpolated pass in C. Chains that never
+mix channels (or only mix them through an initial grayscale conversion) are
+baked into exact per-channel 256-entry tables instead, which cv2.LUT
+applies even faster. processing.filter_pipeline applies both to its working
+buffer; spatial steps (vignette, grain, sharpness) run after them.
+
+ImageEnhance.Contrast pivots around the mean luminance of the image it is
+given, so presets containing a contrast step are baked per mean value. The
+mean is estimated from a nearest-neighbour pixel sample rather than a full
+pass, and the baked tables are kept in a small LRU.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+# Lattice points per axis (Pillow supports 2..65)
+DEFAULT_LUT_SIZE = 33
+
+# Pixels sampled when estimating the mean luminance for contrast steps
+MEAN_SAMPLE_PIXELS = 262144
+
+
+class Preset:
+    """A filter preset split into a color-only chain and trailing spatial steps"""
+
+    def __init__(self, color_ops: List[tuple], spatial_ops: List[tuple] = None):
+        self.color_ops = color_ops
+        self.spatial_ops = spatial_ops or []
+
+    @property
+    def needs_mean(self) -> bool:
+        return any(op[0] == 'contrast' for op in self.color_ops)
+
+    @property
+    def kind(self) -> str:
+        """'channels' (separable), 'gray' (grayscale then separable) or 'cube'"""
+        mixing = [i for i, op in enumerate(self.color_ops) if op[0] in ('gray', 'color')]
+        if not mixing:
+            return 'channels'
+        if mixing == [0] and self.color_ops[0][0] == 'gray':
+            return 'gray'
+        return 'cube'
+
+    @property
+    def adds_grain(self) -> bool:
+        """True if the preset adds film grain"""
+        return any(op[0] == 'grain' for op in self.spatial_ops)
+
+
+def _channels(mul=(1.0, 1.0, 1.0), add=(0.0, 0.0, 0.0)):
+    return ('channels', mul, add)
+
+
+# Preset definitions (same steps and constants as the original hand-written chains)
+FILTER_PRESETS: Dict[str, Preset] = {
+    # Cinematic Presets
+    'teal_orange': Preset([_channels((1.15, 1.0, 0.85), (0, 0, 20)), ('contrast', 1.2), ('color', 0.9)]),
+    'moody_dark': Preset([_channels((0.7, 0.7, 0.7)), ('contrast', 1.3), ('color', 0.8)], [('vignette', 60)]),
+    'bright_cinematic': Preset([_channels((1.15, 1.15, 1.15), (10, 10, 10)), ('contrast', 1.1), ('color', 1.1)]),
+    'film_noir': Preset([('gray',), ('contrast', 1.5)], [('vignette', 70)]),
+    'dramatic': Preset([('contrast', 1.4), ('color', 0.9)], [('vignette', 50)]),
+
+    # Vintage Presets
+    'retro_70s': Preset([_channels((1.1, 1.05, 1.0)), ('color', 0.7), ('contrast', 0.9)], [('grain', 15)]),
+    'polaroid': Preset([('brightness', 1.1), ('color', 0.8), ('contrast', 0.95)], [('vignette', 30)]),
+    'faded_film': Preset([_channels((0.9, 0.9, 0.9), (20, 20, 20)), ('color', 0.6), ('contrast', 0.85)]),
+    'warm_vintage': Preset([_channels(add=(25, 15, 0)), ('color', 0.75)]),
+    'cool_vintage': Preset([_channels(add=(0, 0, 20)), ('color', 0.75), ('contrast', 0.9)]),
+
+    # Modern Presets
+    'clean_bright': Preset([('brightness', 1.15), ('color', 1.05)], [('sharpness', 1.2)]),
+    'high_contrast': Preset([('contrast', 1.4), ('color', 1.1)]),
+    'matte_finish': Preset([_channels((0.95, 0.95, 0.95), (10, 10, 10)), ('contrast', 0.9)]),
+    'vibrant_pop': Preset([('color', 1.3), ('contrast', 1.15)], [('sharpness', 1.1)]),
+    'soft_pastel': Preset([_channels((0.9, 0.9, 0.9), (25, 25, 25)), ('color', 0.8), ('contrast', 0.85)]),
+
+    # Black & White Presets
+    'classic_bw': Preset([('gray',), ('contrast', 1.1)]),
+    'high_contrast_bw': Preset([('gray',), ('contrast', 1.5)]),
+    'soft_bw': Preset([('gray',), _channels((0.95, 0.95, 0.95), (10, 10, 10))]),
+    'dramatic_bw': Preset([('gray',), ('contrast', 1.6)], [('vignette', 60)]),
+    'film_bw': Preset([('gray',), ('contrast', 1.2)], [('grain', 10)]),
+
+    # Special Presets
+    'golden_hour': Preset([_channels((1.2, 1.1, 1.0), (15, 10, 0)), ('color', 1.1)]),
+    'blue_hour': Preset([_channels((1.0, 1.0, 1.2), (0, 0, 15)), ('color', 1.05), ('brightness', 0.95)]),
+    'sunset_glow': Preset([_channels((1.25, 1.1, 0.9))]),
+    'cool_tones': Preset([_channels((0.95, 1.0, 1.15))]),
+    'warm_tones': Preset([_channels((1.15, 1.0, 0.95))]),
+}
+
+
+def _luma(rgb: np.ndarray) -> np.ndarray:
+    """Pillow's RGB -> L conversion (ITU-R 601-2, fixed point with rounding)"""
+    r, g, b = (np.floor(rgb[:, i]).astype(np.int64) for i in range(3))
+    return ((r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16).astype(np.float32)
+
+
+def _blend(base, rgb: np.ndarray, factor: float) -> np.ndarray:
+    """Image.blend(base, rgb, factor): float32 math, clipped and truncated to uint8 levels"""
+    factor = np.float32(factor)
+    return np.floor(np.clip(base + factor * (rgb - base), 0, 255))
+
+
+def run_color_ops(rgb: np.ndarray, ops: List[tuple], means: Tuple[int, ...] = None):
+    """
+    Evaluate a color-only chain on an (N, 3) array of RGB values
+
+    Args:
+        rgb: float32 array of shape (N, 3) with values in 0..255
+        ops: Color operations of a preset
+        means: Mean luminance to use for each contrast step; when omitted the
+            mean of the values being evaluated is used
+
+    Returns:
+        Tuple of (float32 (N, 3) result, tuple of contrast means used)
+    """
+    rgb = rgb.astype(np.float32, copy=True)
+    used_means = []
+    for op in ops:
+        kind = op[0]
+        if kind == 'channels':
+            mul = np.asarray(op[1], dtype=np.float32)
+            add = np.asarray(op[2], dtype=np.float32)
+            rgb = np.floor(np.clip(rgb * mul + add, 0, 255))
+        elif kind == 'gray':
+            rgb = np.repeat(_luma(rgb)[:, None], 3, axis=1)
+        elif kind == 'brightness':
+            rgb = _blend(np.float32(0), rgb, op[1])
+        elif kind == 'color':
+            rgb = _blend(_luma(rgb)[:, None], rgb, op[1])
+        elif kind == 'contrast':
+            if means is not None:
+                mean = means[len(used_means)]
+            else:
+                mean = int(float(_luma(rgb).mean()) + 0.5)
+            used_means.append(mean)
+            rgb = _blend(np.float32(mean), rgb, op[1])
+        else:
+            raise ValueError(f"Unknown color operation: {kind}")
+    return rgb, tuple(used_means)
+
+
+def estimate_contrast_means(img: Image.Image, ops: List[tuple]) -> Tuple[int, ...]:
+    """
+    Estimate the mean luminance seen by each contrast step of a chain
+
+    Args:
+        img: RGB image the chain will be applied to (PIL image or (h, w, 3)
+            uint8 array)
+        ops: Color operations of a preset
+
+    Returns:
+        Tuple with one mean per contrast step
+    """
+    if isinstance(img, np.ndarray):
+        step = max(1, int((img.shape[0] * img.shape[1] / MEAN_SAMPLE_PIXELS) ** 0.5))
+        sample = img[::step, ::step]
+    elif img.width * img.height > MEAN_SAMPLE_PIXELS:
+        step = (img.width * img.height / MEAN_SAMPLE_PIXELS) ** 0.5
+        sample = img.resize(
+            (max(1, int(img.width / step)), max(1, int(img.height / step))),
+            Image.Resampling.NEAREST
+        )
+    else:
+        sample = img
+    rgb = np.asarray(sample, dtype=np.uint8).reshape(-1, 3).astype(np.float32)
+
+    # Only evaluate up to the last contrast step
+    last = max(i for i, op in enumerate(ops) if op[0] == 'contrast')
+    _, means = run_color_ops(rgb, ops[:last + 1])
+    return means
+
+
+def bake_color_ops(ops: List[tuple], means: Tuple[int, ...] = (), size: int = DEFAULT_LUT_SIZE):
+    """
+    Bake a color-only chain into a 3D LUT
+
+    Args:
+        ops: Color operations of a preset
+        means: Mean luminance for each contrast step
+        size: Lattice points per axis
+
+    Returns:
+        ImageFilter.Color3DLUT
+    """
+    levels = np.arange(size, dtype=np.float32) * np.float32(255.0 / (size - 1))
+    # Color3DLUT tables are ordered with red changing fastest, then green, then blue
+    b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+    lattice = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    table, _ = run_color_ops(lattice, ops, means)
+    table = (table / np.float32(255.0)).astype(np.float32)
+    return ImageFilter.Color3DLUT(size, table)
+
+
+def bake_channel_luts(ops: List[tuple], means: Tuple[int, ...] = ()) -> List[list]:
+    """
+    Bake a chain without channel mixing into one 256-entry table per channel
+
+    Args:
+        ops: Color operations (a leading 'gray' step is ignored; the tables
+            are then meant to be applied to the luminance image)
+        means: Mean luminance for each contrast step
+
+    Returns:
+        List of three lists of 256 ints (red, green, blue)
+    """
+    if ops and ops[0][0] == 'gray':
+        ops = ops[1:]
+    ramp = np.repeat(np.arange(256, dtype=np.float32)[:, None], 3, axis=1)
+    table, _ = run_color_ops(ramp, ops, means)
+    table = table.astype(np.uint8)
+    return [table[:, channel].tolist() for channel in range(3)]
+
+
+def _keyword_values(parts: List[str], count: int, cast=float) -> list:
+    """
+    The values of a .cube keyword line
+
+    Raises:
+        ValueError if the line does not have count values of the right type
+    """
+    values = parts[1:]
+    if len(values) != count:
+        raise ValueError(f'{parts[0]} needs {count} value{"s" if count > 1 else ""}')
+    try:
+        return [cast(value) for value in values]
+    except ValueError:
+        raise ValueError(f'Invalid {parts[0]} value: {" ".join(values)}')
+
+
+def parse_cube_lut(data: bytes) -> ImageFilter.Color3DLUT:
+    """
+    Parse an Adobe/Resolve .cube 3D LUT
+
+    Args:
+        data: Raw file contents
+
+    Returns:
+        ImageFilter.Color3DLUT
+
+    Raises:
+        ValueError if the file is not a supported 3D .cube LUT
+    """
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ValueError('LUT file is not valid text')
+
+    size = None
+    domain_min = [0.0, 0.0, 0.0]
+    domain_max = [1.0, 1.0, 1.0]
+    rows = []
+
+    for raw_line in text.splitlines():
+        line = raw_line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split()
+        keyword = parts[0].upper()
+
+        if keyword == 'TITLE':
+            continue
+        elif keyword == 'LUT_3D_SIZE':
+            size = _keyword_values(parts, 1, int)[0]
+        elif keyword == 'LUT_1D_SIZE':
+            raise ValueError('1D .cube LUTs are not supported')
+        elif keyword == 'DOMAIN_MIN':
+            domain_min = _keyword_values(parts, 3)
+        elif keyword == 'DOMAIN_MAX':
+            domain_max = _keyword_values(parts, 3)
+        elif keyword == 'LUT_3D_INPUT_RANGE':
+            low, high = _keyword_values(parts, 2)
+            domain_min = [low] * 3
+            domain_max = [high] * 3
+        elif keyword[0].isalpha():
+            # Unknown metadata keyword
+            continue
+        else:
+            rows.append(parts)
+
+    if size is None:
+        raise ValueError('Missing LUT_3D_SIZE')
+    if not 2 <= size <= 65:
+        raise ValueError(f'LUT_3D_SIZE must be between 2 and 65, got {size}')
+    if domain_min != [0.0, 0.0, 0.0] or domain_max != [1.0, 1.0, 1.0]:
+        raise ValueError('Only LUTs with the default 0-1 domain are supported')
+    if len(rows) != size ** 3:
+        raise ValueError(f'Expected {size ** 3} LUT entries, found {len(rows)}')
+
+    try:
+        table = np.array(rows, dtype=np.float32)
+    except ValueError:
+        raise ValueError('LUT entries must be three numbers per line')
+    if table.shape != (size ** 3, 3):
+        raise ValueError('LUT entries must be three numbers per line')
+
+    # .cube data is already ordered with red changing fastest
+    return ImageFilter.Color3DLUT(size, np.clip(table, 0.0, 1.0))
+
+
+class ColorLUTEngine:
+    """Bakes, caches and applies 3D LUTs for presets and uploaded .cube files"""
+
+    def __init__(self, size: int = DEFAULT_LUT_SIZE, cache_size: int = 32):
+        self.size = size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key, build):
+        with self._lock:
+            lut = self._cache.get(key)
+            if lut is not None:
+                self._cache.move_to_end(key)
+                return lut
+        lut = build()
+        with self._lock:
+            self._cache[key] = lut
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return lut
+
+    def warm(self) -> None:
+        """Bake every preset whose cube does not depend on image statistics"""
+        for name, preset in FILTER_PRESETS.items():
+            if not preset.needs_mean:
+                self.preset_lut(name, ())
+        logger.info(f"[LUT] Baked {len(self._cache)} preset color tables")
+
+    def preset_lut(self, preset_name: str, means: Tuple[int, ...]):
+        """
+        Get the baked color stage of a preset for the given contrast means
+
+        Returns:
+            Per-channel tables for 'channels'/'gray' presets, or a Color3DLUT
+        """
+        preset = FILTER_PRESETS[preset_name]
+        if preset.kind == 'cube':
+            build = lambda: bake_color_ops(preset.color_ops, means, self.size)
+        else:
+            build = lambda: bake_channel_luts(preset.color_ops, means)
+        return self._cached(('preset', preset_name, means), build)
+
+    def load_cube(self, data: bytes) -> ImageFilter.Color3DLUT:
+        """
+        Parse an uploaded .cube LUT, reusing the result for identical uploads
+
+        Args:
+            data: Raw .cube file contents
+
+        Returns:
+            ImageFilter.Color3DLUT
+
+        Raises:
+            ValueError if the LUT cannot be parsed
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        return self._cached(('cube', digest), lambda: parse_cube_lut(data))
+
+
+# Create singleton instance
+color_lut_engine = ColorLUTEngine(config.LUT_SIZE, config.LUT_CACHE_SIZE)
@@ -0,0 +1,119 @@
+"""
+Fused color stage for the filter tool
+
+Saturation, temperature and tint are affine maps of an RGB triple, so they
+are composed into one 3x4 matrix and applied in a single cv2.transform pass.
+Vibrance and hue shift are pointwise functions of the S and H channels, so
+they share one RGB->HSV conversion and are applied together through a
+3-channel lookup table. processing.filter_pipeline applies both to its
+working buffer in place, instead of one PIL round trip (and up to three HSV
+conversions) per slider.
+
+The sliders were previously clipped one at a time; the fused matrix clips
+once at the end, which only differs for colors pushed past 0 or 255 by an
+earlier slider and pulled back by a later one. Vibrance is now applied
+after temperature and tint rather than before them.
+"""
+from typing import Optional
+
+import numpy as np
+
+# Slider keys that feed the color matrix, in the order they are composed
+MATRIX_KEYS = ('saturation', 'temperature', 'tint')
+
+# Slider keys applied in HSV
+HSV_KEYS = ('vibrance', 'hueShift')
+
+# Luma weights of Pillow's RGB -> L conversion (what ImageEnhance.Color blends toward)
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float64)
+
+
+def _affine(linear: np.ndarray, offset=(0.0, 0.0, 0.0)) -> np.ndarray:
+    """4x4 homogeneous matrix from a 3x3 linear part and an offset"""
+    matrix = np.eye(4)
+    matrix[:3, :3] = linear
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def build_color_matrix(filter_data: dict) -> Optional[np.ndarray]:
+    """
+    Compose saturation, temperature and tint into one 3x4 matrix
+
+    Args:
+        filter_data: Filter settings from the request
+
+    Returns:
+        float32 array of shape (3, 4) for cv2.transform, or None if every
+        matrix slider is 0
+    """
+    saturation = float(filter_data.get('saturation', 0))
+    temperature = float(filter_data.get('temperature', 0))
+    tint = float(filter_data.get('tint', 0))
+    if not (saturation or temperature or tint):
+        return None
+
+    steps = []
+
+    # --- SATURATION --- (blend toward luma, as ImageEnhance.Color does)
+    if saturation != 0:
+        factor = max(0.0, 1.0 + saturation / 100.0)
+        linear = factor * np.eye(3) + (1.0 - factor) * np.tile(_LUMA, (3, 1))
+        steps.append(_affine(linear))
+
+    # --- TEMPERATURE ---
+    if temperature != 0:
+        if temperature > 0:  # Warmer
+            offset = (temperature * 1.5, 0.0, -temperature * 0.5)
+        else:  # Cooler
+            offset = (temperature * 0.5, 0.0, -temperature * 1.5)
+        steps.append(_affine(np.eye(3), offset))
+
+    # --- TINT ---
+    if tint != 0:
+        if tint > 0:  # More green
+            offset = (0.0, tint * 1.5, 0.0)
+        else:  # More magenta
+            offset = (-tint * 0.75, 0.0, -tint * 0.75)
+        steps.append(_affine(np.eye(3), offset))
+
+    matrix = np.eye(4)
+    for step in steps:
+        matrix = step @ matrix
+    return matrix[:3].astype(np.float32)
+
+
+def build_hsv_lut(filter_data: dict) -> Optional[np.ndarray]:
+    """
+    Compile vibrance and hue shift into a lookup table over 8-bit HSV
+
+    OpenCV's 8-bit hue runs 0-179; saturation and value run 0-255. Value
+    passes through unchanged.
+
+    Args:
+        filter_data: Filter settings from the request
+
+    Returns:
+        uint8 array of shape (256, 1, 3) for cv2.LUT, or None if both
+        sliders are 0
+    """
+    vibrance = float(filter_data.get('vibrance', 0))
+    hue_shift = float(filter_data.get('hueShift', 0))
+    if not (vibrance or hue_shift):
+        return None
+
+    values = np.arange(256, dtype=np.float32)
+    lut = np.empty((256, 1, 3), dtype=np.uint8)
+
+    # --- HUE SHIFT ---
+    lut[:, 0, 0] = ((values + hue_shift) % 180).astype(np.uint8) if hue_shift else values.astype(np.uint8)
+
+    # --- VIBRANCE --- (less saturated colors move more)
+    if vibrance:
+        saturation = np.clip(values + vibrance * (1.0 - values / 255.0) * 0.5, 0, 255)
+        lut[:, 0, 1] = saturation.astype(np.uint8)
+    else:
+        lut[:, 0, 1] = values.astype(np.uint8)
+
+    lut[:, 0, 2] = values.astype(np.uint8)
+    return lut
@@ -0,0 +1,374 @@
+"""
+Pluggable executor for CPU-bound image work
+
+Image functions normally run in the request thread, where they compete for
+the GIL with every other request in the worker. The process backend runs them
+in a small pool of worker processes. By the time the pool starts, the app has
+threads (model loading, HTTP clients, the server's own), and forking such a
+process can hand a child a lock that some other thread held. Workers are
+therefore started by a fork server: a fresh, single-threaded process that
+imports the processing package once and forks every worker, including the
+ones that replace crashed workers, so the imported libraries are still shared
+copy-on-write. Task functions are pickled by reference and must live in the
+processing package (not in app.py, which the workers never import).
+Pixel data is handed over through shared memory blocks; only the function
+reference and its small arguments are pickled.
+
+Each worker process runs one task at a time, which keeps the failure domain to
+a single task: a worker that crashes or runs past its timeout is killed and
+replaced without affecting the tasks running in the other workers.
+"""
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+import traceback
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, List, Optional, Tuple
+
+from PIL import Image
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+
+class ExecutorError(Exception):
+    """Base class for executor failures"""
+
+
+class ExecutorBusy(ExecutorError):
+    """Raised when the executor queue is full"""
+
+
+class TaskTimeout(ExecutorError):
+    """Raised when a task runs longer than its timeout"""
+
+
+class WorkerCrashed(ExecutorError):
+    """Raised when a worker process dies while running a task"""
+
+
+class TaskFailed(ExecutorError):
+    """Raised when the task function itself raised an exception"""
+
+
+# ============================================================================
+# SHARED MEMORY TRANSFER
+# ============================================================================
+
+# (shared memory name, mode, size, byte count)
+PackedImage = Tuple[str, str, Tuple[int, int], int]
+
+
+def _transferable(img: Image.Image) -> Image.Image:
+    # Palette and bilevel images do not survive a raw byte round trip on
+    # their own, so hand them over in an equivalent full-color mode
+    if img.mode == 'P':
+        return img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    if img.mode == '1':
+        return img.convert('L')
+    return img
+
+
+def _pack_image(img: Image.Image) -> Tuple[PackedImage, SharedMemory]:
+    """
+    Copy an image's pixels into a new shared memory block
+
+    Returns:
+        Tuple of (packed description, SharedMemory owned by the caller)
+    """
+    img = _transferable(img)
+    img.load()
+    data = img.tobytes()
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return (shm.name, img.mode, img.size, len(data)), shm
+
+
+def _unpack_image(packed: PackedImage) -> Image.Image:
+    """Rebuild an image from a shared memory block without taking ownership of it"""
+    name, mode, size, nbytes = packed
+    shm = SharedMemory(name=name)
+    try:
+        with shm.buf[:nbytes] as view:
+            return Image.frombytes(mode, size, view)
+    finally:
+        shm.close()
+
+
+def _release(shm: SharedMemory) -> None:
+    try:
+        shm.close()
+        shm.unlink()
+    except (OSError, BufferError):
+        pass
+
+
+def _unlink_by_name(name: str) -> None:
+    try:
+        _release(SharedMemory(name=name))
+    except OSError:
+        pass
+
+
+# ============================================================================
+# WORKER PROCESS
+# ============================================================================
+
+def _worker_main(conn) -> None:
+    """Task loop of a worker process"""
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+
+        fn, packed_images, single, args, kwargs = task
+        try:
+            images = [_unpack_image(packed) for packed in packed_images]
+            result = fn(images[0] if single else images, *args, **kwargs)
+            packed, shm = _pack_image(result)
+            # The parent unlinks the block once it has copied the result out
+            shm.close()
+            conn.send(('ok', packed))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}', traceback.format_exc()))
+
+
+class _Worker:
+    """A worker process and the pipe used to talk to it"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class InlineExecutor:
+    """Runs image functions directly in the calling thread"""
+
+    backend = 'inline'
+
+    def start(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+    def run(self, fn: Callable, images, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Run fn(images, *args, **kwargs) and return its result
+
+        Args:
+            fn: Function taking an image (or list of images) first and returning an image
+            images: PIL image or list of PIL images
+            timeout: Ignored by this backend
+        """
+        return fn(images, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {'backend': self.backend}
+
+
+class ProcessImageExecutor:
+    """Runs image functions in a pool of worker processes started by a fork server"""
+
+    backend = 'process'
+
+    def __init__(self, workers: int = 2, max_pending: int = 4, task_timeout: float = 60.0):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.task_timeout = task_timeout
+        self._context = multiprocessing.get_context('forkserver')
+        # Imported once by the fork server, before it forks any worker
+        self._context.set_forkserver_preload(['processing'])
+        self._idle: 'queue.Queue[_Worker]' = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'tasks': 0, 'failures': 0, 'timeouts': 0, 'crashes': 0, 'rejected': 0, 'restarts': 0}
+
+    def start(self) -> None:
+        """Start the worker processes (the fork server is started on first use)"""
+        with self._lock:
+            if self._started:
+                return
+            # Workers must report their shared memory blocks to the parent's
+            # tracker rather than each starting a tracker of their own
+            resource_tracker.ensure_running()
+            for _ in range(self.workers):
+                self._idle.put(_Worker(self._context))
+            self._started = True
+        logger.info(f"[EXECUTOR] Started {self.workers} image worker processes")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        self._count('restarts')
+        self._idle.put(_Worker(self._context))
+
+    def run(self, fn: Callable, images, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Run fn(images, *args, **kwargs) in a worker process and return its result
+
+        fn must be a module-level function so it can be referenced by name in
+        the worker. Image pixels travel through shared memory; the other
+        arguments are pickled and should stay small.
+
+        Args:
+            fn: Function taking an image (or list of images) first and returning an image
+            images: PIL image or list of PIL images
+            timeout: Seconds to wait for the result (defaults to the executor's task timeout)
+
+        Returns:
+            PIL image returned by fn
+
+        Raises:
+            ExecutorBusy if max_pending tasks are already queued or running
+            TaskTimeout, WorkerCrashed or TaskFailed if the task did not complete
+        """
+        if not self._started:
+            self.start()
+
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise ExecutorBusy(f'Image executor is busy ({self.max_pending} tasks pending)')
+
+        timeout = self.task_timeout if timeout is None else timeout
+        single = not isinstance(images, (list, tuple))
+        blocks: List[SharedMemory] = []
+        try:
+            deadline = time.monotonic() + timeout
+            try:
+                worker = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                self._count('timeouts')
+                raise TaskTimeout(f'No image worker became free within {timeout:.0f}s')
+
+            packed_images = []
+            for img in ([images] if single else images):
+                packed, shm = _pack_image(img)
+                packed_images.append(packed)
+                blocks.append(shm)
+
+            try:
+                message = pickle.dumps((fn, packed_images, single, args, kwargs))
+            except Exception as e:
+                self._idle.put(worker)
+                raise TaskFailed(f'Cannot send {fn.__name__} to a worker: {e}')
+
+            try:
+                worker.conn.send_bytes(message)
+                if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    self._count('timeouts')
+                    self._replace(worker)
+                    raise TaskTimeout(f'{fn.__name__} did not finish within {timeout:.0f}s')
+                reply = worker.conn.recv()
+            except (EOFError, OSError, BrokenPipeError):
+                self._count('crashes')
+                logger.error(f"[EXECUTOR] Worker died while running {fn.__name__}, restarting it")
+                self._replace(worker)
+                raise WorkerCrashed(f'Image worker crashed while running {fn.__name__}')
+
+            worker.tasks += 1
+            self._idle.put(worker)
+            self._count('tasks')
+
+            if reply[0] == 'error':
+                self._count('failures')
+                logger.error(f"[EXECUTOR] {fn.__name__} failed in worker:\n{reply[2]}")
+                raise TaskFailed(reply[1])
+
+            packed = reply[1]
+            try:
+                return _unpack_image(packed)
+            finally:
+                _unlink_by_name(packed[0])
+        finally:
+            for shm in blocks:
+                _release(shm)
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data.update({
+            'backend': self.backend,
+            'workers': self.workers,
+            'idle_workers': self._idle.qsize(),
+            'max_pending': self.max_pending,
+            'task_timeout': self.task_timeout
+        })
+        return data
+
+
+def create_executor(backend: str, workers: int, max_pending: int, task_timeout: float):
+    """
+    Build the executor for a backend name
+
+    Args:
+        backend: 'inline' or 'process'
+
+    Returns:
+        InlineExecutor or ProcessImageExecutor
+    """
+    if backend == 'process':
+        if 'forkserver' not in multiprocessing.get_all_start_methods():
+            logger.warning("[EXECUTOR] forkserver is not available on this platform, running image work inline")
+            return InlineExecutor()
+        return ProcessImageExecutor(workers, max_pending, task_timeout)
+    if backend != 'inline':
+        logger.warning(f"[EXECUTOR] Unknown backend '{backend}', running image work inline")
+    return InlineExecutor()
+
+
+# Create singleton instance
+image_executor = create_executor(
+    config.EXECUTOR_BACKEND,
+    config.EXECUTOR_WORKERS,
+    config.EXECUTOR_MAX_PENDING,
+    config.EXECUTOR_TASK_TIMEOUT_SECONDS
+)
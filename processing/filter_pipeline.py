@@ -0,0 +1,579 @@
+"""
+Filter tool pipeline on a single working buffer
+
+The filter stages used to hand a PIL image from one to the next, and most of
+them converted it to a float32 numpy array and back, allocating a full copy
+each way. Here the pixels are copied once into a uint8 (h, w, 3) working
+buffer, and every stage modifies it in place: AI enhance, preset, .cube LUT,
+tone curve, color matrix, sharpening, blur, vignette and grain. They write
+through OpenCV dst= and numpy out= arguments. The arithmetic that needs
+floats (white balance, clarity, vignette, grain) runs on a float32 scratch
+block of BLOCK_ROWS rows at a time, not on a full-size float copy. The
+result goes back to PIL once, for encoding.
+
+Working and scratch buffers come from a BufferPool keyed by shape and
+dtype, so requests for images of the same size reuse them instead of
+allocating. Every run records the time and the number of newly allocated
+full-size arrays of each stage. These are logged per request and summed
+in filter_stage_stats(). The totals are per process: with the process
+executor, each worker keeps its own.
+
+Color3DLUT (.cube files and the mixing presets) only exists in Pillow, so
+that stage still makes one round trip through a PIL image.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+
+from config import config
+from processing.color_lut import FILTER_PRESETS, color_lut_engine, estimate_contrast_means
+from processing.color_matrix import build_color_matrix, build_hsv_lut
+from processing.grain import grain_bank, grain_seed
+from processing.tone import build_tone_lut
+from processing.vignette import vignette_masks
+
+logger = logging.getLogger('imgcraft')
+
+# Rows per float32 scratch block
+BLOCK_ROWS = 256
+
+# ImageFilter.SMOOTH, which ImageEnhance.Sharpness blends away from
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+# Sharpening kernel of the AI auto enhance: identity plus a ninth of the
+# 3x3 Laplacian sharpen, so it sums to 1 and keeps the brightness
+_ENHANCE_KERNEL = np.array([[-1, -1, -1], [-1, 17, -1], [-1, -1, -1]], dtype=np.float32) / 9.0
+
+# AI auto enhance tiers, fastest first
+ENHANCE_TIERS = ('fast', 'balanced', 'best')
+
+# Non-local means (template window, search window) per tier
+_NLM_WINDOWS = {'balanced': (5, 11), 'best': (7, 21)}
+
+# Bilateral filter of the fast tier (diameter, sigma color, sigma space)
+_BILATERAL_DIAMETER = 5
+_BILATERAL_SIGMA_COLOR = 10
+_BILATERAL_SIGMA_SPACE = 3
+
+# Seconds per megapixel each tier takes (measured on one core). The 'auto'
+# choice uses these fixed costs, so an image gets the same tier on every
+# worker; measured runs (averaged with _COST_SMOOTHING) are only reported
+_DEFAULT_SECONDS_PER_MP = {'fast': 0.05, 'balanced': 1.0, 'best': 3.0}
+_COST_SMOOTHING = 0.3
+
+# Pixels sampled for the fast tier's white balance statistics
+ENHANCE_PROXY_PIXELS = 65_536
+
+
+# ============================================================================
+# BUFFER POOL
+# ============================================================================
+
+class BufferPool:
+    """Free numpy arrays kept for reuse, keyed by shape and dtype"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._free: 'OrderedDict[tuple, List[np.ndarray]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'allocations': 0, 'evictions': 0}
+
+    def take(self, shape: tuple, dtype) -> Tuple[np.ndarray, bool]:
+        """
+        Get an array of the given shape and dtype (contents undefined)
+
+        Returns:
+            Tuple of (array, True if it was newly allocated)
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                if not free:
+                    del self._free[key]
+                self._bytes -= array.nbytes
+                self._stats['hits'] += 1
+                return array, False
+            self._stats['allocations'] += 1
+        return np.empty(shape, dtype=dtype), True
+
+    def give(self, array: np.ndarray) -> None:
+        """Return an array to the pool, dropping the least recently used ones past max_bytes"""
+        if array.nbytes > self.max_bytes:
+            return
+        key = (array.shape, array.dtype.str)
+        with self._lock:
+            self._free.setdefault(key, []).append(array)
+            self._free.move_to_end(key)
+            self._bytes += array.nbytes
+            while self._bytes > self.max_bytes:
+                oldest_key, arrays = next(iter(self._free.items()))
+                self._bytes -= arrays.pop(0).nbytes
+                if not arrays:
+                    del self._free[oldest_key]
+                self._stats['evictions'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, pooled_bytes=self._bytes, shapes=len(self._free))
+
+
+# Create singleton instance
+buffer_pool = BufferPool(config.FILTER_BUFFER_POOL_MB * 1024 * 1024)
+
+_stage_totals: Dict[str, Dict[str, float]] = {}
+_stage_lock = threading.Lock()
+
+
+def filter_stage_stats() -> dict:
+    """Runs, total milliseconds and allocations per stage, plus buffer pool, mask cache and enhance tier counters"""
+    with _stage_lock:
+        stages = {
+            name: {'runs': int(totals['runs']), 'ms': round(totals['ms'], 1), 'allocations': int(totals['allocations'])}
+            for name, totals in _stage_totals.items()
+        }
+    return {
+        'stages': stages,
+        'buffers': buffer_pool.stats(),
+        'vignette_masks': vignette_masks.stats(),
+        'ai_enhance': enhance_tiers.stats()
+    }
+
+
+# ============================================================================
+# PIPELINE RUN
+# ============================================================================
+
+class FilterRun:
+    """Working buffer, scratch buffers and stage records of one pipeline run"""
+
+    def __init__(self, img: Image.Image, pool: BufferPool):
+        self.pool = pool
+        self.stages: List[Tuple[str, float, int]] = []
+        self._taken: List[np.ndarray] = []
+        self._scratch: Dict[tuple, np.ndarray] = {}
+        self._allocations = 0
+        with self.stage('load'):
+            self.pixels = self._take((img.height, img.width, 3), np.uint8)
+            # The array interface goes through one bytes copy of the image
+            np.copyto(self.pixels, np.asarray(img))
+            self._allocations += 1
+
+    def _take(self, shape: tuple, dtype) -> np.ndarray:
+        array, allocated = self.pool.take(shape, dtype)
+        self._taken.append(array)
+        if allocated:
+            self._allocations += 1
+        return array
+
+    def scratch(self, name: str, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """Scratch buffer reused by every stage that asks for the same name and shape"""
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        array = self._scratch.get(key)
+        if array is None:
+            array = self._scratch[key] = self._take(shape, dtype)
+        return array
+
+    def float_block(self, name: str, channels: int = 3) -> np.ndarray:
+        """float32 scratch of BLOCK_ROWS rows (fewer for short images)"""
+        height, width = self.pixels.shape[:2]
+        shape = (min(BLOCK_ROWS, height), width, channels) if channels > 1 else (min(BLOCK_ROWS, height), width)
+        return self.scratch(name, shape, np.float32)
+
+    def row_blocks(self):
+        """(top, bottom) row ranges of at most BLOCK_ROWS rows"""
+        height = self.pixels.shape[0]
+        for top in range(0, height, BLOCK_ROWS):
+            yield top, min(height, top + BLOCK_ROWS)
+
+    def count_allocation(self, count: int = 1) -> None:
+        """Record full-size arrays a stage had to allocate outside the pool"""
+        self._allocations += count
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        before = self._allocations
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.perf_counter() - started) * 1000, self._allocations - before))
+
+    def to_image(self) -> Image.Image:
+        """Copy the working buffer into a new PIL image and record the run"""
+        with self.stage('to_image'):
+            img = Image.fromarray(self.pixels)
+            self._allocations += 1
+        self._record()
+        return img
+
+    def release(self) -> None:
+        """Hand every buffer back to the pool"""
+        for array in self._taken:
+            self.pool.give(array)
+        self._taken = []
+        self._scratch = {}
+
+    def _record(self) -> None:
+        with _stage_lock:
+            for name, elapsed_ms, allocations in self.stages:
+                totals = _stage_totals.setdefault(name, {'runs': 0, 'ms': 0.0, 'allocations': 0})
+                totals['runs'] += 1
+                totals['ms'] += elapsed_ms
+                totals['allocations'] += allocations
+        height, width = self.pixels.shape[:2]
+        summary = ', '.join(f"{name} {elapsed_ms:.1f}ms/{allocations}" for name, elapsed_ms, allocations in self.stages)
+        logger.debug(f"[FILTER] {width}x{height} stages (time/allocations): {summary}")
+
+
+# ============================================================================
+# STAGES
+# ============================================================================
+
+def _copy_edges(target: np.ndarray, source: np.ndarray) -> None:
+    """Pillow's 3x3 filters leave the outermost pixels unfiltered"""
+    target[0] = source[0]
+    target[-1] = source[-1]
+    target[:, 0] = source[:, 0]
+    target[:, -1] = source[:, -1]
+
+
+def _channel_table(lut: List[list]) -> np.ndarray:
+    """Three 256-entry channel tables as a cv2.LUT table"""
+    return np.ascontiguousarray(np.array(lut, dtype=np.uint8).T.reshape(256, 1, 3))
+
+
+def _white_balance(run: FilterRun, lab: np.ndarray, means) -> None:
+    """Gray world: shift a and b toward neutral in place, weighted by lightness"""
+    weights = run.float_block('weights', channels=1)
+    values = run.float_block('values', channels=1)
+    for top, bottom in run.row_blocks():
+        rows = lab[top:bottom]
+        weight = weights[:bottom - top]
+        np.multiply(rows[..., 0], np.float32(1.1 / 255.0), out=weight, dtype=np.float32)
+        for channel in (1, 2):
+            value = values[:bottom - top]
+            np.multiply(weight, np.float32(128 - means[channel]), out=value)
+            value += rows[..., channel]
+            np.clip(value, 0, 255, out=value)
+            np.copyto(rows[..., channel], value, casting='unsafe')
+
+
+def _proxy_means(lab: np.ndarray) -> np.ndarray:
+    """Channel means of a strided sample of about ENHANCE_PROXY_PIXELS pixels"""
+    step = max(1, int((lab.shape[0] * lab.shape[1] / ENHANCE_PROXY_PIXELS) ** 0.5))
+    return lab[::step, ::step].reshape(-1, 3).mean(axis=0)
+
+
+def ai_auto_enhance(run: FilterRun, tier: str = 'best') -> None:
+    """
+    CLAHE on lightness, sharpening, denoising and gray-world white balance
+
+    'best' denoises with full non-local means, 'balanced' with smaller
+    windows, and 'fast' with a bilateral filter. 'fast' also white-balances
+    straight after CLAHE, using means from a sample of pixels, which saves
+    two color conversions.
+
+    Works on two scratch buffers and writes the working buffer only in its
+    last step, so a failure part way leaves the image untouched.
+    """
+    pixels = run.pixels
+    first = run.scratch('rgb_a', pixels.shape)
+    second = run.scratch('rgb_b', pixels.shape)
+    lightness = run.scratch('plane', pixels.shape[:2])
+
+    # Adaptive histogram equalization of the L channel in LAB (OpenCV builds
+    # one table per tile and interpolates between them)
+    cv2.cvtColor(pixels, cv2.COLOR_RGB2LAB, dst=first)
+    cv2.extractChannel(first, 0, dst=lightness)
+    cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(lightness, dst=lightness)
+    cv2.insertChannel(lightness, first, 0)
+
+    if tier == 'fast':
+        _white_balance(run, first, _proxy_means(first))
+        cv2.cvtColor(first, cv2.COLOR_LAB2RGB, dst=second)
+        cv2.filter2D(second, -1, _ENHANCE_KERNEL, dst=first)
+        cv2.bilateralFilter(first, _BILATERAL_DIAMETER, _BILATERAL_SIGMA_COLOR, _BILATERAL_SIGMA_SPACE, dst=pixels)
+        return
+
+    cv2.cvtColor(first, cv2.COLOR_LAB2RGB, dst=second)
+
+    # Subtle sharpening, then noise reduction
+    cv2.filter2D(second, -1, _ENHANCE_KERNEL, dst=first)
+    template_window, search_window = _NLM_WINDOWS[tier]
+    cv2.fastNlMeansDenoisingColored(first, second, 3, 3, template_window, search_window)
+
+    # Auto white balance on the final colors
+    cv2.cvtColor(second, cv2.COLOR_RGB2LAB, dst=first)
+    _white_balance(run, first, cv2.mean(first))
+    cv2.cvtColor(first, cv2.COLOR_LAB2RGB, dst=pixels)
+
+
+class EnhanceTierModel:
+    """
+    Picks the best AI enhance tier expected to finish within a time budget
+
+    The choice depends only on the pixel count: each tier's cost is a fixed
+    number of seconds per megapixel, so one input gets the same tier (and
+    output) on every worker. The measured cost of this process's runs is
+    tracked as a moving average for the metrics, to show when the fixed
+    costs no longer fit the host.
+    """
+
+    def __init__(self, budget_seconds: float = 2.5, seconds_per_mp: Optional[Dict[str, float]] = None):
+        self.budget_seconds = budget_seconds
+        self.seconds_per_mp = dict(seconds_per_mp or _DEFAULT_SECONDS_PER_MP)
+        self._measured = dict(self.seconds_per_mp)
+        self._runs = {tier: 0 for tier in ENHANCE_TIERS}
+        self._lock = threading.Lock()
+
+    def choose(self, pixel_count: int, budget_seconds: Optional[float] = None) -> str:
+        """Slowest (best) tier whose fixed cost fits the budget, or 'fast'"""
+        budget = self.budget_seconds if budget_seconds is None else budget_seconds
+        megapixels = pixel_count / 1_000_000
+        for tier in reversed(ENHANCE_TIERS):
+            if self.seconds_per_mp[tier] * megapixels <= budget:
+                return tier
+        return ENHANCE_TIERS[0]
+
+    def record(self, tier: str, pixel_count: int, seconds: float) -> None:
+        megapixels = max(pixel_count / 1_000_000, 0.01)
+        with self._lock:
+            previous = self._measured[tier]
+            self._measured[tier] = previous + _COST_SMOOTHING * (seconds / megapixels - previous)
+            self._runs[tier] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'budget_ms': round(self.budget_seconds * 1000),
+                'seconds_per_mp': dict(self.seconds_per_mp),
+                'measured_seconds_per_mp': {tier: round(cost, 3) for tier, cost in self._measured.items()},
+                'runs': dict(self._runs)
+            }
+
+
+# Create singleton instance
+enhance_tiers = EnhanceTierModel(config.AI_ENHANCE_BUDGET_MS / 1000)
+
+
+def enhance_tier(filter_data: dict, pixel_count: int) -> str:
+    """
+    Tier for a request: 'enhanceQuality' if it names one, else chosen from the budget
+
+    Args:
+        filter_data: Filter settings ('enhanceQuality': 'auto', 'fast',
+            'balanced' or 'best'; missing or unknown means 'auto')
+        pixel_count: Image width times height
+
+    Returns:
+        One of ENHANCE_TIERS
+    """
+    requested = str(filter_data.get('enhanceQuality', 'auto')).lower()
+    if requested in ENHANCE_TIERS:
+        return requested
+    return enhance_tiers.choose(pixel_count)
+
+
+def apply_cube(run: FilterRun, lut: ImageFilter.Color3DLUT) -> None:
+    """Apply a Color3DLUT (through Pillow, which has the only implementation)"""
+    graded = Image.fromarray(run.pixels).filter(lut)
+    np.copyto(run.pixels, np.asarray(graded))
+    run.count_allocation(3)
+
+
+def apply_preset(run: FilterRun, preset_name: str) -> List[tuple]:
+    """
+    Apply the color stage of a preset in place
+
+    Returns:
+        Spatial steps still to apply (none for unknown presets)
+    """
+    preset = FILTER_PRESETS.get(preset_name)
+    if preset is None:
+        return []
+    pixels = run.pixels
+    means = estimate_contrast_means(pixels, preset.color_ops) if preset.needs_mean else ()
+    lut = color_lut_engine.preset_lut(preset_name, means)
+
+    if preset.kind == 'cube':
+        apply_cube(run, lut)
+    else:
+        if preset.kind == 'gray':
+            luminance = run.scratch('plane', pixels.shape[:2])
+            cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY, dst=luminance)
+            cv2.cvtColor(luminance, cv2.COLOR_GRAY2RGB, dst=pixels)
+        cv2.LUT(pixels, _channel_table(lut), dst=pixels)
+    return preset.spatial_ops
+
+
+def sharpen(run: FilterRun, factor: float) -> None:
+    """ImageEnhance.Sharpness: blend away from (factor > 1) the SMOOTH-filtered image"""
+    pixels = run.pixels
+    smooth = run.scratch('rgb_a', pixels.shape)
+    cv2.filter2D(pixels, -1, _SMOOTH_KERNEL, dst=smooth)
+    _copy_edges(smooth, pixels)
+    cv2.addWeighted(pixels, factor, smooth, 1.0 - factor, 0, dst=pixels)
+
+
+def unsharp_mask(run: FilterRun, radius: float, percent: int, threshold: int) -> None:
+    """ImageFilter.UnsharpMask: add back the detail that differs by at least threshold"""
+    pixels = run.pixels
+    blurred = run.scratch('rgb_a', pixels.shape)
+    cv2.GaussianBlur(pixels, (0, 0), radius, dst=blurred)
+    details = run.float_block('values')
+    masks = run.float_block('weights')
+    for top, bottom in run.row_blocks():
+        detail = details[:bottom - top]
+        mask = masks[:bottom - top]
+        np.subtract(pixels[top:bottom], blurred[top:bottom], out=detail, dtype=np.float32)
+        np.abs(detail, out=mask)
+        np.greater_equal(mask, threshold, out=mask)
+        detail *= mask
+        detail *= np.float32(percent / 100.0)
+        detail += pixels[top:bottom]
+        np.clip(detail, 0, 255, out=detail)
+        np.copyto(pixels[top:bottom], detail, casting='unsafe')
+
+
+def gaussian_blur(run: FilterRun, radius: float) -> None:
+    cv2.GaussianBlur(run.pixels, (0, 0), radius, dst=run.pixels)
+
+
+def vignette(run: FilterRun, strength: float) -> None:
+    """Darken toward the corners, a block of mask rows at a time (see processing.vignette)"""
+    pixels = run.pixels
+    rows, cols = pixels.shape[:2]
+    mask = vignette_masks.get(cols, rows, strength)
+
+    values = run.float_block('values')
+    factors = run.float_block('mask', channels=1)
+    for top, bottom in run.row_blocks():
+        value = values[:bottom - top]
+        factor = mask.rows(top, bottom, factors)
+        np.multiply(pixels[top:bottom], factor[:, :, None], out=value, dtype=np.float32)
+        np.clip(value, 0, 255, out=value)
+        np.copyto(pixels[top:bottom], value, casting='unsafe')
+
+
+def grain(run: FilterRun, amount: float, seed: int, stream: int = 0) -> None:
+    """Add film grain with standard deviation amount / 2 from the texture bank (see processing.grain)"""
+    grain_bank.apply(run.pixels, amount, seed, run.float_block('values'), stream)
+
+
+def apply_manual(run: FilterRun, filter_data: dict, seed: int = 0) -> None:
+    """Manual adjustment sliders, in the tool's order (seed is the grain seed)"""
+    pixels = run.pixels
+
+    # --- EXPOSURE / BRIGHTNESS / CONTRAST / HIGHLIGHTS / SHADOWS / WHITES / BLACKS ---
+    tone_lut = build_tone_lut(filter_data)
+    if tone_lut is not None:
+        with run.stage('tone'):
+            cv2.LUT(pixels, tone_lut, dst=pixels)
+
+    # --- SATURATION / TEMPERATURE / TINT / VIBRANCE / HUE SHIFT ---
+    matrix = build_color_matrix(filter_data)
+    if matrix is not None:
+        with run.stage('color_matrix'):
+            cv2.transform(pixels, matrix, dst=pixels)
+    hsv_lut = build_hsv_lut(filter_data)
+    if hsv_lut is not None:
+        with run.stage('hsv'):
+            hsv = run.scratch('rgb_a', pixels.shape)
+            cv2.cvtColor(pixels, cv2.COLOR_RGB2HSV, dst=hsv)
+            cv2.LUT(hsv, hsv_lut, dst=hsv)
+            cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB, dst=pixels)
+
+    # --- SHARPNESS ---
+    sharpness = float(filter_data.get('sharpness', 0))
+    if sharpness > 0:
+        with run.stage('sharpness'):
+            sharpen(run, 1.0 + (sharpness / 50.0))
+
+    # --- CLARITY ---
+    clarity = float(filter_data.get('clarity', 0))
+    if clarity > 0:
+        with run.stage('clarity'):
+            unsharp_mask(run, 2, int(clarity * 1.5), 3)
+
+    # --- BLUR ---
+    blur = float(filter_data.get('blur', 0))
+    if blur > 0:
+        with run.stage('blur'):
+            gaussian_blur(run, blur / 10.0)
+
+    # --- VIGNETTE ---
+    strength = float(filter_data.get('vignette', 0))
+    if strength > 0:
+        with run.stage('vignette'):
+            vignette(run, strength)
+
+    # --- GRAIN ---
+    amount = float(filter_data.get('grain', 0))
+    if amount > 0:
+        with run.stage('grain'):
+            grain(run, amount, seed, stream=1)
+
+
+def run_filter_pipeline(
+    img: Image.Image,
+    filter_data: dict,
+    custom_lut: Optional[ImageFilter.Color3DLUT] = None
+) -> Image.Image:
+    """
+    Apply AI enhance, preset, .cube LUT and manual adjustments on one working buffer
+
+    Args:
+        img: Source image (converted to RGB)
+        filter_data: Filter settings from the request
+        custom_lut: Optional Color3DLUT from an uploaded .cube file
+
+    Returns:
+        RGB PIL image
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    seed = grain_seed(filter_data)
+    run = FilterRun(img, buffer_pool)
+    try:
+        if filter_data.get('aiAutoEnhance', False):
+            pixel_count = img.width * img.height
+            tier = enhance_tier(filter_data, pixel_count)
+            with run.stage(f'ai_enhance_{tier}'):
+                started = time.perf_counter()
+                try:
+                    ai_auto_enhance(run, tier)
+                    enhance_tiers.record(tier, pixel_count, time.perf_counter() - started)
+                except Exception as e:
+                    logger.warning(f"AI Auto Enhance failed: {e}, returning original")
+
+        preset_name = filter_data.get('preset', None)
+        if preset_name and preset_name != 'none':
+            with run.stage('preset'):
+                spatial_steps = apply_preset(run, preset_name)
+            for step, amount in spatial_steps:
+                with run.stage(f'preset_{step}'):
+                    if step == 'vignette':
+                        vignette(run, amount)
+                    elif step == 'grain':
+                        grain(run, amount, seed)
+                    elif step == 'sharpness':
+                        sharpen(run, amount)
+
+        if custom_lut is not None:
+            with run.stage('cube'):
+                apply_cube(run, custom_lut)
+
+        apply_manual(run, filter_data, seed)
+        return run.to_image()
+    finally:
+        run.release()
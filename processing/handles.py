@@ -0,0 +1,316 @@
+"""
+Server-side image handles
+
+An uploaded image is stored once and referred to by an opaque handle, so a
+multi-step workflow (crop, then filter, then compress) does not upload and
+decode the same file for every step. The encoded bytes are kept on disk for
+the handle's lifetime; decoded pixels are kept in a size-bounded in-memory
+LRU and re-decoded from disk after eviction.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Optional
+
+from PIL import Image
+
+from config import config
+from image_utils import ImageTooLarge, load_image_safe, open_image_checked
+
+logger = logging.getLogger('imgcraft')
+
+
+class ImageHandle:
+    """Metadata of a stored image"""
+
+    def __init__(self, owner: Optional[str], filename: str, digest: str, nbytes: int, ttl: int):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.filename = filename
+        self.digest = digest
+        self.bytes = nbytes
+        self.created_at = time.time()
+        self.expires_at = self.created_at + ttl
+        self.width = None
+        self.height = None
+        self.mode = None
+        self.format = None
+
+    def to_dict(self) -> dict:
+        return {
+            'handle': self.id,
+            'filename': self.filename,
+            'width': self.width,
+            'height': self.height,
+            'mode': self.mode,
+            'format': self.format,
+            'bytes': self.bytes,
+            'expires_at': self.expires_at
+        }
+
+
+class ImageHandleStore:
+    """TTL-bounded store of uploaded images, with decoded pixels cached in memory"""
+
+    def __init__(
+        self,
+        store_dir: str,
+        ttl: int = 1800,
+        memory_bytes: int = 16 * 1024 * 1024,
+        disk_bytes: int = 512 * 1024 * 1024
+    ):
+        self.store_dir = store_dir
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._handles: 'OrderedDict[str, ImageHandle]' = OrderedDict()
+        self._by_digest: Dict[str, str] = {}
+        self._decoded: 'OrderedDict[str, Image.Image]' = OrderedDict()
+        self._decoded_bytes = 0
+        self._disk_used = 0
+        self._stats = {'created': 0, 'decode_hits': 0, 'decode_misses': 0, 'expired': 0}
+
+    def _path(self, handle_id: str) -> str:
+        return os.path.join(self.store_dir, handle_id)
+
+    @staticmethod
+    def _image_bytes(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    # ------------------------------------------------------------------
+    # Eviction (callers hold self._lock)
+    # ------------------------------------------------------------------
+
+    def _drop_decoded(self, handle_id: str) -> None:
+        img = self._decoded.pop(handle_id, None)
+        if img is not None:
+            self._decoded_bytes -= self._image_bytes(img)
+
+    def _remove(self, handle_id: str) -> None:
+        handle = self._handles.pop(handle_id, None)
+        if handle is None:
+            return
+        self._drop_decoded(handle_id)
+        if self._by_digest.get(handle.digest) == handle_id:
+            del self._by_digest[handle.digest]
+        self._disk_used -= handle.bytes
+        try:
+            os.remove(self._path(handle_id))
+        except OSError:
+            pass
+
+    def _prune(self) -> None:
+        now = time.time()
+        for handle_id in [h.id for h in self._handles.values() if h.expires_at <= now]:
+            self._remove(handle_id)
+            self._stats['expired'] += 1
+        # Oldest handles go first when the disk budget is exceeded
+        while self._disk_used > self.disk_bytes and self._handles:
+            self._remove(next(iter(self._handles)))
+
+    def _remember_decoded(self, handle_id: str, img: Image.Image) -> None:
+        size = self._image_bytes(img)
+        if size > self.memory_bytes:
+            return
+        self._drop_decoded(handle_id)
+        self._decoded[handle_id] = img
+        self._decoded_bytes += size
+        while self._decoded_bytes > self.memory_bytes and self._decoded:
+            _, evicted = self._decoded.popitem(last=False)
+            self._decoded_bytes -= self._image_bytes(evicted)
+
+    def _register(self, handle: ImageHandle, decoded: Optional[Image.Image] = None) -> None:
+        # Takes self._lock itself, unlike the eviction helpers above
+        with self._lock:
+            self._handles[handle.id] = handle
+            self._by_digest[handle.digest] = handle.id
+            self._disk_used += handle.bytes
+            if decoded is not None:
+                self._remember_decoded(handle.id, decoded)
+            self._stats['created'] += 1
+            self._prune()
+
+        logger.info(f"[HANDLES] Stored {handle.id} ({handle.width}x{handle.height}, {handle.bytes} bytes)")
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def put(self, owner: str, data: bytes, filename: str = 'image') -> ImageHandle:
+        """
+        Store an encoded image and return its handle
+
+        Args:
+            owner: User id allowed to use the handle
+            data: Encoded image bytes
+            filename: Original file name
+
+        Returns:
+            ImageHandle
+
+        Raises:
+            ValueError if data is not a readable image
+        """
+        try:
+            decoded, _ = load_image_safe(data)
+        except ImageTooLarge:
+            raise
+        except Exception as e:
+            raise ValueError(f'Not a readable image: {str(e)}')
+        fmt = decoded.format
+
+        handle = ImageHandle(owner, filename, hashlib.sha256(data).hexdigest(), len(data), self.ttl)
+        handle.width, handle.height = decoded.size
+        handle.mode = decoded.mode
+        handle.format = fmt
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self._path(handle.id), 'wb') as handle_file:
+            handle_file.write(data)
+
+        self._register(handle, decoded)
+        return handle
+
+    def put_file(self, owner: str, source: BinaryIO, filename: str = 'image',
+                 chunk_size: int = 1024 * 1024) -> ImageHandle:
+        """
+        Store an encoded image from a file object, copying it in chunks
+
+        Only the header is read (no pixels are decoded and the bytes are
+        never held in memory at once); the pixels are decoded on first use.
+
+        Args:
+            owner: User id allowed to use the handle
+            source: Readable file object positioned at the start of the image
+            filename: Original file name
+            chunk_size: Bytes copied at a time
+
+        Returns:
+            ImageHandle
+
+        Raises:
+            ValueError if the stored file is not a readable image
+        """
+        handle = ImageHandle(owner, filename, '', 0, self.ttl)
+        path = self._path(handle.id)
+        digest = hashlib.sha256()
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(path, 'wb') as handle_file:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                handle_file.write(chunk)
+                handle.bytes += len(chunk)
+        handle.digest = digest.hexdigest()
+
+        try:
+            with open(path, 'rb') as handle_file:
+                header = open_image_checked(handle_file)
+                handle.width, handle.height = header.size
+                handle.mode = header.mode
+                handle.format = header.format
+        except Exception as e:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            if isinstance(e, ImageTooLarge):
+                raise
+            raise ValueError(f'Not a readable image: {str(e)}')
+
+        self._register(handle)
+        return handle
+
+    def get(self, handle_id: str, owner: Optional[str]) -> Optional[ImageHandle]:
+        """
+        Look up a handle usable by owner
+
+        Returns:
+            ImageHandle, or None if it does not exist, expired or belongs to
+            someone else (a handle without an owner is never returned)
+        """
+        with self._lock:
+            self._prune()
+            handle = self._handles.get(handle_id)
+        if handle is None or owner is None or handle.owner != owner:
+            return None
+        return handle
+
+    def read_bytes(self, handle: ImageHandle) -> Optional[bytes]:
+        """Encoded bytes of a handle, or None if they are gone"""
+        try:
+            with open(self._path(handle.id), 'rb') as handle_file:
+                return handle_file.read()
+        except OSError:
+            return None
+
+    def delete(self, handle_id: str, owner: Optional[str]) -> bool:
+        with self._lock:
+            handle = self._handles.get(handle_id)
+            if handle is None or owner is None or handle.owner != owner:
+                return False
+            self._remove(handle_id)
+            return True
+
+    def decoded(self, data: bytes) -> Optional[Image.Image]:
+        """
+        Decoded pixels for bytes that belong to a stored handle
+
+        Lets code that works on uploaded bytes skip the decode when the bytes
+        came from a handle. The returned image is a private copy.
+
+        Returns:
+            PIL image (with .format set), or None if data is not a stored handle
+        """
+        with self._lock:
+            if not self._handles:
+                return None
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            handle_id = self._by_digest.get(digest)
+            if handle_id is None:
+                return None
+            img = self._decoded.get(handle_id)
+            if img is not None:
+                self._decoded.move_to_end(handle_id)
+                self._stats['decode_hits'] += 1
+                copy = img.copy()
+                copy.format = img.format
+                return copy
+            self._stats['decode_misses'] += 1
+
+        # Evicted from memory: decode again and keep it for the next step
+        img, _ = load_image_safe(data)
+        with self._lock:
+            if handle_id in self._handles:
+                self._remember_decoded(handle_id, img)
+        copy = img.copy()
+        copy.format = img.format
+        return copy
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'handles': len(self._handles),
+                'decoded_entries': len(self._decoded),
+                'decoded_bytes': self._decoded_bytes,
+                'disk_bytes': self._disk_used
+            })
+            return data
+
+
+# Create singleton instance
+image_handles = ImageHandleStore(
+    config.HANDLE_DIR,
+    ttl=config.HANDLE_TTL_SECONDS,
+    memory_bytes=config.HANDLE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=config.HANDLE_DISK_MB * 1024 * 1024
+)
@@ -0,0 +1,232 @@
+"""
+Background job queue for long-running image tools
+
+Heavy tools (8x upscale, background removal, AI enhance) can take longer than
+a request thread should be held. A job is accepted by reserving a slot in a
+bounded queue, runs on a small local worker pool, and writes its encoded
+result to disk, where it is kept for a limited time and total size.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be accepted right now"""
+
+
+class Job:
+    """State of a single submitted job"""
+
+    def __init__(self, user_id: str, tool: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.tool = tool
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result_path = None
+        self.result_bytes = 0
+        self.mimetype = None
+        self.headers: Dict[str, str] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'tool': self.tool,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result_bytes': self.result_bytes if self.status == 'done' else None
+        }
+
+
+class JobManager:
+    """Accepts, runs and retains results for background jobs"""
+
+    def __init__(
+        self,
+        result_dir: str,
+        workers: int = 1,
+        max_pending: int = 8,
+        result_ttl: int = 1800,
+        max_result_bytes: int = 256 * 1024 * 1024,
+        max_jobs: int = 256
+    ):
+        self.result_dir = result_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_result_bytes = max_result_bytes
+        self.max_jobs = max_jobs
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._reserved = 0
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created lazily so importing the module does not start threads
+        with self._lock:
+            if self._executor is None:
+                os.makedirs(self.result_dir, exist_ok=True)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='imgcraft-job'
+                )
+            return self._executor
+
+    # ------------------------------------------------------------------
+    # Acceptance
+    # ------------------------------------------------------------------
+
+    def reserve(self) -> None:
+        """
+        Reserve a queue slot before charging for a job
+
+        Raises:
+            JobQueueFull if max_pending jobs are already queued or running
+        """
+        with self._lock:
+            if self._reserved >= self.max_pending:
+                raise JobQueueFull(f'Job queue is full ({self.max_pending} jobs pending)')
+            self._reserved += 1
+
+    def release(self) -> None:
+        """Give back a reserved slot (e.g. when credit deduction failed)"""
+        with self._lock:
+            self._reserved = max(0, self._reserved - 1)
+
+    def submit(self, user_id: str, tool: str, fn: Callable) -> Job:
+        """
+        Start a job in a slot previously obtained with reserve()
+
+        Args:
+            user_id: Owner of the job
+            tool: Tool name
+            fn: Callable returning (BytesIO, mimetype, headers dict)
+
+        Returns:
+            The queued Job
+        """
+        job = Job(user_id, tool)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._get_executor().submit(self._run, job, fn)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self.release()
+            raise
+        logger.info(f"[JOBS] Accepted {tool} job {job.id} for user {user_id}")
+        return job
+
+    # ------------------------------------------------------------------
+    # Execution
+    # ------------------------------------------------------------------
+
+    def _run(self, job: Job, fn: Callable) -> None:
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            output, mimetype, headers = fn()
+            path = os.path.join(self.result_dir, job.id)
+            with open(path, 'wb') as result_file:
+                output.copy_to(result_file)
+            job.result_path = path
+            job.result_bytes = os.path.getsize(path)
+            job.mimetype = mimetype
+            job.headers = dict(headers or {})
+            job.status = 'done'
+            logger.info(
+                f"[JOBS] {job.tool} job {job.id} finished in "
+                f"{time.time() - job.started_at:.2f}s ({job.result_bytes} bytes)"
+            )
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"[JOBS] {job.tool} job {job.id} failed: {str(e)}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            self.release()
+            self.prune()
+
+    # ------------------------------------------------------------------
+    # Lookup and retention
+    # ------------------------------------------------------------------
+
+    def get(self, job_id: str, user_id: str) -> Optional[Job]:
+        """
+        Get a job owned by user_id
+
+        Returns:
+            Job, or None if it does not exist, has expired or belongs to someone else
+        """
+        self.prune()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _discard(self, job: Job) -> None:
+        self._jobs.pop(job.id, None)
+        if job.result_path:
+            try:
+                os.remove(job.result_path)
+            except OSError:
+                pass
+
+    def prune(self) -> None:
+        """Drop expired results, then the oldest ones while over the size or count limit"""
+        now = time.time()
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished_at is not None]
+
+            for job in finished:
+                if now - job.finished_at > self.result_ttl:
+                    self._discard(job)
+
+            finished = [job for job in finished if job.id in self._jobs]
+            finished.sort(key=lambda job: job.finished_at)
+            total = sum(job.result_bytes for job in finished)
+            while finished and (total > self.max_result_bytes or len(self._jobs) > self.max_jobs):
+                oldest = finished.pop(0)
+                total -= oldest.result_bytes
+                self._discard(oldest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._reserved,
+                'jobs': counts,
+                'result_bytes': sum(job.result_bytes for job in self._jobs.values())
+            }
+
+
+# Create singleton instance
+job_manager = JobManager(
+    config.JOB_RESULT_DIR,
+    workers=config.JOB_WORKERS,
+    max_pending=config.JOB_MAX_PENDING,
+    result_ttl=config.JOB_RESULT_TTL_SECONDS,
+    max_result_bytes=config.JOB_MAX_RESULT_MB * 1024 * 1024
+)
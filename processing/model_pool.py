@@ -0,0 +1,195 @@
+"""
+Process-wide registry of warm rembg model sessions
+
+Loading an ONNX model and initializing its graph is the most expensive part of
+a background removal, so each model is loaded once per worker process and then
+shared by every request thread. onnxruntime sessions are safe to run from
+several threads at once, so only the load itself is serialized.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger('imgcraft')
+
+
+def _current_rss_bytes() -> Optional[int]:
+    """
+    Get the resident set size of this process
+
+    Returns:
+        RSS in bytes, or None if it cannot be determined on this platform
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class _ModelEntry:
+    """A loaded session plus its load and inference statistics"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.session = None
+        self.load_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.load_seconds = None
+        self.load_rss_bytes = None
+        self.loaded_at = None
+        self.calls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+        self.last_seconds = None
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, failed: bool) -> None:
+        with self.stats_lock:
+            self.in_flight -= 1
+            self.calls += 1
+            if failed:
+                self.failures += 1
+            self.total_seconds += seconds
+            self.last_seconds = seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self) -> dict:
+        with self.stats_lock:
+            avg = self.total_seconds / self.calls if self.calls else None
+            return {
+                'loaded': self.session is not None,
+                'loaded_at': self.loaded_at,
+                'load_seconds': self.load_seconds,
+                'load_rss_bytes': self.load_rss_bytes,
+                'calls': self.calls,
+                'failures': self.failures,
+                'in_flight': self.in_flight,
+                'avg_seconds': avg,
+                'last_seconds': self.last_seconds,
+                'max_seconds': self.max_seconds if self.calls else None,
+            }
+
+
+class ModelRegistry:
+    """Loads each rembg model once and shares it across request threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _ModelEntry] = {}
+
+    def _entry(self, model_name: str) -> _ModelEntry:
+        with self._lock:
+            entry = self._entries.get(model_name)
+            if entry is None:
+                entry = _ModelEntry(model_name)
+                self._entries[model_name] = entry
+            return entry
+
+    def get_session(self, model_name: str = 'u2netp'):
+        """
+        Get the shared session for a model, loading it on first use
+
+        Args:
+            model_name: rembg model name (e.g. 'u2netp')
+
+        Returns:
+            rembg session instance
+        """
+        entry = self._entry(model_name)
+        if entry.session is not None:
+            return entry.session
+
+        with entry.load_lock:
+            # Another thread may have finished loading while we waited
+            if entry.session is not None:
+                return entry.session
+
+            from rembg import new_session
+
+            rss_before = _current_rss_bytes()
+            start = time.perf_counter()
+            session = new_session(model_name)
+            entry.load_seconds = time.perf_counter() - start
+            rss_after = _current_rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                entry.load_rss_bytes = max(0, rss_after - rss_before)
+            entry.loaded_at = time.time()
+            entry.session = session
+
+            logger.info(
+                f"[MODELS] Loaded rembg model '{model_name}' in {entry.load_seconds:.2f}s "
+                f"(rss +{entry.load_rss_bytes or 0} bytes)"
+            )
+            return session
+
+    def remove_background(self, image, model_name: str = 'u2netp', **kwargs):
+        """
+        Run rembg.remove with the shared session for a model
+
+        Args:
+            image: PIL image to process
+            model_name: rembg model name
+            **kwargs: Extra arguments passed through to rembg.remove
+
+        Returns:
+            Output of rembg.remove (RGBA PIL image for PIL input)
+        """
+        from rembg import remove
+
+        session = self.get_session(model_name)
+        entry = self._entry(model_name)
+        with entry.stats_lock:
+            entry.in_flight += 1
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = remove(image, session=session, **kwargs)
+            failed = False
+            return result
+        finally:
+            entry.record(time.perf_counter() - start, failed)
+
+    def warm(self, model_names: Iterable[str], background: bool = True) -> None:
+        """
+        Load models ahead of the first request
+
+        Args:
+            model_names: Models to load
+            background: Load in a daemon thread so startup is not blocked
+        """
+        names = [name for name in model_names if name]
+        if not names:
+            return
+
+        def _load_all():
+            for name in names:
+                try:
+                    self.get_session(name)
+                except Exception as e:
+                    logger.error(f"[MODELS] Failed to warm model '{name}': {str(e)}")
+
+        if background:
+            threading.Thread(target=_load_all, name='rembg-warmup', daemon=True).start()
+        else:
+            _load_all()
+
+    def stats(self) -> dict:
+        """
+        Get load and latency statistics for every known model
+
+        Returns:
+            Dictionary keyed by model name
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        return {entry.name: entry.snapshot() for entry in entries}
+
+
+# Create singleton instance
+model_registry = ModelRegistry()
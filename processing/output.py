@@ -0,0 +1,171 @@
+"""
+Output sinks for encoded results
+
+Encoders write into an OutputBuffer instead of a plain BytesIO. Small results
+stay in memory; once a result grows past the spill threshold its bytes move
+to an anonymous temporary file, so a large PNG does not sit in the worker's
+heap while it is being sent. The body is served from whichever holds it:
+the temporary file goes out through wsgi.file_wrapper (sendfile under
+gunicorn) and the size is always known, so responses carry an exact
+Content-Length.
+
+OutputBuffer deliberately has no usable fileno(): Pillow would use one to write
+straight to the descriptor, which for SpooledTemporaryFile forces every
+result to disk. Without it Pillow falls back to write(), and the buffer
+decides where the bytes go.
+"""
+import io
+import logging
+import shutil
+import tempfile
+from typing import BinaryIO, List, Optional
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+# Bytes copied at a time out of a spilled buffer
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class OutputBuffer(io.RawIOBase):
+    """Seekable in-memory buffer that moves to a temporary file when it grows"""
+
+    def __init__(self, spill_bytes: int = 8 * 1024 * 1024, spool_dir: Optional[str] = None):
+        super().__init__()
+        self.spill_bytes = spill_bytes
+        self.spool_dir = spool_dir
+        self._body: BinaryIO = io.BytesIO()
+        self._spilled = False
+
+    @property
+    def spilled(self) -> bool:
+        """True once the content lives in a temporary file"""
+        return self._spilled
+
+    @property
+    def size(self) -> int:
+        """Total bytes written (independent of the current position)"""
+        position = self._body.tell()
+        size = self._body.seek(0, io.SEEK_END)
+        self._body.seek(position)
+        return size
+
+    def _spill(self) -> None:
+        position = self._body.tell()
+        spool = tempfile.TemporaryFile(dir=self.spool_dir)
+        spool.write(self._body.getbuffer())
+        spool.seek(position)
+        self._body.close()
+        self._body = spool
+        self._spilled = True
+        logger.debug(f"[OUTPUT] Spilled result to disk after {self.size} bytes")
+
+    # ------------------------------------------------------------------
+    # File protocol
+    # ------------------------------------------------------------------
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if not self._spilled and self._body.tell() + len(data) > self.spill_bytes:
+            self._spill()
+        return self._body.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._body.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self._body.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._body.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._body.tell()
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self._body.truncate(size)
+
+    def flush(self) -> None:
+        if not self._body.closed:
+            self._body.flush()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._body.close()
+        super().close()
+
+    # ------------------------------------------------------------------
+    # Consumers
+    # ------------------------------------------------------------------
+
+    def getvalue(self) -> bytes:
+        """Whole content as bytes (reads the temporary file back if spilled)"""
+        if not self._spilled:
+            return self._body.getvalue()
+        position = self._body.tell()
+        self._body.seek(0)
+        data = self._body.read()
+        self._body.seek(position)
+        return data
+
+    def copy_to(self, fileobj: BinaryIO) -> int:
+        """
+        Copy the whole content to fileobj without building one bytes object
+
+        Returns:
+            Bytes copied
+        """
+        if not self._spilled:
+            return fileobj.write(self._body.getbuffer())
+        position = self._body.tell()
+        self._body.seek(0)
+        shutil.copyfileobj(self._body, fileobj, COPY_CHUNK_BYTES)
+        self._body.seek(position)
+        return self.size
+
+    def body(self) -> BinaryIO:
+        """
+        Detach the underlying BytesIO or temporary file, rewound, for sending
+
+        The caller owns the returned object from then on (the WSGI server
+        closes it after the response, which deletes the temporary file) and
+        this buffer is left empty.
+        """
+        body = self._body
+        body.seek(0)
+        self._body = io.BytesIO()
+        self._spilled = False
+        return body
+
+
+class ChunkSink:
+    """Write-only file object that hands written bytes to a generator"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def output_buffer() -> OutputBuffer:
+    """New OutputBuffer with the configured spill threshold"""
+    return OutputBuffer(config.OUTPUT_SPILL_MB * 1024 * 1024, config.OUTPUT_SPOOL_DIR or None)
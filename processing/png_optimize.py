@@ -0,0 +1,298 @@
+"""
+Lossless PNG optimizer
+
+Pillow's optimize=True is one deflate pass with one strategy. No single
+setting wins everywhere: flat graphics and screenshots compress best with no
+row filter at all, while photos and cutouts do best with adaptive filtering
+and a run-length or filtered deflate strategy, which is also several times
+faster than the default level 9 pass. The optimizer encodes the image with
+a few such candidates on a shared thread pool (zlib releases the GIL, so
+they overlap on multi-core hosts and run in priority order on one core),
+stops waiting once the per-request time budget is spent, and keeps the
+smallest complete stream. Candidates still running at that
+point notice a cancel flag between blocks and give up.
+
+'fast' mode encodes once, inline, with the cheap candidate that suits the
+image (no filter for flat graphics, judged by the distinct colors in a
+sample; run-length otherwise). On typical outputs that is still smaller
+than Pillow's optimize pass, at a fraction of its latency.
+Very large images go through the run-length candidate alone, strip by
+strip, and modes the PNG writer does not handle (palette, 16-bit) through
+Pillow. The ICC profile (or sRGB and gamma) and DPI in img.info are written
+as iCCP / sRGB / gAMA / pHYs chunks.
+"""
+import logging
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import BinaryIO, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import config
+from processing.tiles import _PNG_COLOR_TYPES, PNGStripWriter, _filter_rows, _metadata_chunks, _png_chunk
+
+logger = logging.getLogger('imgcraft')
+
+# Encoding modes accepted by save_png
+PNG_MODES = ('optimize', 'fast')
+
+# (row filter, deflate level, deflate strategy) per mode, in priority order:
+# the run-length pass is the cheapest and usually wins on photos, no filter
+# wins on flat graphics, and the slow level 9 passes come last
+PNG_CANDIDATES = {
+    'optimize': (
+        ('adaptive', 9, zlib.Z_RLE),
+        ('none', 9, zlib.Z_DEFAULT_STRATEGY),
+        ('adaptive', 9, zlib.Z_FILTERED),
+        ('adaptive', 9, zlib.Z_DEFAULT_STRATEGY)
+    ),
+    'fast': (
+        ('adaptive', 9, zlib.Z_RLE),
+        ('none', 6, zlib.Z_DEFAULT_STRATEGY)
+    )
+}
+
+# Flat graphics (few distinct colors in a sample) take the unfiltered fast
+# candidate, everything else the run-length one
+_FLAT_COLOR_RATIO = 0.1
+_SAMPLE_PIXELS = 65_536
+
+# Rows filtered and compressed per step (cancellation is checked between steps)
+_BLOCK_ROWS = 64
+
+
+_STRATEGY_NAMES = {zlib.Z_DEFAULT_STRATEGY: 'default', zlib.Z_FILTERED: 'filtered', zlib.Z_RLE: 'rle'}
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _distinct_ratio(rows: np.ndarray, bpp: int) -> float:
+    """Distinct colors per pixel in a strided sample of the image"""
+    pixels = rows.reshape(len(rows), -1, bpp)
+    step = max(1, int((pixels.shape[0] * pixels.shape[1] / _SAMPLE_PIXELS) ** 0.5))
+    sample = pixels[::step, ::step].reshape(-1, bpp)
+    packed = np.zeros(len(sample), dtype=np.uint32)
+    for band in range(bpp):
+        packed = (packed << 8) | sample[:, band]
+    # Grayscale has at most 256 values per band, so compare against what is possible
+    return len(np.unique(packed)) / max(1, min(len(packed), 256 ** bpp))
+
+
+def _label(candidate) -> str:
+    row_filter, level, strategy = candidate
+    return f'{row_filter}/{level}/{_STRATEGY_NAMES.get(strategy, strategy)}'
+
+
+def _filter_image(rows: np.ndarray, bpp: int, cancel: threading.Event) -> bytes:
+    """Adaptively filtered scanlines of the whole image, block by block"""
+    out = bytearray()
+    prev = np.zeros(rows.shape[1], dtype=np.uint8)
+    for top in range(0, len(rows), _BLOCK_ROWS):
+        if cancel.is_set():
+            raise _Cancelled()
+        block = rows[top:top + _BLOCK_ROWS]
+        out += _filter_rows(block, prev, bpp).tobytes()
+        prev = block[-1]
+    return bytes(out)
+
+
+def _unfiltered_blocks(rows: np.ndarray):
+    """Scanlines with filter type 0 (None), block by block"""
+    for top in range(0, len(rows), _BLOCK_ROWS):
+        block = rows[top:top + _BLOCK_ROWS]
+        out = np.zeros((len(block), rows.shape[1] + 1), dtype=np.uint8)
+        out[:, 1:] = block
+        yield out.tobytes()
+
+
+def _deflate(blocks, level: int, strategy: int, cancel: threading.Event) -> List[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+    chunks = []
+    for block in blocks:
+        if cancel.is_set():
+            raise _Cancelled()
+        data = compressor.compress(block)
+        if data:
+            chunks.append(data)
+    chunks.append(compressor.flush())
+    return chunks
+
+
+def _slices(data: bytes, size: int):
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+
+def _write_png(fileobj: BinaryIO, img: Image.Image, idat: List[bytes]) -> None:
+    width, height = img.size
+    fileobj.write(b'\x89PNG\r\n\x1a\n')
+    fileobj.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, _PNG_COLOR_TYPES[img.mode], 0, 0, 0)))
+    for chunk in _metadata_chunks(img.info):
+        fileobj.write(chunk)
+    for chunk in idat:
+        if chunk:
+            fileobj.write(_png_chunk(b'IDAT', chunk))
+    fileobj.write(_png_chunk(b'IEND', b''))
+
+
+class PNGOptimizer:
+    """Encodes PNGs with several deflate candidates in parallel under a time budget"""
+
+    def __init__(self, workers: int = 3, budget_seconds: float = 2.0, max_pixels: int = 8_000_000):
+        self.workers = workers
+        self.budget_seconds = budget_seconds
+        self.max_pixels = max_pixels
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {'encoded': 0, 'single_pass': 0, 'budget_hits': 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='imgcraft-png')
+            return self._executor
+
+    def save(self, img: Image.Image, fileobj: BinaryIO, mode: str = 'optimize',
+             budget_seconds: Optional[float] = None) -> dict:
+        """
+        Write img to fileobj as the smallest PNG found within the time budget
+
+        Args:
+            img: Image to encode
+            fileobj: Destination
+            mode: 'optimize' (all candidates) or 'fast' (one cheap candidate)
+            budget_seconds: Time to wait for candidates (defaults to the optimizer's)
+
+        Returns:
+            Dict with the winning 'candidate', 'bytes' and 'candidates' finished
+
+        Raises:
+            ValueError for an unknown mode
+        """
+        if mode not in PNG_MODES:
+            raise ValueError(f'Unknown PNG mode: {mode}')
+        budget = self.budget_seconds if budget_seconds is None else budget_seconds
+
+        if img.mode not in _PNG_COLOR_TYPES or img.width * img.height > self.max_pixels:
+            return self._save_single(img, fileobj, mode)
+
+        started = time.monotonic()
+        rows = np.asarray(img, dtype=np.uint8).reshape(img.height, -1)
+        bpp = len(img.mode)
+        cancel = threading.Event()
+
+        if mode == 'fast':
+            return self._save_fast(img, rows, bpp, fileobj, started)
+        executor = self._get_executor()
+        futures = {}
+
+        def run(candidate, filtered_future):
+            row_filter, level, strategy = candidate
+            if row_filter == 'none':
+                return _deflate(_unfiltered_blocks(rows), level, strategy, cancel)
+            filtered = filtered_future.result()
+            return _deflate(_slices(filtered, _BLOCK_ROWS * (rows.shape[1] + 1)), level, strategy, cancel)
+
+        # Tasks run in submission order when workers are scarce, so the shared
+        # adaptive filter goes first and the candidates follow by priority
+        filtered_future = executor.submit(_filter_image, rows, bpp, cancel)
+        for candidate in PNG_CANDIDATES[mode]:
+            futures[executor.submit(run, candidate, filtered_future)] = candidate
+
+        remaining = budget - (time.monotonic() - started)
+        done, pending = wait(futures, timeout=max(0.0, remaining))
+        results = [(f.result(), futures[f]) for f in done if f.exception() is None]
+        if not results:
+            # Nothing finished in time: take whichever finishes first
+            while not results and pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results = [(f.result(), futures[f]) for f in done if f.exception() is None]
+        cancel.set()
+        for future in pending:
+            future.cancel()
+        if not results:
+            return self._save_single(img, fileobj, mode)
+
+        sizes = [(sum(len(chunk) for chunk in idat), idat, candidate) for idat, candidate in results]
+        sizes.sort(key=lambda item: item[0])
+        best_size, best_idat, best_candidate = sizes[0]
+        _write_png(fileobj, img, best_idat)
+
+        label = _label(best_candidate)
+        with self._lock:
+            self._stats['encoded'] += 1
+            if pending:
+                self._stats['budget_hits'] += 1
+        logger.debug(
+            f"[PNG] {img.width}x{img.height} {mode}: {label} won with {best_size} bytes "
+            f"({len(results)}/{len(futures)} candidates in {time.monotonic() - started:.2f}s)"
+        )
+        return {'candidate': label, 'bytes': best_size, 'candidates': len(results)}
+
+    def _save_fast(self, img: Image.Image, rows: np.ndarray, bpp: int, fileobj: BinaryIO, started: float) -> dict:
+        """One fast candidate, picked from the color count of a sample, encoded inline"""
+        flat = _distinct_ratio(rows, bpp) < _FLAT_COLOR_RATIO
+        candidate = PNG_CANDIDATES['fast'][1 if flat else 0]
+        cancel = threading.Event()
+        if flat:
+            idat = _deflate(_unfiltered_blocks(rows), candidate[1], candidate[2], cancel)
+        else:
+            filtered = _filter_image(rows, bpp, cancel)
+            idat = _deflate(_slices(filtered, _BLOCK_ROWS * (rows.shape[1] + 1)), candidate[1], candidate[2], cancel)
+        _write_png(fileobj, img, idat)
+        size = sum(len(chunk) for chunk in idat)
+        with self._lock:
+            self._stats['encoded'] += 1
+        logger.debug(
+            f"[PNG] {img.width}x{img.height} fast: {_label(candidate)} with {size} bytes "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        return {'candidate': _label(candidate), 'bytes': size, 'candidates': 1}
+
+    def _save_single(self, img: Image.Image, fileobj: BinaryIO, mode: str) -> dict:
+        """
+        One pass, for modes or sizes the parallel path does not take
+
+        Large images are written strip by strip with adaptive filtering and
+        run-length deflate (the candidate that wins on photos, at a bounded
+        memory cost); other modes go through Pillow.
+        """
+        with self._lock:
+            self._stats['single_pass'] += 1
+        if img.mode in _PNG_COLOR_TYPES:
+            writer = PNGStripWriter(fileobj, img.size, img.mode, strategy=zlib.Z_RLE, chunks=_metadata_chunks(img.info))
+            for top in range(0, img.height, _BLOCK_ROWS * 16):
+                writer.write(img.crop((0, top, img.width, min(img.height, top + _BLOCK_ROWS * 16))))
+            writer.close()
+            return {'candidate': _label(('adaptive', 9, zlib.Z_RLE)), 'bytes': None, 'candidates': 1}
+        # Pillow keeps the ICC profile itself but only writes pHYs when asked
+        dpi = img.info.get('dpi')
+        if mode == 'fast':
+            img.save(fileobj, 'PNG', compress_level=6, dpi=dpi)
+        else:
+            img.save(fileobj, 'PNG', optimize=True, dpi=dpi)
+        return {'candidate': 'pillow', 'bytes': None, 'candidates': 1}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+# Create singleton instance
+png_optimizer = PNGOptimizer(
+    workers=config.PNG_OPTIMIZE_WORKERS,
+    budget_seconds=config.PNG_OPTIMIZE_BUDGET_MS / 1000,
+    max_pixels=config.PNG_OPTIMIZE_MAX_PIXELS
+)
+
+
+def save_png(img: Image.Image, fileobj: BinaryIO, mode: str = 'optimize') -> dict:
+    """Encode img as PNG with the shared optimizer (see PNGOptimizer.save)"""
+    return png_optimizer.save(img, fileobj, mode)
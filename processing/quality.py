@@ -0,0 +1,120 @@
+"""
+Perceptual similarity for choosing encoder quality
+
+Structural similarity (SSIM) is computed on the luminance of the image at
+full resolution. Images up to PROXY_SIDE on the longer side are compared
+whole; larger ones on a TILE_GRID x TILE_GRID grid of TILE_SIDE tiles spread
+evenly over the image, about a megapixel in all. Reducing the image instead
+would average away the block and ringing artifacts of an 8x8 codec and make
+the score depend on the image size; tiles keep them at their true scale
+while a comparison still costs a few milliseconds, so a quality search can
+afford one per trial. The local statistics use Gaussian windows through
+OpenCV, with no Python loops over pixels.
+"""
+import io
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Images with a longer side up to this are compared whole
+PROXY_SIDE = 1024
+
+# Side of the full-resolution tiles compared for larger images
+TILE_SIDE = 256
+
+# Tiles per row and column (TILE_GRID ** 2 tiles in all)
+TILE_GRID = 4
+
+# Tile corners are aligned to this (the largest JPEG MCU)
+_TILE_ALIGN = 16
+
+# SSIM constants for 8-bit data (K1 = 0.01, K2 = 0.03)
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+
+Box = Tuple[int, int, int, int]
+
+
+def _tile_starts(length: int) -> List[int]:
+    if length <= TILE_SIDE * TILE_GRID:
+        # Too short for separate tiles: cover it with adjoining ones
+        return list(range(0, max(1, length - TILE_SIDE + 1), TILE_SIDE))[:TILE_GRID] or [0]
+    span = length - TILE_SIDE
+    return [(span * index // (TILE_GRID - 1)) // _TILE_ALIGN * _TILE_ALIGN for index in range(TILE_GRID)]
+
+
+def proxy_boxes(size) -> List[Box]:
+    """
+    Regions of an image of this size that SSIM is computed on
+
+    Returns:
+        (left, top, right, bottom) boxes: the whole image up to PROXY_SIDE,
+        otherwise full-resolution tiles spread over the image
+    """
+    width, height = size
+    if max(width, height) <= PROXY_SIDE:
+        return [(0, 0, width, height)]
+    return [
+        (left, top, min(width, left + TILE_SIDE), min(height, top + TILE_SIDE))
+        for top in _tile_starts(height)
+        for left in _tile_starts(width)
+    ]
+
+
+def luma_proxy(img: Image.Image, boxes: Sequence[Box]) -> List[np.ndarray]:
+    """
+    Luminance of img inside each box, as float32
+
+    Args:
+        img: PIL image (any mode; alpha is ignored)
+        boxes: Regions from proxy_boxes
+
+    Returns:
+        One 2-D float32 array per box
+    """
+    return [np.asarray(img.crop(box).convert('L'), dtype=np.float32) for box in boxes]
+
+
+def ssim(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """
+    Mean structural similarity of two luminance arrays
+
+    Uses the usual 11x11 Gaussian window (sigma 1.5).
+
+    Returns:
+        SSIM in [-1, 1] (1 means identical)
+    """
+    def blur(values):
+        return cv2.GaussianBlur(values, (11, 11), 1.5)
+
+    mu_x = blur(reference)
+    mu_y = blur(candidate)
+    mu_xx = mu_x * mu_x
+    mu_yy = mu_y * mu_y
+    mu_xy = mu_x * mu_y
+    sigma_xx = blur(reference * reference) - mu_xx
+    sigma_yy = blur(candidate * candidate) - mu_yy
+    sigma_xy = blur(reference * candidate) - mu_xy
+
+    numerator = (2 * mu_xy + _C1) * (2 * sigma_xy + _C2)
+    denominator = (mu_xx + mu_yy + _C1) * (sigma_xx + sigma_yy + _C2)
+    return float(np.mean(numerator / denominator))
+
+
+def encoded_ssim(reference: List[np.ndarray], encoded: bytes, boxes: Sequence[Box]) -> float:
+    """
+    SSIM of an encoded image against a reference proxy
+
+    Args:
+        reference: luma_proxy of the source for the same boxes
+        encoded: Encoded image bytes
+        boxes: Regions from proxy_boxes
+
+    Returns:
+        SSIM of the decoded candidate, averaged over the boxes by area
+    """
+    candidate = luma_proxy(Image.open(io.BytesIO(encoded)), boxes)
+    scores = [ssim(ref, cand) for ref, cand in zip(reference, candidate)]
+    return float(np.average(scores, weights=[ref.size for ref in reference]))
@@ -0,0 +1,260 @@
+"""
+Palette quantization for PNG compression
+
+The palette is built from a sample of the image instead of every pixel,
+so its cost no longer grows with the image size. Images with few distinct
+colors are sampled from their color histogram, others by position. Mapping the full
+image onto the palette is vectorized: pixels are grouped into color cells
+(5 bits per color channel, 4 for alpha), the nearest palette entry is found
+once per occupied cell, and the result is gathered back with one table
+lookup. Screenshots, which repeat a small set
+of colors over many pixels, occupy few cells and map almost for free.
+
+RGB images without ordered dithering are mapped by Pillow's C palette
+mapper instead, which is faster still; Floyd-Steinberg error diffusion is
+sequential and only available there. RGBA images keep their alpha channel
+in the palette (written as a PNG tRNS chunk) and colors are compared
+premultiplied, so fully transparent pixels match any transparent entry.
+Ordered (Bayer) dithering is vectorized and works for both.
+"""
+import logging
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('imgcraft')
+
+# Pixels the palette is built from (median cut slows down sharply past
+# a few tens of thousands of distinct colors)
+SAMPLE_PIXELS = 16_384
+
+# Images with at most this many distinct colors are sampled by color
+# histogram instead of by position (getcolors gives up early on photos)
+HISTOGRAM_COLORS = 65_536
+
+# Dithering modes accepted by quantize_image
+DITHER_MODES = ('none', 'ordered', 'floyd')
+
+# Cell resolution of the palette lookup (2^19 cells for RGBA)
+_COLOR_BITS = 5
+_ALPHA_BITS = 4
+
+# Cells compared against the palette at once (bounds the distance matrix)
+_CELL_CHUNK = 16_384
+
+# 8x8 Bayer matrix, normalized to [-0.5, 0.5)
+_BAYER_8 = (np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21]
+], dtype=np.float32) + 0.5) / 64 - 0.5
+
+
+def _working_mode(img: Image.Image) -> str:
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return 'RGBA'
+    return 'RGB'
+
+
+def _histogram(img: Image.Image):
+    """(colors, counts) of an image with at most HISTOGRAM_COLORS distinct colors, else None"""
+    histogram = img.getcolors(HISTOGRAM_COLORS)
+    if histogram is None:
+        return None
+    counts = np.array([count for count, _ in histogram], dtype=np.int64)
+    colors = np.array([color for _, color in histogram], dtype=np.uint8).reshape(len(histogram), -1)
+    return colors, counts
+
+
+def _sample(img: Image.Image, sample_pixels: int) -> Image.Image:
+    """Every n-th pixel along both axes, about sample_pixels in total"""
+    step = max(1, int((img.width * img.height / sample_pixels) ** 0.5))
+    if step == 1:
+        return img
+    pixels = np.asarray(img)[::step, ::step]
+    return Image.fromarray(np.ascontiguousarray(pixels))
+
+
+def _histogram_sample(img: Image.Image, colors: np.ndarray, counts: np.ndarray, sample_pixels: int) -> Image.Image:
+    """About sample_pixels pixels with each color repeated in proportion to its count"""
+    repeats = np.rint(counts * (sample_pixels / counts.sum())).astype(np.int64)
+    return Image.fromarray(np.repeat(colors, repeats, axis=0)[None], img.mode)
+
+
+def build_palette(img: Image.Image, colors: int, sample_pixels: int = SAMPLE_PIXELS) -> np.ndarray:
+    """
+    Build a palette for img from a sample of its pixels
+
+    Images with at most `colors` distinct colors get exactly those colors.
+    Other images with at most HISTOGRAM_COLORS (screenshots, UI, diagrams)
+    are sampled from their color histogram, so thin detail such as a 1 px
+    line counts with its true pixel share instead of being skipped by the
+    stride, and are quantized by fast octree, which keeps their flat
+    colors better than median cut. Everything else (photos) is sampled
+    every n-th pixel and quantized by median cut (RGB) or fast octree (RGBA,
+    the Pillow quantizer that keeps alpha).
+
+    Args:
+        img: RGB or RGBA image
+        colors: Maximum palette entries (2-256)
+        sample_pixels: Pixels the palette is built from
+
+    Returns:
+        uint8 array of shape (entries, bands)
+    """
+    bands = 4 if img.mode == 'RGBA' else 3
+    histogram = _histogram(img)
+    if histogram is not None and len(histogram[0]) <= colors:
+        return histogram[0]
+
+    if histogram is not None:
+        sample = _histogram_sample(img, *histogram, sample_pixels)
+        method = Image.Quantize.FASTOCTREE
+    else:
+        sample = _sample(img, sample_pixels)
+        method = Image.Quantize.FASTOCTREE if bands == 4 else Image.Quantize.MEDIANCUT
+    paletted = sample.quantize(colors=colors, method=method)
+    raw = paletted.getpalette(img.mode)
+    used = sorted(index for _, index in paletted.getcolors(256))
+    palette = np.array(raw, dtype=np.uint8).reshape(-1, bands)[used]
+    if bands == 4 and np.asarray(sample)[..., 3].min() == 0 and palette[:, 3].min() > 0:
+        # Octree averages alpha within a bucket; keep fully transparent pixels exact
+        transparent = np.zeros((1, 4), dtype=np.uint8)
+        if len(palette) < colors:
+            palette = np.concatenate([palette, transparent])
+        else:
+            palette[palette[:, 3].argmin()] = transparent
+    return palette
+
+
+def _premultiplied(values: np.ndarray) -> np.ndarray:
+    """float32 copy with color scaled by alpha (RGBA) or unchanged (RGB)"""
+    values = values.astype(np.float32)
+    if values.shape[-1] == 4:
+        values[..., :3] *= values[..., 3:] / 255
+    return values
+
+
+def _nearest(colors: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Index of the nearest palette entry for each color, in chunks"""
+    targets = _premultiplied(palette)
+    target_norms = (targets * targets).sum(axis=1)
+    result = np.empty(len(colors), dtype=np.uint8)
+    for start in range(0, len(colors), _CELL_CHUNK):
+        chunk = _premultiplied(colors[start:start + _CELL_CHUNK])
+        # |a - b|^2 without the |a|^2 term, which does not change the argmin
+        distances = target_norms[None, :] - 2 * chunk @ targets.T
+        result[start:start + _CELL_CHUNK] = distances.argmin(axis=1)
+    return result
+
+
+def _cell_ids(pixels: np.ndarray) -> np.ndarray:
+    shift = 8 - _COLOR_BITS
+    ids = np.right_shift(pixels[..., 0], shift, dtype=np.uint32)
+    for band in (1, 2):
+        ids <<= _COLOR_BITS
+        ids |= pixels[..., band] >> shift
+    if pixels.shape[-1] == 4:
+        ids <<= _ALPHA_BITS
+        ids |= pixels[..., 3] >> (8 - _ALPHA_BITS)
+    return ids
+
+
+def _cell_colors(cells: np.ndarray, bands: int) -> np.ndarray:
+    """Representative color of each cell id (its center; alpha cells span 0-255 exactly)"""
+    colors = np.empty((len(cells), bands), dtype=np.float32)
+    if bands == 4:
+        colors[:, 3] = (cells & ((1 << _ALPHA_BITS) - 1)) * (255 / ((1 << _ALPHA_BITS) - 1))
+        cells = cells >> _ALPHA_BITS
+    step = 1 << (8 - _COLOR_BITS)
+    mask = (1 << _COLOR_BITS) - 1
+    for band in range(3):
+        shift = _COLOR_BITS * (2 - band)
+        colors[:, band] = ((cells >> shift) & mask) * step + (step - 1) / 2
+    return colors
+
+
+def map_to_palette(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """
+    Map an (h, w, bands) uint8 array to palette indices
+
+    Returns:
+        uint8 array of shape (h, w)
+    """
+    bands = pixels.shape[-1]
+    ids = _cell_ids(pixels).ravel()
+    cells = 1 << (3 * _COLOR_BITS + (_ALPHA_BITS if bands == 4 else 0))
+
+    occupied = np.flatnonzero(np.bincount(ids, minlength=cells))
+    lookup = np.zeros(cells, dtype=np.uint8)
+    lookup[occupied] = _nearest(_cell_colors(occupied, bands), palette)
+    return lookup[ids].reshape(pixels.shape[:2])
+
+
+def _ordered_dither(pixels: np.ndarray, entries: int) -> np.ndarray:
+    """Add a tiled Bayer pattern scaled to half the palette's average color spacing"""
+    height, width = pixels.shape[:2]
+    spread = 0.5 * 255 / max(1.0, entries ** (1 / 3))
+    offsets = np.round(_BAYER_8 * spread).astype(np.int16)
+    pattern = np.tile(offsets, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    dithered = pixels.astype(np.int16)
+    dithered[..., :3] += pattern[..., None]
+    np.clip(dithered, 0, 255, out=dithered)
+    return dithered.astype(np.uint8)
+
+
+def quantize_image(
+    img: Image.Image,
+    colors: int = 256,
+    dither: str = 'none',
+    sample_pixels: int = SAMPLE_PIXELS
+) -> Image.Image:
+    """
+    Reduce an image to a palette of at most `colors` entries
+
+    Args:
+        img: Source image (any mode; alpha is kept)
+        colors: Maximum palette entries (2-256)
+        dither: 'none', 'ordered' (Bayer) or 'floyd' (error diffusion, RGB only;
+            RGBA images fall back to ordered)
+        sample_pixels: Pixels the palette is built from
+
+    Returns:
+        P mode image (palette with alpha for RGBA sources)
+
+    Raises:
+        ValueError for an unknown dither mode
+    """
+    if dither not in DITHER_MODES:
+        raise ValueError(f'Unknown dither mode: {dither}')
+    colors = max(2, min(256, int(colors)))
+    mode = _working_mode(img)
+    if img.mode != mode:
+        img = img.convert(mode)
+
+    palette = build_palette(img, colors, sample_pixels)
+
+    if mode == 'RGB' and dither != 'ordered':
+        # Pillow maps RGB onto a fixed palette in C (with its own color cache)
+        palette_img = Image.new('P', (1, 1))
+        palette_img.putpalette(palette.ravel().tolist(), 'RGB')
+        method = Image.Dither.FLOYDSTEINBERG if dither == 'floyd' else Image.Dither.NONE
+        return img.quantize(palette=palette_img, dither=method)
+    if dither == 'floyd':
+        logger.debug("[QUANTIZE] Error diffusion is RGB only, using ordered dithering for RGBA")
+        dither = 'ordered'
+
+    pixels = np.asarray(img)
+    if dither == 'ordered':
+        pixels = _ordered_dither(pixels, len(palette))
+    indices = map_to_palette(pixels, palette)
+
+    # putpalette turns the L image of indices into P mode
+    result = Image.fromarray(indices)
+    result.putpalette(palette.ravel().tolist(), mode)
+    return result
@@ -0,0 +1,269 @@
+"""
+Content-addressed cache for deterministic tool results
+
+Tools such as resize, convert, compress, crop and palette are pure functions
+of the uploaded bytes and the request parameters, so their encoded output can
+be reused when the same upload is processed again with the same settings
+(repeat downloads, retries after a dropped connection). Results live in a
+small in-memory LRU and a larger size-bounded LRU on disk.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+
+class CachedResult(NamedTuple):
+    """An encoded tool result plus what is needed to send it again"""
+    data: bytes
+    mimetype: str
+    headers: Dict[str, str]
+
+
+class ResultCache:
+    """Two-tier (memory + disk) LRU of encoded results keyed by content hash"""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        memory_bytes: int = 32 * 1024 * 1024,
+        disk_bytes: int = 512 * 1024 * 1024,
+        max_entry_bytes: int = 16 * 1024 * 1024,
+        enabled: bool = True
+    ):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._memory: 'OrderedDict[str, CachedResult]' = OrderedDict()
+        self._memory_used = 0
+        self._disk: 'OrderedDict[str, int]' = OrderedDict()
+        self._disk_used = 0
+        self._disk_loaded = False
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+    @staticmethod
+    def make_key(tool: str, data: bytes, params: dict) -> str:
+        """
+        Build the cache key for a tool run
+
+        Args:
+            tool: Tool name
+            data: Raw uploaded bytes
+            params: Parameters that affect the output (JSON serializable)
+
+        Returns:
+            Hex digest identifying the result
+        """
+        digest = hashlib.sha256()
+        digest.update(tool.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(json.dumps(params, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+
+    def _paths(self, key: str):
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + '.bin', base + '.json'
+
+    def _load_disk_index(self) -> None:
+        # Rebuild the LRU order from modification times (touched on every hit).
+        # The scan runs once, outside self._lock, so memory hits never wait on it
+        if self._disk_loaded:
+            return
+        with self._index_lock:
+            if self._disk_loaded:
+                return
+            entries = []
+            try:
+                for root, _, files in os.walk(self.cache_dir):
+                    for name in files:
+                        if name.endswith('.bin'):
+                            path = os.path.join(root, name)
+                            stat = os.stat(path)
+                            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+            except OSError as e:
+                logger.warning(f"[CACHE] Could not scan result cache directory: {str(e)}")
+            with self._lock:
+                # Entries stored while scanning are newer than anything found
+                stored = list(self._disk.items())
+                self._disk.clear()
+                for _, key, size in sorted(entries):
+                    self._disk[key] = size
+                for key, size in stored:
+                    self._disk.pop(key, None)
+                    self._disk[key] = size
+                self._disk_used = sum(self._disk.values())
+                self._disk_loaded = True
+
+    def _disk_forget(self, key: str) -> None:
+        # Caller holds self._lock; the files are removed by _remove_files
+        self._disk_used -= self._disk.pop(key, 0)
+
+    def _remove_files(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _disk_read(self, key: str) -> Optional[CachedResult]:
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            with open(data_path, 'rb') as data_file:
+                data = data_file.read()
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        return CachedResult(data, meta['mimetype'], meta.get('headers', {}))
+
+    def _disk_write(self, key: str, result: CachedResult) -> bool:
+        # Temporary names are per thread, so concurrent stores of one key do not collide
+        data_path, meta_path = self._paths(key)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            with open(data_path + suffix, 'wb') as data_file:
+                data_file.write(result.data)
+            with open(meta_path + suffix, 'w') as meta_file:
+                json.dump({'mimetype': result.mimetype, 'headers': result.headers}, meta_file)
+            os.replace(meta_path + suffix, meta_path)
+            os.replace(data_path + suffix, data_path)
+        except OSError as e:
+            logger.warning(f"[CACHE] Could not write result to disk: {str(e)}")
+            return False
+        return True
+
+    # ------------------------------------------------------------------
+    # Memory tier
+    # ------------------------------------------------------------------
+
+    def _memory_put(self, key: str, result: CachedResult) -> None:
+        if len(result.data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old.data)
+        self._memory[key] = result
+        self._memory_used += len(result.data)
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted.data)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """
+        Look up a result, promoting disk hits into memory
+
+        Only the index and LRU order are updated under the lock; disk reads
+        happen outside it.
+
+        Returns:
+            CachedResult, or None on a miss (or when the cache is disabled)
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return result
+
+        self._load_disk_index()
+        with self._lock:
+            on_disk = key in self._disk
+        result = self._disk_read(key) if on_disk else None
+
+        with self._lock:
+            if result is None:
+                if on_disk:
+                    self._disk_forget(key)
+                self._stats['misses'] += 1
+            else:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._memory_put(key, result)
+                self._stats['disk_hits'] += 1
+        if result is None and on_disk:
+            self._remove_files(key)
+        return result
+
+    def put(self, key: str, data: bytes, mimetype: str, headers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Store an encoded result
+
+        The files are written outside the lock, which only covers the
+        index update and the choice of entries to evict.
+
+        Args:
+            key: Key from make_key
+            data: Encoded output
+            mimetype: Response mimetype
+            headers: Extra response headers to replay on a hit
+        """
+        if not self.enabled or len(data) > self.max_entry_bytes:
+            return
+        result = CachedResult(bytes(data), mimetype, dict(headers or {}))
+        with self._lock:
+            self._memory_put(key, result)
+            self._stats['stores'] += 1
+        if len(result.data) > self.disk_bytes:
+            return
+
+        self._load_disk_index()
+        if not self._disk_write(key, result):
+            return
+        evicted = []
+        with self._lock:
+            self._disk_forget(key)
+            self._disk[key] = len(result.data)
+            self._disk_used += len(result.data)
+            while self._disk_used > self.disk_bytes and self._disk:
+                oldest = next(iter(self._disk))
+                self._disk_forget(oldest)
+                evicted.append(oldest)
+        for oldest in evicted:
+            self._remove_files(oldest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'enabled': self.enabled,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_used
+            })
+            return data
+
+
+# Create singleton instance
+result_cache = ResultCache(
+    config.RESULT_CACHE_DIR,
+    memory_bytes=config.RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_bytes=config.RESULT_CACHE_DISK_MB * 1024 * 1024,
+    max_entry_bytes=config.RESULT_CACHE_MAX_ENTRY_MB * 1024 * 1024,
+    enabled=config.RESULT_CACHE_ENABLED
+)
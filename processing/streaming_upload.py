@@ -0,0 +1,143 @@
+"""
+Streaming multipart parsing with incremental image decoding
+
+Werkzeug normally buffers the whole multipart body before the endpoint runs,
+and decoding only starts after that. This parser reads the request stream in
+chunks and feeds the main image part into an IncrementalDecoder as it
+arrives, so the header is validated after the first few KB and decoding
+overlaps the time spent receiving the rest of the upload. An on_header
+callback sees the header before any pixels are decoded, so the caller can
+reserve memory for the decode (or refuse it) first. The other fields
+and files are collected as Werkzeug would, so endpoints see the usual
+request.form and request.files.
+"""
+import io
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage, Headers, MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from image_utils import IncrementalDecoder
+
+
+class StreamedUpload:
+    """Form fields and files of a multipart body, plus the pre-decoded main image"""
+
+    def __init__(self):
+        self.form = MultiDict()
+        self.files = MultiDict()
+        self.image: Optional[Image.Image] = None
+        self.image_bytes: Optional[bytes] = None
+
+
+class _Part:
+    """Part currently being received"""
+
+    def __init__(self, name: str, filename: Optional[str], headers: Headers, decoder: Optional[IncrementalDecoder]):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+        self.decoder = decoder
+        self.chunks: List[bytes] = []
+
+    def feed(self, data: bytes) -> None:
+        if self.decoder is not None:
+            self.decoder.feed(data)
+        else:
+            self.chunks.append(data)
+
+
+def read_streaming_upload(
+    stream: BinaryIO,
+    content_type: str,
+    image_field: str = 'image',
+    chunk_size: int = 64 * 1024,
+    max_parts: int = 64,
+    on_header: Optional[Callable[[Tuple[int, int], str, MultiDict], None]] = None
+) -> StreamedUpload:
+    """
+    Parse a multipart/form-data body while decoding its main image
+
+    Args:
+        stream: Request body stream (already limited to the content length)
+        content_type: Request Content-Type header, including the boundary
+        image_field: File field decoded incrementally
+        chunk_size: Bytes read from the stream at a time
+        max_parts: Maximum number of fields and files
+        on_header: Called with (size, mode, form fields received so far) once
+            the image header is parsed, before its pixels are decoded
+
+    Returns:
+        StreamedUpload
+
+    Raises:
+        ImageTooLarge if the image header is over the pixel budget
+        ValueError if the body is malformed or the image header is not readable
+        RequestEntityTooLarge if the body has more than max_parts parts
+        Whatever on_header raises
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise ValueError('Expected a multipart/form-data upload')
+
+    parser = MultipartDecoder(boundary.encode('latin-1'), max_parts=max_parts)
+    upload = StreamedUpload()
+    part: Optional[_Part] = None
+    finished = False
+
+    while not finished:
+        chunk = stream.read(chunk_size)
+        parser.receive_data(chunk or None)
+        event = parser.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, Field):
+                part = _Part(event.name, None, event.headers, None)
+            elif isinstance(event, File):
+                decoder = None
+                if event.name == image_field and upload.image_bytes is None and event.filename:
+                    decoder = IncrementalDecoder(on_header=_header_callback(on_header, upload))
+                part = _Part(event.name, event.filename, event.headers, decoder)
+            elif isinstance(event, Data):
+                part.feed(event.data)
+                if not event.more_data:
+                    _finish_part(upload, part)
+                    part = None
+            elif isinstance(event, Epilogue):
+                finished = True
+                break
+            event = parser.next_event()
+        if not chunk:
+            break
+
+    if not finished:
+        raise ValueError('Malformed upload: the body ended early')
+    return upload
+
+
+def _header_callback(on_header, upload: StreamedUpload):
+    if on_header is None:
+        return None
+    return lambda header: on_header(header.size, header.mode, upload.form)
+
+
+def _finish_part(upload: StreamedUpload, part: _Part) -> None:
+    if part.decoder is not None:
+        upload.image, upload.image_bytes = part.decoder.close()
+        data = upload.image_bytes
+    else:
+        data = b''.join(part.chunks)
+
+    if part.filename is None:
+        upload.form.add(part.name, data.decode('utf-8', 'replace'))
+        return
+
+    upload.files.add(part.name, FileStorage(
+        stream=io.BytesIO(data),
+        filename=part.filename,
+        name=part.name,
+        content_type=part.headers.get('Content-Type'),
+        headers=part.headers
+    ))
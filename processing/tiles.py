@@ -0,0 +1,301 @@
+"""
+Strip-based execution engine for large images
+
+Instead of materializing full-resolution intermediates for every step of a
+chain, the output is produced in horizontal strips. Each strip is rendered
+from the source with a configurable overlap (so neighborhood operations such
+as sharpening see the same pixels they would in a full-image pass), trimmed
+back to its own rows, and handed to an encoder. The PNG encoder writes strips
+as they arrive, so peak memory stays proportional to the strip size rather
+than the image size.
+"""
+import struct
+import zlib
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from processing.output import ChunkSink
+
+# Modes the strip engine and the streaming PNG writer handle
+STRIP_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# PNG color type for each supported mode
+_PNG_COLOR_TYPES = {'L': 0, 'LA': 4, 'RGB': 2, 'RGBA': 6}
+
+# Render callback: (top, bottom) output rows -> image covering exactly those rows
+StripRenderer = Callable[[int, int], Image.Image]
+
+
+def strip_height_for(width: int, tile_pixels: int, minimum: int = 16) -> int:
+    """
+    Pick a strip height so one strip holds about tile_pixels pixels
+
+    Args:
+        width: Output width
+        tile_pixels: Target pixels per strip
+        minimum: Lower bound on the strip height
+
+    Returns:
+        Strip height in rows
+    """
+    return max(minimum, tile_pixels // max(1, width))
+
+
+def render_strips(
+    size: Tuple[int, int],
+    render: StripRenderer,
+    strip_height: int,
+    overlap: int = 0
+) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Render an output image strip by strip
+
+    Each strip is rendered with up to `overlap` extra rows above and below
+    (clamped to the image), then cropped back to its own rows, so operations
+    whose footprint is smaller than the overlap give the same pixels as a
+    full-image pass.
+
+    Args:
+        size: Output (width, height)
+        render: Callback returning the output rows [top, bottom) as an image
+        strip_height: Rows per strip
+        overlap: Extra rows rendered on each side of a strip
+
+    Yields:
+        Tuples of (y offset, strip image)
+    """
+    width, height = size
+    for y0 in range(0, height, strip_height):
+        y1 = min(height, y0 + strip_height)
+        top = max(0, y0 - overlap)
+        bottom = min(height, y1 + overlap)
+        rendered = render(top, bottom)
+        if top == y0 and bottom == y1:
+            yield y0, rendered
+        else:
+            yield y0, rendered.crop((0, y0 - top, width, y1 - top))
+        del rendered
+
+
+def assemble_strips(mode: str, size: Tuple[int, int], strips: Iterator[Tuple[int, Image.Image]]) -> Image.Image:
+    """
+    Paste rendered strips into a single image
+
+    Used for encoders that need the whole image; the output canvas is the only
+    full-size buffer held.
+    """
+    canvas = Image.new(mode, size)
+    for y0, strip in strips:
+        canvas.paste(strip, (0, y0))
+    return canvas
+
+
+# ============================================================================
+# STREAMING PNG ENCODER
+# ============================================================================
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack('>I', len(data)) + chunk_type + data +
+        struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+    )
+
+
+def _metadata_chunks(info: dict) -> List[bytes]:
+    """
+    Ancillary chunks for the metadata Pillow keeps in Image.info
+
+    Color information (iCCP, or sRGB and gAMA) and the pixel density (pHYs)
+    are kept, as Pillow's own PNG writer keeps the ICC profile. Text and EXIF
+    chunks are not written, as with Pillow's default save.
+    """
+    chunks = []
+    icc_profile = info.get('icc_profile')
+    if icc_profile:
+        chunks.append(_png_chunk(b'iCCP', b'ICC Profile\0\0' + zlib.compress(icc_profile)))
+    else:
+        if info.get('srgb') is not None:
+            chunks.append(_png_chunk(b'sRGB', struct.pack('>B', int(info['srgb']))))
+        if info.get('gamma'):
+            chunks.append(_png_chunk(b'gAMA', struct.pack('>I', int(info['gamma'] * 100000 + 0.5))))
+    dpi = info.get('dpi')
+    if dpi:
+        try:
+            ppm = [int(float(value) / 0.0254 + 0.5) for value in dpi[:2]]
+        except (TypeError, ValueError):
+            ppm = None
+        if ppm and min(ppm) > 0:
+            chunks.append(_png_chunk(b'pHYs', struct.pack('>IIB', ppm[0], ppm[1], 1)))
+    return chunks
+
+
+def _filter_rows(rows: np.ndarray, prev: np.ndarray, bpp: int) -> np.ndarray:
+    """
+    Apply adaptive PNG filtering to a block of scanlines
+
+    For each row the filter (None, Sub, Up, Average, Paeth) with the smallest
+    sum of absolute signed residuals is chosen, the usual heuristic that
+    libpng and Pillow use.
+
+    Args:
+        rows: uint8 array of shape (rows, stride)
+        prev: uint8 array of the scanline before the block (zeros for the first)
+        bpp: Bytes per pixel
+
+    Returns:
+        uint8 array of shape (rows, stride + 1) with the filter type byte first
+    """
+    x = rows.astype(np.int16)
+    up = np.empty_like(x)
+    up[0] = prev
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up_left = np.zeros_like(x)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    best = x.astype(np.uint8)
+    best_type = np.zeros(len(x), dtype=np.uint8)
+    best_score = np.abs(best.view(np.int8).astype(np.int32)).sum(axis=1)
+
+    def consider(filter_type: int, predictor: np.ndarray) -> None:
+        nonlocal best
+        residual = (x - predictor).astype(np.uint8)
+        score = np.abs(residual.view(np.int8).astype(np.int32)).sum(axis=1)
+        better = score < best_score
+        if better.any():
+            best[better] = residual[better]
+            best_type[better] = filter_type
+            best_score[better] = score[better]
+
+    consider(1, left)
+    consider(2, up)
+    consider(3, (left + up) >> 1)
+
+    # Paeth predictor
+    pa = np.abs(up - up_left)
+    pb = np.abs(left - up_left)
+    pc = np.abs(left + up - 2 * up_left)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+    consider(4, paeth)
+
+    out = np.empty((len(x), x.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = best_type
+    out[:, 1:] = best
+    return out
+
+
+class PNGStripWriter:
+    """Writes an 8-bit PNG one strip at a time"""
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        size: Tuple[int, int],
+        mode: str,
+        compress_level: int = 9,
+        strategy: int = zlib.Z_DEFAULT_STRATEGY,
+        chunks: Iterable[bytes] = ()
+    ):
+        if mode not in _PNG_COLOR_TYPES:
+            raise ValueError(f'Unsupported mode for streaming PNG: {mode}')
+        self.fileobj = fileobj
+        self.width, self.height = size
+        self.mode = mode
+        self.bpp = len(mode)
+        self.rows_written = 0
+        self._prev = np.zeros(self.width * self.bpp, dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level, strategy=strategy)
+
+        self.fileobj.write(b'\x89PNG\r\n\x1a\n')
+        ihdr = struct.pack('>IIBBBBB', self.width, self.height, 8, _PNG_COLOR_TYPES[mode], 0, 0, 0)
+        self.fileobj.write(_png_chunk(b'IHDR', ihdr))
+        # Ancillary chunks (e.g. from _metadata_chunks) go before the first IDAT
+        for chunk in chunks:
+            self.fileobj.write(chunk)
+
+    def write(self, strip: Image.Image) -> None:
+        """Append the next strip (same width and mode as the image)"""
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        rows = np.asarray(strip, dtype=np.uint8).reshape(strip.height, self.width * self.bpp)
+        filtered = _filter_rows(rows, self._prev, self.bpp)
+        self._prev = rows[-1].copy()
+        self.rows_written += strip.height
+        compressed = self._compressor.compress(filtered.tobytes())
+        if compressed:
+            self.fileobj.write(_png_chunk(b'IDAT', compressed))
+
+    def close(self) -> None:
+        """Flush the compressor and write the end of the file"""
+        if self.rows_written != self.height:
+            raise ValueError(f'Expected {self.height} rows, got {self.rows_written}')
+        self.fileobj.write(_png_chunk(b'IDAT', self._compressor.flush()))
+        self.fileobj.write(_png_chunk(b'IEND', b''))
+
+
+def encode_strips(
+    strips: Iterator[Tuple[int, Image.Image]],
+    size: Tuple[int, int],
+    mode: str,
+    fmt: str,
+    fileobj: BinaryIO,
+    **save_kwargs
+) -> None:
+    """
+    Encode rendered strips to fileobj
+
+    PNG is written incrementally. Other formats are assembled into one output
+    image first, since their Pillow encoders need the whole image.
+
+    Args:
+        strips: Iterator from render_strips
+        size: Output (width, height)
+        mode: Output mode
+        fmt: Pillow format name (e.g. 'PNG', 'JPEG')
+        fileobj: Destination
+        **save_kwargs: Passed to Image.save for non-PNG formats
+    """
+    if fmt.upper() == 'PNG' and mode in _PNG_COLOR_TYPES:
+        writer = PNGStripWriter(fileobj, size, mode)
+        for _, strip in strips:
+            writer.write(strip)
+        writer.close()
+        return
+
+    image = assemble_strips(mode, size, strips)
+    image.save(fileobj, fmt, **save_kwargs)
+
+
+def stream_png_strips(
+    strips: Iterator[Tuple[int, Image.Image]],
+    size: Tuple[int, int],
+    mode: str
+) -> Iterator[bytes]:
+    """
+    Encode rendered strips to PNG, yielding the file as it is produced
+
+    Rendering and compression happen as the consumer pulls chunks, so a
+    response can start sending before the last strip exists and the
+    encoded file is never held whole.
+
+    Args:
+        strips: Iterator from render_strips
+        size: Output (width, height)
+        mode: Output mode (one of STRIP_MODES)
+
+    Yields:
+        Chunks of the PNG file
+    """
+    sink = ChunkSink()
+    writer = PNGStripWriter(sink, size, mode)
+    yield sink.drain()
+    for _, strip in strips:
+        writer.write(strip)
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,68 @@
+"""
+Tone curve compiler for the filter tool
+
+Exposure, brightness, contrast, highlights, shadows, whites and blacks are all
+pointwise functions of a channel value, so the whole chain is evaluated once
+over the 256 possible input values and applied to the image as a single
+lookup table instead of one full-image float pass per slider.
+"""
+from typing import Optional
+
+import numpy as np
+
+# Slider keys that feed the tone curve, in the order they are applied
+TONE_KEYS = ('exposure', 'brightness', 'contrast', 'highlights', 'shadows', 'whites', 'blacks')
+
+
+def _tone_values(filter_data: dict) -> dict:
+    return {key: float(filter_data.get(key, 0)) for key in TONE_KEYS}
+
+
+def build_tone_lut(filter_data: dict) -> Optional[np.ndarray]:
+    """
+    Compile the tone sliders into a 256-entry lookup table
+
+    The arithmetic mirrors the original per-pixel float32 chain step by step
+    (including the clip after every slider and the truncating uint8 cast), so
+    applying the table is equivalent to running the chain on every pixel.
+
+    Args:
+        filter_data: Filter settings from the request
+
+    Returns:
+        uint8 array of 256 output values, or None if every tone slider is 0
+    """
+    values = _tone_values(filter_data)
+    if not any(values.values()):
+        return None
+
+    curve = np.arange(256, dtype=np.float32)
+
+    # --- EXPOSURE ---
+    if values['exposure'] != 0:
+        factor = 2.0 ** (values['exposure'] / 50.0)
+        curve = np.clip(curve * factor, 0, 255)
+
+    # --- BRIGHTNESS ---
+    if values['brightness'] != 0:
+        curve = np.clip(curve + (values['brightness'] * 2.55), 0, 255)
+
+    # --- CONTRAST ---
+    if values['contrast'] != 0:
+        factor = (values['contrast'] + 100.0) / 100.0
+        curve = np.clip(((curve - 127.5) * factor) + 127.5, 0, 255)
+
+    # --- HIGHLIGHTS / SHADOWS / WHITES / BLACKS ---
+    # Each one shifts the values on one side of a threshold
+    for key, above, threshold, weight in (
+        ('highlights', True, 180, 0.5),
+        ('shadows', False, 75, 0.5),
+        ('whites', True, 200, 0.3),
+        ('blacks', False, 50, 0.3),
+    ):
+        amount = values[key]
+        if amount != 0:
+            mask = (curve > threshold) if above else (curve < threshold)
+            curve = np.clip(curve + (mask.astype(float) * (amount * weight)), 0, 255)
+
+    return curve.astype(np.uint8)
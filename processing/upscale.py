@@ -0,0 +1,102 @@
+"""
+Upscale enhancement chain
+
+The resize and factor-based enhancements of the upscale tool. They live
+outside app.py so that image executor workers can import them without
+importing the web app.
+"""
+import logging
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+logger = logging.getLogger('imgcraft')
+
+# Factor-based quality enhancements, applied in order after the LANCZOS resize
+UPSCALE_ENHANCEMENTS = {
+    # 8x: Maximum quality - most beautiful
+    8: [
+        ('unsharp', (3, 200, 2)),   # High sharpness with UnsharpMask
+        ('contrast', 1.15),         # 15% contrast boost (detail enhancement)
+        ('brightness', 1.05),       # 5% brightness boost
+        ('sharpness', 1.3),         # 30% sharpness boost
+        ('color', 1.1)              # 10% saturation boost for vibrant colors
+    ],
+    # 4x: Medium quality
+    4: [
+        ('unsharp', (2, 150, 3)),   # Moderate sharpness
+        ('contrast', 1.1),          # 10% contrast boost
+        ('sharpness', 1.2),         # 20% sharpness boost
+        ('color', 1.05)             # 5% saturation boost
+    ],
+    # 2x: Standard quality
+    2: [
+        ('unsharp', (1.5, 120, 3)), # Light sharpness
+        ('contrast', 1.05),         # 5% contrast boost
+        ('sharpness', 1.1)          # 10% sharpness boost
+    ]
+}
+
+def enhance_contrast(img, factor, mean):
+    """
+    ImageEnhance.Contrast with the gray level given instead of measured
+    
+    Lets separate strips of one image share the mean of the whole image.
+    """
+    degenerate = Image.new('L', img.size, mean)
+    if img.mode != 'L':
+        degenerate = degenerate.convert(img.mode)
+    if 'A' in img.getbands():
+        degenerate.putalpha(img.getchannel('A'))
+    return Image.blend(degenerate, img, factor)
+
+
+def apply_upscale_enhancements(img, factor, contrast_mean=None):
+    """
+    Apply the enhancement chain for an upscale factor
+    
+    Args:
+        img: Resized PIL image (or a strip of it)
+        factor: Upscale factor (2, 4 or 8)
+        contrast_mean: Gray level for the contrast step; measured from img if None
+    
+    Returns:
+        Enhanced PIL image
+    """
+    for step, value in UPSCALE_ENHANCEMENTS.get(factor, UPSCALE_ENHANCEMENTS[2]):
+        if step == 'unsharp':
+            radius, percent, threshold = value
+            img = img.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold))
+        elif step == 'contrast':
+            if contrast_mean is None:
+                img = ImageEnhance.Contrast(img).enhance(value)
+            else:
+                img = enhance_contrast(img, value, contrast_mean)
+        elif step == 'brightness':
+            img = ImageEnhance.Brightness(img).enhance(value)
+        elif step == 'sharpness':
+            img = ImageEnhance.Sharpness(img).enhance(value)
+        elif step == 'color':
+            img = ImageEnhance.Color(img).enhance(value)
+    return img
+
+
+def enhance_upscaled(img, factor):
+    """
+    Resize an image by factor and apply the factor-based quality enhancements
+    
+    Args:
+        img: PIL image
+        factor: Upscale factor (2, 4 or 8)
+    
+    Returns:
+        Upscaled PIL image
+    """
+    new_width = img.width * factor
+    new_height = img.height * factor
+    
+    # Step 1: High-quality resize using LANCZOS
+    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    
+    # Step 2: Apply factor-based quality enhancements
+    logger.info(f"Applying {factor}x quality enhancements")
+    return apply_upscale_enhancements(upscaled, factor)
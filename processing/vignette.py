@@ -0,0 +1,169 @@
+"""
+Cached vignette masks
+
+A vignette darkens each pixel by a factor that falls off linearly with its
+distance from the center. Building that factor field used to take a
+float64 distance computation for every pixel on every call. The field is
+smooth, so it is built at a small base resolution (BASE_SIDE on the longer
+side) in float32 and resized bilinearly to the image size. This takes a
+few milliseconds, and the error stays well below one 8-bit level.
+
+Only the base masks are cached, keyed by strength and aspect ratio (rounded
+to ASPECT_STEP) and bounded by VIGNETTE_CACHE_MB, so sizes that differ only
+slightly, such as phone photos cropped a few pixels differently, share one
+base. A full-size mask is never held: bilinear resizing is separable, so
+the base is resized across the width once (at most BASE_SIDE rows) and
+each block of output rows is interpolated from that band when the filter
+needs it. This gives the same values as resizing the whole mask.
+"""
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger('imgcraft')
+
+# Longer side of the base masks
+BASE_SIDE = 512
+
+# Aspect ratios closer than this share a base mask
+ASPECT_STEP = 0.01
+
+
+def build_vignette_mask(width: int, height: int, strength: float) -> np.ndarray:
+    """
+    Exact vignette factors for an image size
+
+    Args:
+        width: Mask width
+        height: Mask height
+        strength: Vignette strength (0-100)
+
+    Returns:
+        float32 array of shape (height, width), 1 at the center and
+        1 - strength / 100 in the corners
+    """
+    center_x, center_y = width / 2, height / 2
+    max_dist = np.float32(np.sqrt(center_x ** 2 + center_y ** 2))
+    dx2 = np.square(np.arange(width, dtype=np.float32) - np.float32(center_x))
+    dy2 = np.square(np.arange(height, dtype=np.float32) - np.float32(center_y))
+    mask = np.sqrt(dy2[:, None] + dx2[None, :])
+    mask /= max_dist
+    np.minimum(mask, 1.0, out=mask)
+    mask *= np.float32(-strength / 100.0)
+    mask += 1.0
+    return mask
+
+
+class VignetteMask:
+    """Vignette factors of one image size, produced a block of rows at a time"""
+
+    def __init__(self, base: np.ndarray, width: int, height: int):
+        self.width = width
+        self.height = height
+        # Horizontal half of the bilinear resize, done once per image
+        if base.shape[1] == width:
+            self._band = base
+        else:
+            self._band = cv2.resize(base, (width, base.shape[0]), interpolation=cv2.INTER_LINEAR)
+        # Vertical half: source rows and weights of every output row, with
+        # cv2.resize's pixel-center alignment and edge clamping
+        scale = base.shape[0] / height
+        source = np.clip((np.arange(height) + 0.5) * scale - 0.5, 0, base.shape[0] - 1)
+        self._top = np.floor(source).astype(np.intp)
+        self._bottom = np.minimum(self._top + 1, base.shape[0] - 1)
+        self._weight = (source - self._top).astype(np.float32)[:, None]
+
+    @property
+    def nbytes(self) -> int:
+        return self._band.nbytes
+
+    def rows(self, top: int, bottom: int, out: np.ndarray) -> np.ndarray:
+        """
+        Mask rows top..bottom
+
+        Args:
+            top: First row
+            bottom: Row after the last one
+            out: float32 array with at least bottom - top rows of width values
+
+        Returns:
+            The filled view of out, shape (bottom - top, width)
+        """
+        out = out[:bottom - top]
+        upper = self._band[self._top[top:bottom]]
+        lower = self._band[self._bottom[top:bottom]]
+        np.subtract(lower, upper, out=lower)
+        lower *= self._weight[top:bottom]
+        np.add(upper, lower, out=out)
+        return out
+
+
+class VignetteMaskCache:
+    """LRU of low-resolution vignette bases, bounded by bytes"""
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._bases: 'OrderedDict[tuple, np.ndarray]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'built': 0}
+
+    def _base(self, width: int, height: int, strength: float) -> np.ndarray:
+        if max(width, height) <= BASE_SIDE:
+            # Small images get an exact mask, which is no larger than a base
+            key = (width, height, strength)
+            size = (width, height)
+        else:
+            aspect = round(round(width / height / ASPECT_STEP) * ASPECT_STEP, 6)
+            key = (aspect, strength)
+            if aspect >= 1:
+                size = (BASE_SIDE, max(1, round(BASE_SIDE / aspect)))
+            else:
+                size = (max(1, round(BASE_SIDE * aspect)), BASE_SIDE)
+        with self._lock:
+            base = self._bases.get(key)
+            if base is not None:
+                self._bases.move_to_end(key)
+                self._stats['hits'] += 1
+                return base
+
+        base = build_vignette_mask(size[0], size[1], strength)
+        base.flags.writeable = False
+        with self._lock:
+            self._stats['built'] += 1
+            if key not in self._bases and base.nbytes <= self.max_bytes:
+                self._bases[key] = base
+                self._bytes += base.nbytes
+                while self._bytes > self.max_bytes:
+                    _, dropped = self._bases.popitem(last=False)
+                    self._bytes -= dropped.nbytes
+        return base
+
+    def get(self, width: int, height: int, strength: float) -> VignetteMask:
+        """
+        Vignette mask for an image size
+
+        Small images (up to BASE_SIDE) get an exact mask; larger ones a
+        base mask resized to fit.
+
+        Args:
+            width: Image width
+            height: Image height
+            strength: Vignette strength (0-100)
+
+        Returns:
+            VignetteMask (holds at most BASE_SIDE rows of the image width)
+        """
+        return VignetteMask(self._base(width, height, float(strength)), width, height)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, bases=len(self._bases), cached_bytes=self._bytes)
+
+
+# Create singleton instance
+vignette_masks = VignetteMaskCache(config.VIGNETTE_CACHE_MB * 1024 * 1024)
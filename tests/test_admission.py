@@ -0,0 +1,98 @@
+"""
+Reservation accounting of the memory budget
+"""
+import threading
+import time
+
+import pytest
+
+from processing.admission import (
+    BASE_OVERHEAD_BYTES, AdmissionRejected, MemoryBudget, estimate_peak_bytes
+)
+
+MB = 1024 * 1024
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+def test_release_returns_exactly_what_was_reserved():
+    budget = MemoryBudget(100 * MB)
+    first = budget.reserve(30 * MB, 'resize')
+    second = budget.reserve(50 * MB, 'filter')
+    assert budget.stats()['reserved_bytes'] == 80 * MB
+    first.release()
+    first.release()
+    assert budget.stats()['reserved_bytes'] == 50 * MB
+    second.release()
+    stats = budget.stats()
+    assert stats['reserved_bytes'] == 0
+    assert stats['reservations'] == []
+
+
+def test_context_manager_releases_on_error():
+    budget = MemoryBudget(100 * MB)
+    with pytest.raises(RuntimeError):
+        with budget.reserve(40 * MB, 'crop'):
+            raise RuntimeError('tool failed')
+    assert budget.stats()['reserved_bytes'] == 0
+
+
+def test_request_larger_than_budget_is_refused_outright():
+    budget = MemoryBudget(100 * MB, max_wait_seconds=30)
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        budget.reserve(101 * MB, 'upscale')
+    assert excinfo.value.never_fits
+    assert time.monotonic() - started < 1
+    assert budget.stats()['rejected_too_large'] == 1
+
+
+def test_waiting_request_times_out_and_leaves_no_trace():
+    budget = MemoryBudget(100 * MB)
+    held = budget.reserve(80 * MB, 'filter')
+    with pytest.raises(AdmissionRejected) as excinfo:
+        budget.reserve(40 * MB, 'filter', timeout=0.05)
+    assert not excinfo.value.never_fits
+    stats = budget.stats()
+    assert stats['reserved_bytes'] == 80 * MB
+    assert stats['waiting'] == 0
+    assert stats['rejected_timeout'] == 1
+    held.release()
+
+
+def test_waiting_requests_are_admitted_in_arrival_order():
+    budget = MemoryBudget(100 * MB)
+    held = budget.reserve(90 * MB, 'upscale')
+    admitted = []
+
+    def request(name, nbytes):
+        with budget.reserve(nbytes, name, timeout=5):
+            admitted.append(name)
+
+    large = threading.Thread(target=request, args=('large', 60 * MB))
+    large.start()
+    wait_until(lambda: budget.stats()['waiting'] == 1)
+    small = threading.Thread(target=request, args=('small', 5 * MB))
+    small.start()
+    wait_until(lambda: budget.stats()['waiting'] == 2)
+    # The small request would fit now, but must not overtake the large one
+    time.sleep(0.05)
+    assert admitted == []
+
+    held.release()
+    large.join(5)
+    small.join(5)
+    assert admitted == ['large', 'small']
+    assert budget.stats()['reserved_bytes'] == 0
+
+
+def test_estimate_grows_with_image_size():
+    small = estimate_peak_bytes('compress', [((1000, 1000), 'RGB')], {})
+    large = estimate_peak_bytes('compress', [((2000, 2000), 'RGB')], {})
+    assert BASE_OVERHEAD_BYTES < small < large
+
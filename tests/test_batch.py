@@ -0,0 +1,128 @@
+"""
+Upload expansion limits and the streamed result archive of batch runs
+"""
+import io
+import json
+import zipfile
+
+import pytest
+
+from processing.batch import expand_uploads, stream_batch_zip
+
+MB = 1024 * 1024
+ALLOWED = {'png', 'jpg'}
+
+
+class Upload(io.BytesIO):
+    """Uploaded file as the endpoint sees it"""
+
+    def __init__(self, filename, data):
+        super().__init__(data)
+        self.filename = filename
+
+
+def archive(members):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return data.getvalue()
+
+
+def expand(files, max_items=10, max_item_bytes=MB, max_total_bytes=4 * MB):
+    return expand_uploads(files, ALLOWED, max_items, max_item_bytes, max_total_bytes)
+
+
+def run(items, process, **kwargs):
+    data = b''.join(stream_batch_zip(items, process, workers=2, **kwargs))
+    result = zipfile.ZipFile(io.BytesIO(data))
+    return result, json.loads(result.read('manifest.json'))
+
+
+def copy(item):
+    return io.BytesIO(item.read()), 'image/png'
+
+
+def test_archive_members_are_filtered():
+    items = expand([Upload('photos.zip', archive({
+        'a.png': b'a',
+        'dir/b.JPG': b'b',
+        'notes.txt': b'not an image',
+        '.hidden.png': b'hidden',
+        '__MACOSX/dir/._b.JPG': b'resource fork',
+    }))])
+    assert [item.name for item in items] == ['a.png', 'dir/b.JPG']
+    assert items[1].read() == b'b'
+
+
+def test_too_many_items_are_refused():
+    with pytest.raises(ValueError, match='Too many images'):
+        expand([Upload(f'{index}.png', b'x') for index in range(3)], max_items=2)
+
+
+def test_uncompressed_total_is_capped():
+    # Compresses to a few KB, expands past the total limit
+    bomb = archive({f'{index}.png': b'\0' * MB for index in range(5)})
+    assert len(bomb) < 64 * 1024
+    with pytest.raises(ValueError, match='uncompressed'):
+        expand([Upload('bomb.zip', bomb)])
+
+
+def test_oversized_member_becomes_a_failed_item():
+    items = expand([Upload('photos.zip', archive({'big.png': b'\0' * (MB + 1), 'ok.png': b'ok'}))])
+    assert items[0].error.startswith('File is larger than')
+    assert items[0].opener is None
+    assert items[1].error is None
+
+
+def test_invalid_archive_is_refused():
+    with pytest.raises(ValueError, match='not a valid ZIP'):
+        expand([Upload('broken.zip', b'not a zip')])
+
+
+def test_failed_items_are_skipped_and_reported():
+    items = expand([
+        Upload('photos.zip', archive({'big.png': b'\0' * (MB + 1)})),
+        Upload('good.png', b'good'),
+        Upload('bad.png', b'bad'),
+    ])
+    processed = []
+
+    def process(item):
+        processed.append(item.name)
+        if item.name == 'bad.png':
+            raise ValueError('cannot decode')
+        return copy(item)
+
+    result, manifest = run(items, process)
+    assert sorted(processed) == ['bad.png', 'good.png']
+    assert result.namelist() == ['002_good.png', 'manifest.json']
+    assert result.read('002_good.png') == b'good'
+    assert [entry['status'] for entry in manifest['items']] == ['failed', 'done', 'failed']
+    assert manifest['items'][2]['error'] == 'cannot decode'
+    assert (manifest['succeeded'], manifest['failed']) == (1, 2)
+
+
+def test_on_finish_sees_every_entry_and_extends_the_manifest():
+    items = expand([Upload('a.png', b'a'), Upload('b.png', b'b')])
+    seen = []
+
+    def on_finish(entries):
+        seen.extend(entry['status'] for entry in entries)
+        return {'credits_refunded': 0}
+
+    _, manifest = run(items, copy, manifest_extra={'tool': 'resize'}, on_finish=on_finish)
+    assert seen == ['done', 'done']
+    assert manifest['tool'] == 'resize'
+    assert manifest['credits_refunded'] == 0
+
+
+def test_on_finish_runs_when_the_client_goes_away():
+    items = expand([Upload(f'{index}.png', b'x' * 1024) for index in range(6)])
+    seen = []
+    chunks = stream_batch_zip(items, copy, workers=1, on_finish=lambda entries: seen.append(entries))
+    next(chunks)
+    chunks.close()
+    assert len(seen) == 1
+    assert len(seen[0]) == 6
+    assert {entry['status'] for entry in seen[0]} <= {'done', 'pending'}
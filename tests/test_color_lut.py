@@ -0,0 +1,32 @@
+"""
+.cube parsing errors are reported as ValueError
+"""
+import pytest
+
+from processing.color_lut import parse_cube_lut
+
+
+def cube(size=2, header=''):
+    lines = [header, f'LUT_3D_SIZE {size}']
+    steps = [i / (size - 1) for i in range(size)]
+    lines += [f'{r} {g} {b}' for b in steps for g in steps for r in steps]
+    return '\n'.join(lines).encode()
+
+
+def test_parses_identity_cube():
+    assert tuple(parse_cube_lut(cube()).size) == (2, 2, 2)
+
+
+@pytest.mark.parametrize('data', [
+    b'LUT_3D_SIZE\n',
+    b'LUT_3D_SIZE seventeen\n',
+    b'LUT_3D_SIZE 2 3\n',
+    cube(header='DOMAIN_MIN 0 0'),
+    cube(header='DOMAIN_MAX 1 1 one'),
+    cube(header='LUT_3D_INPUT_RANGE 0'),
+    b'LUT_3D_SIZE 2\n0 0 0\n1 x 0\n',
+    b'\xff\xfe\x00',
+])
+def test_malformed_cube_raises_value_error(data):
+    with pytest.raises(ValueError):
+        parse_cube_lut(data)
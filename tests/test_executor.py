@@ -0,0 +1,94 @@
+"""
+Image executor backends
+
+The process backend must give the same result as running the function in
+the calling thread, and a worker that is killed is replaced by a fresh one
+from the fork server.
+"""
+import multiprocessing
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.executor import (
+    ExecutorBusy, InlineExecutor, ProcessImageExecutor, TaskFailed,
+    _pack_image, _release, _unpack_image, create_executor
+)
+from processing.filter_pipeline import run_filter_pipeline
+from processing.upscale import enhance_upscaled
+
+requires_forkserver = pytest.mark.skipif(
+    'forkserver' not in multiprocessing.get_all_start_methods(),
+    reason='the process backend needs the forkserver start method'
+)
+
+
+def sample_image():
+    rng = np.random.default_rng(5)
+    return Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+
+
+@pytest.fixture(scope='module')
+def process_executor():
+    executor = ProcessImageExecutor(workers=1, max_pending=1, task_timeout=60)
+    executor.start()
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'P', '1'])
+def test_shared_memory_round_trip(mode):
+    img = sample_image().convert(mode)
+    packed, shm = _pack_image(img)
+    try:
+        restored = _unpack_image(packed)
+    finally:
+        _release(shm)
+    # Palette and bilevel images travel as their full-color equivalent
+    expected = {'P': 'RGB', '1': 'L'}.get(mode, mode)
+    assert restored.mode == expected
+    assert restored.tobytes() == img.convert(expected).tobytes()
+
+
+def test_inline_executor_calls_the_function():
+    img = sample_image()
+    assert InlineExecutor().run(enhance_upscaled, img, 2) == enhance_upscaled(img, 2)
+
+
+def test_unknown_backend_runs_inline():
+    assert isinstance(create_executor('threads', 2, 4, 60), InlineExecutor)
+
+
+@requires_forkserver
+def test_process_backend_matches_inline(process_executor):
+    img = sample_image()
+    assert process_executor.run(enhance_upscaled, img, 2) == enhance_upscaled(img, 2)
+    filter_data = {'brightness': 20, 'vignette': 40}
+    assert process_executor.run(run_filter_pipeline, img, filter_data) == run_filter_pipeline(img, filter_data)
+
+
+@requires_forkserver
+def test_task_errors_are_reported(process_executor):
+    with pytest.raises(TaskFailed):
+        process_executor.run(enhance_upscaled, sample_image(), 'not-a-factor')
+    # The worker survives a failing task
+    assert process_executor.run(enhance_upscaled, sample_image(), 2).size == (128, 96)
+
+
+@requires_forkserver
+def test_replaced_worker_keeps_serving(process_executor):
+    worker = process_executor._idle.get()
+    process_executor._replace(worker)
+    assert process_executor.run(enhance_upscaled, sample_image(), 2).size == (128, 96)
+    assert process_executor.stats()['restarts'] >= 1
+
+
+@requires_forkserver
+def test_full_queue_is_refused(process_executor):
+    assert process_executor._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(ExecutorBusy):
+            process_executor.run(enhance_upscaled, sample_image(), 2)
+    finally:
+        process_executor._slots.release()
@@ -0,0 +1,128 @@
+"""
+Behavior of the pooled-buffer filter pipeline
+"""
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from processing import filter_pipeline
+from processing.filter_pipeline import BufferPool, run_filter_pipeline
+
+# Largest per-pixel difference from the per-filter chain, in 8-bit levels.
+# Pillow approximates the Gaussian of blur and clarity with box blurs, so
+# those stages differ by a few levels at edges; the mean stays below one
+MAX_DIFFERENCE = 6
+MEAN_DIFFERENCE = 1.0
+
+# The AI enhance sharpen kernel before it was fixed: the 3x3 Laplacian sharpen
+# divided by 9, which sums to 1/9
+OLD_ENHANCE_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], dtype=np.float32) / 9.0
+
+
+def gradient_image(width=160, height=120):
+    x = np.linspace(40, 215, width, dtype=np.float32)
+    y = np.linspace(0, 30, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + y, x[::-1] + y, np.full((height, width), 128, np.float32)], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def textured_image(width=320, height=280):
+    # Taller than BLOCK_ROWS, so the float stages run in more than one block
+    rng = np.random.default_rng(9)
+    small = Image.fromarray(rng.integers(0, 256, (35, 40, 3), dtype=np.uint8))
+    return small.resize((width, height), Image.Resampling.BICUBIC)
+
+
+def reference_vignette(img, strength):
+    """The per-filter vignette, with its full-size float64 distance mask"""
+    img_array = np.array(img, dtype=np.float32)
+    rows, cols = img_array.shape[:2]
+    center_x, center_y = cols / 2, rows / 2
+    Y, X = np.ogrid[:rows, :cols]
+    dist_from_center = np.sqrt((X - center_x) ** 2 + (Y - center_y) ** 2)
+    mask = np.clip(1.0 - dist_from_center / np.sqrt(center_x ** 2 + center_y ** 2), 0, 1)
+    mask = 1.0 - (strength / 100.0 * (1.0 - mask))
+    return Image.fromarray(np.clip(img_array * mask[:, :, np.newaxis], 0, 255).astype(np.uint8))
+
+
+def reference_spatial_chain(img, filter_data):
+    """The per-filter PIL chain for sharpness, clarity, blur and vignette"""
+    sharpness = float(filter_data.get('sharpness', 0))
+    if sharpness > 0:
+        img = ImageEnhance.Sharpness(img).enhance(1.0 + sharpness / 50.0)
+    clarity = float(filter_data.get('clarity', 0))
+    if clarity > 0:
+        img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=int(clarity * 1.5), threshold=3))
+    blur = float(filter_data.get('blur', 0))
+    if blur > 0:
+        img = img.filter(ImageFilter.GaussianBlur(radius=blur / 10.0))
+    vignette = float(filter_data.get('vignette', 0))
+    if vignette > 0:
+        img = reference_vignette(img, vignette)
+    return img
+
+
+@pytest.mark.parametrize('filter_data', [
+    {'sharpness': 60},
+    {'clarity': 50},
+    {'blur': 25},
+    {'vignette': 70},
+    {'sharpness': 40, 'clarity': 30, 'blur': 10, 'vignette': 50},
+])
+def test_pooled_pipeline_matches_the_per_filter_chain(filter_data):
+    img = textured_image()
+    expected = np.asarray(reference_spatial_chain(img, filter_data), dtype=np.int16)
+    actual = np.asarray(run_filter_pipeline(img, filter_data), dtype=np.int16)
+    difference = np.abs(actual - expected)
+    assert difference.max() <= MAX_DIFFERENCE
+    assert difference.mean() < MEAN_DIFFERENCE
+
+
+def test_runs_of_the_same_size_reuse_pooled_buffers(monkeypatch):
+    pool = BufferPool()
+    monkeypatch.setattr(filter_pipeline, 'buffer_pool', pool)
+    img = textured_image()
+    filter_data = {'clarity': 30, 'vignette': 50}
+    first = run_filter_pipeline(img, filter_data)
+    allocations = pool.stats()['allocations']
+    second = run_filter_pipeline(img, filter_data)
+    assert pool.stats()['allocations'] == allocations
+    assert pool.stats()['hits'] >= allocations
+    # Reused buffers start dirty; the result must not depend on that
+    assert first.tobytes() == second.tobytes()
+
+
+def test_source_image_is_not_modified():
+    img = textured_image()
+    before = img.tobytes()
+    run_filter_pipeline(img, {'brightness': 30, 'sharpness': 50, 'grain': 20})
+    assert img.tobytes() == before
+
+
+def test_enhance_kernel_keeps_flat_areas():
+    flat = np.full((16, 16, 3), 128, dtype=np.uint8)
+    assert filter_pipeline._ENHANCE_KERNEL.sum() == pytest.approx(1.0)
+    assert np.array_equal(cv2.filter2D(flat, -1, filter_pipeline._ENHANCE_KERNEL), flat)
+    # Before the fix a flat area came out at a ninth of its brightness
+    assert cv2.filter2D(flat, -1, OLD_ENHANCE_KERNEL).max() == 14
+
+
+@pytest.mark.parametrize('tier', ['fast', 'balanced'])
+def test_ai_enhance_keeps_brightness(tier):
+    img = gradient_image()
+    result = run_filter_pipeline(img, {'aiAutoEnhance': True, 'enhanceQuality': tier})
+    before = np.asarray(img, dtype=np.float32).mean()
+    after = np.asarray(result, dtype=np.float32).mean()
+    assert abs(after - before) < 12
+
+
+def test_auto_enhance_tier_depends_only_on_pixel_count():
+    model = filter_pipeline.EnhanceTierModel(2.5)
+    choices = [model.choose(pixels) for pixels in (500_000, 2_000_000, 8_000_000)]
+    assert choices == ['best', 'balanced', 'fast']
+    # Slow runs on this worker do not change the choice
+    model.record('best', 500_000, 60.0)
+    model.record('balanced', 2_000_000, 60.0)
+    assert [model.choose(pixels) for pixels in (500_000, 2_000_000, 8_000_000)] == choices
+    assert model.stats()['measured_seconds_per_mp']['best'] > model.seconds_per_mp['best']
@@ -0,0 +1,91 @@
+"""
+Ownership, expiry and the decoded-pixel cache of image handles
+"""
+import io
+
+import pytest
+from PIL import Image
+
+from processing.handles import ImageHandleStore
+
+
+def png_bytes(size=(32, 24), color=(200, 40, 90)):
+    data = io.BytesIO()
+    Image.new('RGB', size, color).save(data, 'PNG')
+    return data.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageHandleStore(str(tmp_path), ttl=60, memory_bytes=32 * 24 * 3 * 2)
+
+
+def test_handle_is_only_usable_by_its_owner(store):
+    handle = store.put('user-a', png_bytes(), 'photo.png')
+    assert store.get(handle.id, 'user-a') is handle
+    assert store.get(handle.id, 'user-b') is None
+    assert store.get(handle.id, None) is None
+    assert store.read_bytes(handle) == png_bytes()
+
+
+def test_only_the_owner_can_delete(store):
+    handle = store.put('user-a', png_bytes())
+    assert not store.delete(handle.id, 'user-b')
+    assert not store.delete(handle.id, None)
+    assert store.delete(handle.id, 'user-a')
+    assert store.get(handle.id, 'user-a') is None
+    assert store.read_bytes(handle) is None
+
+
+def test_expired_handles_are_removed(store, tmp_path):
+    handle = store.put('user-a', png_bytes())
+    handle.expires_at = 0
+    assert store.get(handle.id, 'user-a') is None
+    assert store.stats()['expired'] == 1
+    assert not (tmp_path / handle.id).exists()
+
+
+def test_disk_budget_drops_the_oldest_handles(tmp_path):
+    data = png_bytes()
+    store = ImageHandleStore(str(tmp_path), disk_bytes=2 * len(data))
+    first = store.put('user-a', data)
+    second = store.put('user-a', png_bytes(color=(1, 2, 3)))
+    third = store.put('user-a', png_bytes(color=(4, 5, 6)))
+    assert store.get(first.id, 'user-a') is None
+    assert store.get(second.id, 'user-a') is second
+    assert store.get(third.id, 'user-a') is third
+
+
+def test_put_file_reads_the_header_only(store):
+    handle = store.put_file('user-a', io.BytesIO(png_bytes((40, 30))), 'result')
+    assert (handle.width, handle.height, handle.format) == (40, 30, 'PNG')
+    assert store.stats()['decoded_entries'] == 0
+
+
+def test_unreadable_data_is_refused(store, tmp_path):
+    with pytest.raises(ValueError):
+        store.put('user-a', b'not an image')
+    with pytest.raises(ValueError):
+        store.put_file('user-a', io.BytesIO(b'not an image'))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_decoded_cache_stays_within_its_budget(store):
+    handles = [store.put('user-a', png_bytes(color=(index, 0, 0))) for index in range(3)]
+    stats = store.stats()
+    assert stats['decoded_entries'] == 2
+    assert stats['decoded_bytes'] <= store.memory_bytes
+    # An evicted handle is decoded again from disk
+    img = store.decoded(store.read_bytes(handles[0]))
+    assert img.getpixel((0, 0)) == (0, 0, 0)
+    assert store.stats()['decode_misses'] == 1
+    assert store.stats()['decoded_bytes'] <= store.memory_bytes
+
+
+def test_decoded_returns_a_private_copy(store):
+    data = png_bytes()
+    store.put('user-a', data)
+    img = store.decoded(data)
+    img.putpixel((0, 0), (0, 0, 0))
+    assert store.decoded(data).getpixel((0, 0)) == (200, 40, 90)
+    assert store.decoded(png_bytes(color=(9, 9, 9))) is None
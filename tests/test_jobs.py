@@ -0,0 +1,100 @@
+"""
+Slot accounting, ownership and retention of the background job queue
+"""
+import os
+import time
+
+import pytest
+
+from processing.jobs import JobManager, JobQueueFull
+
+
+class Output:
+    """Minimal encoded output, as the tools hand to JobManager"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def copy_to(self, fileobj):
+        return fileobj.write(self.data)
+
+
+def wait_for(manager, job, timeout=5.0):
+    """Wait until job has finished and given back its slot"""
+    deadline = time.monotonic() + timeout
+    while job.finished_at is None or manager.stats()['pending']:
+        assert time.monotonic() < deadline, 'job did not finish'
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(str(tmp_path / 'jobs'), workers=1, max_pending=2)
+
+
+def test_reserve_refuses_past_max_pending(manager):
+    manager.reserve()
+    manager.reserve()
+    with pytest.raises(JobQueueFull):
+        manager.reserve()
+    manager.release()
+    manager.reserve()
+    assert manager.stats()['pending'] == 2
+
+
+def test_release_never_goes_negative(manager):
+    manager.release()
+    assert manager.stats()['pending'] == 0
+
+
+def test_finished_job_gives_back_its_slot(manager):
+    manager.reserve()
+    job = wait_for(manager, manager.submit('user-a', 'upscale', lambda: (Output(b'result'), 'image/png', {'X-Test': '1'})))
+    assert job.status == 'done'
+    assert job.result_bytes == len(b'result')
+    with open(job.result_path, 'rb') as result_file:
+        assert result_file.read() == b'result'
+    assert job.headers == {'X-Test': '1'}
+    assert manager.stats()['pending'] == 0
+
+
+def test_failed_job_gives_back_its_slot(manager):
+    def fail():
+        raise RuntimeError('boom')
+
+    manager.reserve()
+    job = wait_for(manager, manager.submit('user-a', 'upscale', fail))
+    assert job.status == 'failed'
+    assert job.error == 'boom'
+    assert manager.stats()['pending'] == 0
+
+
+def test_submit_failure_releases_the_slot(manager, monkeypatch):
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise RuntimeError('cannot schedule')
+
+    monkeypatch.setattr(manager, '_get_executor', lambda: BrokenExecutor())
+    manager.reserve()
+    with pytest.raises(RuntimeError):
+        manager.submit('user-a', 'upscale', lambda: None)
+    stats = manager.stats()
+    assert stats['pending'] == 0
+    assert stats['jobs'] == {}
+
+
+def test_jobs_are_only_visible_to_their_owner(manager):
+    manager.reserve()
+    job = wait_for(manager, manager.submit('user-a', 'upscale', lambda: (Output(b'x'), 'image/png', {})))
+    assert manager.get(job.id, 'user-a') is job
+    assert manager.get(job.id, 'user-b') is None
+    assert manager.get('missing', 'user-a') is None
+
+
+def test_expired_results_are_pruned(manager):
+    manager.reserve()
+    job = wait_for(manager, manager.submit('user-a', 'upscale', lambda: (Output(b'x'), 'image/png', {})))
+    job.finished_at -= manager.result_ttl + 1
+    assert manager.get(job.id, 'user-a') is None
+    assert not os.path.exists(job.result_path)
@@ -0,0 +1,83 @@
+"""
+Spilling, copying and detaching of encoded outputs
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.output import ChunkSink, OutputBuffer
+from processing.tiles import PNGStripWriter
+
+
+def test_small_output_stays_in_memory():
+    buffer = OutputBuffer(spill_bytes=100)
+    buffer.write(b'x' * 100)
+    assert not buffer.spilled
+    assert buffer.size == 100
+
+
+def test_output_spills_once_it_passes_the_threshold(tmp_path):
+    buffer = OutputBuffer(spill_bytes=100, spool_dir=str(tmp_path))
+    buffer.write(b'a' * 60)
+    buffer.write(b'b' * 60)
+    assert buffer.spilled
+    assert buffer.size == 120
+    assert buffer.tell() == 120
+    assert buffer.getvalue() == b'a' * 60 + b'b' * 60
+    # Reading the value back does not move the write position
+    buffer.write(b'c')
+    assert buffer.getvalue().endswith(b'bc')
+
+
+def test_spill_keeps_the_position_after_a_seek():
+    buffer = OutputBuffer(spill_bytes=10)
+    buffer.write(b'0123456789')
+    buffer.seek(2)
+    buffer.write(b'ABCDEFGHIJ')
+    assert buffer.spilled
+    assert buffer.getvalue() == b'01ABCDEFGHIJ'
+
+
+@pytest.mark.parametrize('spill_bytes', [1 << 20, 16])
+def test_copy_to_writes_everything_and_keeps_the_position(spill_bytes):
+    data = bytes(range(256)) * 8
+    buffer = OutputBuffer(spill_bytes=spill_bytes)
+    buffer.write(data)
+    buffer.seek(5)
+    target = io.BytesIO()
+    assert buffer.copy_to(target) == len(data)
+    assert target.getvalue() == data
+    assert buffer.tell() == 5
+
+
+@pytest.mark.parametrize('spill_bytes', [1 << 20, 16])
+def test_body_is_rewound_and_detached(spill_bytes):
+    buffer = OutputBuffer(spill_bytes=spill_bytes)
+    buffer.write(b'result' * 10)
+    body = buffer.body()
+    assert body.read() == b'result' * 10
+    assert buffer.size == 0
+    assert not buffer.spilled
+    body.close()
+
+
+def test_pillow_encodes_through_write():
+    img = Image.fromarray(np.random.default_rng(4).integers(0, 256, (64, 64, 3), dtype=np.uint8))
+    buffer = OutputBuffer(spill_bytes=1024)
+    img.save(buffer, 'PNG')
+    assert buffer.spilled
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(buffer.getvalue()))), np.asarray(img))
+
+
+def test_strip_written_png_matches_the_image():
+    img = Image.fromarray(np.random.default_rng(6).integers(0, 256, (50, 40, 4), dtype=np.uint8))
+    sink = ChunkSink()
+    writer = PNGStripWriter(sink, img.size, img.mode)
+    for top in range(0, img.height, 16):
+        writer.write(img.crop((0, top, img.width, min(img.height, top + 16))))
+    writer.close()
+    decoded = Image.open(io.BytesIO(sink.drain()))
+    assert decoded.mode == 'RGBA'
+    assert np.array_equal(np.asarray(decoded), np.asarray(img))
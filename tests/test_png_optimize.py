@@ -0,0 +1,91 @@
+"""
+The PNG optimizer must stay lossless whichever candidate wins
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.png_optimize import PNG_MODES, PNGOptimizer
+
+
+def photo(mode):
+    rng = np.random.default_rng(8)
+    bands = len(mode)
+    pixels = rng.integers(0, 256, (96, 128, bands), dtype=np.uint8)
+    if bands == 1:
+        pixels = pixels[..., 0]
+    return Image.fromarray(pixels, mode)
+
+
+def graphic():
+    pixels = np.zeros((96, 128, 3), dtype=np.uint8)
+    pixels[:, 64:] = (30, 144, 255)
+    pixels[40:60] = 255
+    return Image.fromarray(pixels)
+
+
+@pytest.fixture(scope='module')
+def optimizer():
+    return PNGOptimizer(workers=2, budget_seconds=5.0)
+
+
+def round_trip(optimizer, img, **kwargs):
+    data = io.BytesIO()
+    result = optimizer.save(img, data, **kwargs)
+    decoded = Image.open(io.BytesIO(data.getvalue()))
+    decoded.load()
+    return result, decoded
+
+
+@pytest.mark.parametrize('mode', PNG_MODES)
+@pytest.mark.parametrize('img_mode', ['RGB', 'RGBA', 'L', 'LA'])
+def test_output_decodes_to_the_same_pixels(optimizer, mode, img_mode):
+    img = photo(img_mode)
+    _, decoded = round_trip(optimizer, img, mode=mode)
+    assert decoded.mode == img_mode
+    assert decoded.tobytes() == img.tobytes()
+
+
+def test_smallest_candidate_is_written(optimizer):
+    img = graphic()
+    result, decoded = round_trip(optimizer, img)
+    assert decoded.tobytes() == img.tobytes()
+    assert result['candidates'] > 1
+    pillow = io.BytesIO()
+    img.save(pillow, 'PNG', compress_level=6)
+    assert result['bytes'] <= len(pillow.getvalue())
+
+
+def test_expired_budget_still_writes_a_valid_png():
+    img = photo('RGB')
+    result, decoded = round_trip(PNGOptimizer(workers=1, budget_seconds=0), img)
+    assert result['candidates'] >= 1
+    assert decoded.tobytes() == img.tobytes()
+
+
+def test_large_images_are_written_in_strips():
+    img = photo('RGB')
+    result, decoded = round_trip(PNGOptimizer(max_pixels=1000), img)
+    assert result['candidates'] == 1
+    assert decoded.tobytes() == img.tobytes()
+
+
+def test_other_modes_go_through_pillow(optimizer):
+    img = photo('RGB').convert('P')
+    result, decoded = round_trip(optimizer, img)
+    assert result['candidate'] == 'pillow'
+    assert decoded.tobytes() == img.tobytes()
+
+
+def test_dpi_is_kept(optimizer):
+    img = photo('RGB')
+    img.info['dpi'] = (300, 300)
+    _, decoded = round_trip(optimizer, img)
+    assert tuple(round(value) for value in decoded.info['dpi']) == (300, 300)
+
+
+def test_unknown_mode_is_refused(optimizer):
+    with pytest.raises(ValueError):
+        optimizer.save(photo('RGB'), io.BytesIO(), mode='ultra')
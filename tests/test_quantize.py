@@ -0,0 +1,80 @@
+"""
+Palette quantization used by PNG compression
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.quantize import DITHER_MODES, quantize_image
+
+
+def photo(mode='RGB', size=(160, 120)):
+    x = np.linspace(0, 255, size[0], dtype=np.float32)
+    y = np.linspace(0, 255, size[1], dtype=np.float32)[:, None]
+    bands = [x + 0 * y, y + 0 * x, (x + y) / 2]
+    if mode == 'RGBA':
+        alpha = np.full((size[1], size[0]), 255, np.float32)
+        alpha[:, :size[0] // 4] = 0
+        alpha[:, size[0] // 4:size[0] // 2] = 128
+        bands.append(alpha)
+    return Image.fromarray(np.stack(bands, axis=-1).astype(np.uint8), mode)
+
+
+def premultiplied(img, mode):
+    pixels = np.asarray(img.convert(mode), dtype=np.float32)
+    if mode == 'RGBA':
+        pixels[..., :3] *= pixels[..., 3:] / 255
+    return pixels
+
+
+def rms_error(source, quantized):
+    """RMS error, premultiplied for RGBA (the color of transparent pixels does not matter)"""
+    expected = premultiplied(source, source.mode)
+    actual = premultiplied(quantized, source.mode)
+    return float(np.sqrt(np.mean((expected - actual) ** 2)))
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('dither', DITHER_MODES)
+def test_palette_size_and_error(mode, dither):
+    img = photo(mode)
+    result = quantize_image(img, 64, dither)
+    assert result.mode == 'P'
+    assert result.size == img.size
+    assert len(np.unique(np.asarray(result))) <= 64
+    # Dithering trades a little RMS error for smoother gradients
+    assert rms_error(img, result) < (12 if dither == 'none' else 16)
+
+
+def test_few_colors_are_kept_exactly():
+    pixels = np.zeros((40, 40, 3), dtype=np.uint8)
+    pixels[:20] = (255, 0, 0)
+    pixels[20:, :20] = (0, 128, 255)
+    img = Image.fromarray(pixels)
+    assert rms_error(img, quantize_image(img, 16)) == 0
+
+
+def test_transparent_pixels_stay_transparent():
+    img = photo('RGBA')
+    result = quantize_image(img, 32).convert('RGBA')
+    alpha = np.asarray(result)[..., 3]
+    assert (alpha[:, :img.width // 4] == 0).all()
+    assert (alpha[:, img.width // 2:] == 255).all()
+
+
+def test_palette_is_built_from_a_sample():
+    # A sample of a few hundred pixels still yields a usable palette
+    img = photo(size=(600, 400))
+    assert rms_error(img, quantize_image(img, 64, sample_pixels=256)) < 16
+
+
+def test_unknown_dither_is_refused():
+    with pytest.raises(ValueError):
+        quantize_image(photo(), 64, 'random')
+
+
+def test_rgba_error_diffusion_falls_back_to_ordered():
+    img = photo('RGBA')
+    floyd = quantize_image(img, 64, 'floyd')
+    ordered = quantize_image(img, 64, 'ordered')
+    assert floyd.convert('RGBA').tobytes() == ordered.convert('RGBA').tobytes()
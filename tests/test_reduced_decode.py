@@ -0,0 +1,67 @@
+"""
+Reduced-resolution decoding for tools that shrink the image
+"""
+import io
+from functools import lru_cache
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_utils import open_image_for_size, reduction_factor
+
+
+@lru_cache(maxsize=None)
+def encoded_bytes(fmt, size=(1600, 1200)):
+    rng = np.random.default_rng(11)
+    pixels = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels).resize(size, Image.Resampling.BILINEAR)
+    data = io.BytesIO()
+    img.save(data, fmt)
+    return data.getvalue()
+
+
+def encoded(fmt):
+    return io.BytesIO(encoded_bytes(fmt))
+
+
+@pytest.mark.parametrize('size, target, gap, expected', [
+    ((1600, 1200), (800, 600), 1.0, 2),
+    ((1600, 1200), (799, 599), 1.0, 2),
+    ((1600, 1200), (801, 600), 1.0, 1),
+    ((1600, 1200), (200, 150), 1.0, 8),
+    ((1600, 1200), (200, 150), 2.0, 4),
+    ((1600, 1200), (2000, 1500), 1.0, 1),
+])
+def test_reduction_factor_keeps_the_target_covered(size, target, gap, expected):
+    assert reduction_factor(size, target, gap) == expected
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+@pytest.mark.parametrize('target, gap', [((200, 150), 1.0), ((300, 100), 2.0), ((1000, 10), 1.0)])
+def test_decoded_image_still_covers_the_target(fmt, target, gap):
+    img = open_image_for_size(encoded(fmt), target, reducing_gap=gap)
+    img.load()
+    assert img.width >= target[0] * gap
+    assert img.height >= target[1] * gap
+    assert img.format == fmt
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+def test_decode_is_reduced(fmt):
+    img = open_image_for_size(encoded(fmt), (200, 150))
+    img.load()
+    assert img.size == (200, 150)
+
+
+def test_larger_target_decodes_at_full_size():
+    img = open_image_for_size(encoded('PNG'), (4000, 3000))
+    assert img.size == (1600, 1200)
+
+
+def test_reduced_result_matches_a_full_decode():
+    target = (400, 300)
+    full = Image.open(encoded('PNG')).resize(target, Image.Resampling.LANCZOS)
+    reduced = open_image_for_size(encoded('PNG'), target, reducing_gap=2.0).resize(target, Image.Resampling.LANCZOS)
+    difference = np.abs(np.asarray(full, dtype=np.int16) - np.asarray(reduced, dtype=np.int16))
+    assert difference.mean() < 1.5
@@ -0,0 +1,81 @@
+"""
+Keys and eviction of the content-addressed result cache
+"""
+import pytest
+
+from processing.result_cache import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path), memory_bytes=100, disk_bytes=250, max_entry_bytes=200)
+
+
+def test_key_ignores_parameter_order():
+    first = ResultCache.make_key('resize', b'image', {'width': 10, 'height': 20})
+    second = ResultCache.make_key('resize', b'image', {'height': 20, 'width': 10})
+    assert first == second
+
+
+@pytest.mark.parametrize('tool, data, params', [
+    ('compress', b'image', {'width': 10}),
+    ('resize', b'other', {'width': 10}),
+    ('resize', b'image', {'width': 11}),
+    ('resize', b'image', {'width': '10'}),
+])
+def test_key_changes_with_tool_data_and_params(tool, data, params):
+    assert ResultCache.make_key(tool, data, params) != ResultCache.make_key('resize', b'image', {'width': 10})
+
+
+def test_hit_replays_mimetype_and_headers(cache):
+    cache.put('a', b'result', 'image/png', {'X-Original-Size': '10'})
+    hit = cache.get('a')
+    assert hit.data == b'result'
+    assert hit.mimetype == 'image/png'
+    assert hit.headers == {'X-Original-Size': '10'}
+
+
+def test_memory_evicts_least_recently_used(cache):
+    cache.put('a', b'a' * 40, 'image/png')
+    cache.put('b', b'b' * 40, 'image/png')
+    cache.get('a')
+    cache.put('c', b'c' * 40, 'image/png')
+    assert set(cache._memory) == {'a', 'c'}
+    assert cache.stats()['memory_bytes'] == 80
+
+
+def test_evicted_from_memory_is_served_from_disk(cache):
+    cache.put('a', b'a' * 60, 'image/png')
+    cache.put('b', b'b' * 60, 'image/png')
+    assert 'a' not in cache._memory
+    assert cache.get('a').data == b'a' * 60
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_evicts_oldest_and_removes_files(cache, tmp_path):
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key.encode() * 100, 'image/png')
+    assert list(cache._disk) == ['b', 'c']
+    assert cache.stats()['disk_bytes'] == 200
+    assert not any(path.name.startswith('a.') for path in tmp_path.rglob('*'))
+
+
+def test_disk_index_survives_a_restart(cache, tmp_path):
+    cache.put('a', b'a' * 60, 'image/jpeg')
+    restarted = ResultCache(str(tmp_path), memory_bytes=100, disk_bytes=250, max_entry_bytes=200)
+    hit = restarted.get('a')
+    assert hit.data == b'a' * 60
+    assert hit.mimetype == 'image/jpeg'
+
+
+def test_oversized_results_are_not_stored(cache):
+    cache.put('big', b'x' * 201, 'image/png')
+    assert cache.get('big') is None
+    assert cache.stats()['stores'] == 0
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResultCache(str(tmp_path), enabled=False)
+    cache.put('a', b'result', 'image/png')
+    assert cache.get('a') is None
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,130 @@
+"""
+Streaming multipart parsing and the memory reserved for a streamed decode
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.admission import AdmissionRejected, MemoryBudget
+from processing.streaming_upload import read_streaming_upload
+
+BOUNDARY = 'imgcraft-test-boundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+MB = 1024 * 1024
+
+
+def png_bytes(size=(300, 200)):
+    rng = np.random.default_rng(2)
+    data = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(data, 'PNG')
+    return data.getvalue()
+
+
+def multipart(fields, files):
+    """Body with fields first, then files given as (name, filename, bytes)"""
+    body = io.BytesIO()
+    for name, value in fields:
+        body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        body.write(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: image/png\r\n\r\n'.encode()
+        )
+        body.write(data + b'\r\n')
+    body.write(f'--{BOUNDARY}--\r\n'.encode())
+    return body.getvalue()
+
+
+class CountingStream(io.BytesIO):
+    """Request body that records how much of it was read"""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+def test_form_files_and_decoded_image():
+    data = png_bytes()
+    body = multipart([('quality', '80')], [('image', 'photo.png', data), ('logo', 'logo.png', b'logo')])
+    upload = read_streaming_upload(io.BytesIO(body), CONTENT_TYPE, chunk_size=4096)
+    assert upload.form['quality'] == '80'
+    assert upload.image_bytes == data
+    assert upload.image.size == (300, 200)
+    assert np.array_equal(np.asarray(upload.image), np.asarray(Image.open(io.BytesIO(data))))
+    assert upload.files['image'].read() == data
+    assert upload.files['logo'].read() == b'logo'
+
+
+def test_header_callback_sees_the_fields_sent_before_the_image():
+    calls = []
+    body = multipart([('factor', '4')], [('image', 'photo.png', png_bytes())])
+    read_streaming_upload(
+        io.BytesIO(body), CONTENT_TYPE, chunk_size=4096,
+        on_header=lambda size, mode, form: calls.append((size, mode, dict(form)))
+    )
+    assert calls == [((300, 200), 'RGB', {'factor': '4'})]
+
+
+def test_refusal_in_the_header_callback_stops_reading():
+    budget = MemoryBudget(1 * MB)
+    stream = CountingStream(multipart([], [('image', 'photo.png', png_bytes((600, 600)))]))
+
+    def reserve(size, mode, form):
+        budget.reserve(size[0] * size[1] * 3, 'filter')
+
+    with pytest.raises(AdmissionRejected):
+        read_streaming_upload(stream, CONTENT_TYPE, chunk_size=4096, on_header=reserve)
+    assert stream.consumed < len(stream.getvalue())
+    assert budget.stats()['reserved_bytes'] == 0
+
+
+def test_malformed_bodies_are_refused():
+    with pytest.raises(ValueError):
+        read_streaming_upload(io.BytesIO(b''), 'application/json')
+    body = multipart([], [('image', 'photo.png', png_bytes())])
+    with pytest.raises(ValueError):
+        read_streaming_upload(io.BytesIO(body[:len(body) // 2]), CONTENT_TYPE)
+
+
+def test_streamed_reservation_is_topped_up_to_the_full_estimate():
+    budget = MemoryBudget(100 * MB)
+    held = [budget.reserve(30 * MB, 'filter')]
+    reservations = budget.reserve_remainder(held, 45 * MB, 'filter')
+    assert budget.stats()['reserved_bytes'] == 45 * MB
+    for reservation in reservations:
+        reservation.release()
+    assert budget.stats()['reserved_bytes'] == 0
+
+
+def test_streamed_reservation_that_covers_the_estimate_is_kept():
+    budget = MemoryBudget(100 * MB)
+    held = [budget.reserve(30 * MB, 'filter')]
+    assert budget.reserve_remainder(held, 20 * MB, 'filter') == held
+    assert budget.stats()['reserved_bytes'] == 30 * MB
+    held[0].release()
+
+
+def test_refused_top_up_releases_the_streamed_reservation():
+    budget = MemoryBudget(100 * MB)
+    blocker = budget.reserve(60 * MB, 'upscale')
+    held = [budget.reserve(30 * MB, 'filter')]
+    with pytest.raises(AdmissionRejected):
+        budget.reserve_remainder(held, 50 * MB, 'filter', timeout=0.05)
+    assert budget.stats()['reserved_bytes'] == 60 * MB
+    blocker.release()
+
+
+def test_estimate_over_the_budget_is_refused_despite_the_streamed_reservation():
+    budget = MemoryBudget(100 * MB, max_wait_seconds=30)
+    held = [budget.reserve(90 * MB, 'upscale')]
+    with pytest.raises(AdmissionRejected) as excinfo:
+        budget.reserve_remainder(held, 120 * MB, 'upscale')
+    assert excinfo.value.never_fits
+    assert budget.stats()['reserved_bytes'] == 0
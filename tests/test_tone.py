@@ -0,0 +1,104 @@
+"""
+The tone LUT must match the per-pixel float chain it replaced
+
+reference_tone_chain is the chain apply_manual_filters ran on every pixel
+before the sliders were compiled into a lookup table, which the filter
+pipeline now applies. Both evaluate the same float operations on the same
+input values, so the outputs are expected to be identical; TOLERANCE is the
+largest difference allowed, in 8-bit levels.
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from processing.filter_pipeline import run_filter_pipeline
+from processing.tone import TONE_KEYS, build_tone_lut
+
+# Largest allowed difference per channel, in 8-bit levels
+TOLERANCE = 0
+
+
+def reference_tone_chain(img, filter_data):
+    """The original per-pixel float chain (exposure through blacks)"""
+    img_array = np.array(img, dtype=np.float32)
+
+    exposure_val = float(filter_data.get('exposure', 0))
+    if exposure_val != 0:
+        factor = 2.0 ** (exposure_val / 50.0)
+        img_array = np.clip(img_array * factor, 0, 255)
+
+    brightness = float(filter_data.get('brightness', 0))
+    if brightness != 0:
+        img_array = np.clip(img_array + (brightness * 2.55), 0, 255)
+
+    contrast = float(filter_data.get('contrast', 0))
+    if contrast != 0:
+        factor = (contrast + 100.0) / 100.0
+        img_array = np.clip(((img_array - 127.5) * factor) + 127.5, 0, 255)
+
+    highlights = float(filter_data.get('highlights', 0))
+    if highlights != 0:
+        mask = (img_array > 180).astype(float)
+        adjustment = highlights * 0.5
+        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
+
+    shadows = float(filter_data.get('shadows', 0))
+    if shadows != 0:
+        mask = (img_array < 75).astype(float)
+        adjustment = shadows * 0.5
+        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
+
+    whites = float(filter_data.get('whites', 0))
+    if whites != 0:
+        mask = (img_array > 200).astype(float)
+        adjustment = whites * 0.3
+        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
+
+    blacks = float(filter_data.get('blacks', 0))
+    if blacks != 0:
+        mask = (img_array < 50).astype(float)
+        adjustment = blacks * 0.3
+        img_array = np.clip(img_array + (mask * adjustment), 0, 255)
+
+    return Image.fromarray(img_array.astype(np.uint8))
+
+
+def random_settings(rng):
+    """Random values for a random subset of the tone sliders"""
+    keys = rng.choice(TONE_KEYS, size=rng.integers(1, len(TONE_KEYS) + 1), replace=False)
+    return {str(key): float(rng.uniform(-100, 100)) for key in keys}
+
+
+@pytest.fixture(scope='module')
+def image():
+    rng = np.random.default_rng(3)
+    return Image.fromarray(rng.integers(0, 256, (96, 128, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize('filter_data', [
+    {'exposure': 40},
+    {'brightness': -35.5},
+    {'contrast': 60},
+    {'highlights': -80, 'shadows': 70},
+    {'whites': 100, 'blacks': -100},
+    {key: 50 for key in TONE_KEYS},
+    {key: -50 for key in TONE_KEYS},
+])
+def test_tone_curve_matches_float_chain(image, filter_data):
+    expected = np.asarray(reference_tone_chain(image, filter_data), dtype=np.int16)
+    actual = np.asarray(run_filter_pipeline(image, filter_data), dtype=np.int16)
+    assert np.abs(actual - expected).max() <= TOLERANCE
+
+
+def test_tone_curve_matches_float_chain_random_settings(image):
+    rng = np.random.default_rng(7)
+    for _ in range(50):
+        filter_data = random_settings(rng)
+        expected = np.asarray(reference_tone_chain(image, filter_data), dtype=np.int16)
+        actual = np.asarray(run_filter_pipeline(image, filter_data), dtype=np.int16)
+        assert np.abs(actual - expected).max() <= TOLERANCE, filter_data
+
+
+def test_no_tone_sliders_builds_no_table():
+    assert build_tone_lut({'saturation': 30}) is None
+    assert build_tone_lut({key: 0 for key in TONE_KEYS}) is None
@@ -0,0 +1,66 @@
+"""
+Cached, low-resolution vignette masks against the exact mask
+"""
+import cv2
+import numpy as np
+import pytest
+
+from processing.vignette import BASE_SIDE, VignetteMaskCache, build_vignette_mask
+
+
+def full_mask(mask, height):
+    out = np.empty((height, mask.width), dtype=np.float32)
+    for top in range(0, height, 100):
+        bottom = min(height, top + 100)
+        mask.rows(top, bottom, out[top:bottom])
+    return out
+
+
+@pytest.mark.parametrize('width, height', [(300, 200), (1600, 1200), (1200, 1600), (3000, 700)])
+def test_resized_mask_is_within_one_level(width, height):
+    mask = full_mask(VignetteMaskCache().get(width, height, 80), height)
+    exact = build_vignette_mask(width, height, 80)
+    # A factor error of 1/255 changes a white pixel by less than one level
+    assert np.abs(mask - exact).max() * 255 < 1
+
+
+def test_small_images_get_the_exact_mask():
+    mask = full_mask(VignetteMaskCache().get(BASE_SIDE, 300, 50), 300)
+    assert np.array_equal(mask, build_vignette_mask(BASE_SIDE, 300, 50))
+
+
+def test_similar_aspect_ratios_share_a_base():
+    cache = VignetteMaskCache()
+    cache.get(4000, 3000, 60)
+    cache.get(4004, 3002, 60)
+    cache.get(2000, 1500, 60)
+    assert cache.stats()['built'] == 1
+    assert cache.stats()['hits'] == 2
+    cache.get(4000, 3000, 61)
+    assert cache.stats()['built'] == 2
+
+
+def test_cache_stays_within_its_budget():
+    one_base = build_vignette_mask(BASE_SIDE, BASE_SIDE // 2, 50).nbytes
+    cache = VignetteMaskCache(max_bytes=2 * one_base)
+    for strength in (10, 20, 30):
+        cache.get(2000, 1000, strength)
+    stats = cache.stats()
+    assert stats['bases'] == 2
+    assert stats['cached_bytes'] <= 2 * one_base
+    # The least recently used base was dropped
+    cache.get(2000, 1000, 10)
+    assert cache.stats()['built'] == 4
+
+
+def test_row_blocks_match_resizing_the_whole_base():
+    cache = VignetteMaskCache()
+    mask = cache.get(2400, 1800, 70)
+    base = cache._base(2400, 1800, 70.0)
+    expected = cv2.resize(base, (2400, 1800), interpolation=cv2.INTER_LINEAR)
+    assert np.allclose(full_mask(mask, 1800), expected, atol=1e-6)
+
+
+def test_mask_does_not_hold_a_full_size_mask():
+    mask = VignetteMaskCache().get(6000, 4000, 70)
+    assert mask.nbytes <= BASE_SIDE * 6000 * 4